@@ -0,0 +1,90 @@
+import collections
+import threading
+import time
+from Metrics import metrics
+
+ADMITTED = metrics.counter("admission_admitted")  # connections that got a session slot at once
+QUEUED = metrics.counter("admission_queued")  # connections that had to wait in the pending queue for one
+REJECTED_FULL = metrics.counter("admission_rejected_full")  # every slot busy and the pending queue full
+REJECTED_PER_IP = metrics.counter("admission_rejected_per_ip")  # the address already had its limit of connections
+PENDING = metrics.gauge("admission_pending")
+PENDING_WAIT = metrics.histogram("admission_wait")  # how long a queued connection waited for its slot
+
+
+class AdmissionController:
+    """
+    Decides which accepted connections may play, so a burst of clients or many slow ones push back on the accept
+    loop instead of piling up threads and memory. At most max_sessions connections play at once, up to max_pending
+    more wait in a FIFO queue for a slot to free up, and anything beyond that is rejected at once, before we read a
+    single byte of it. One address may hold at most max_per_ip connections, playing or waiting.
+    Under load the timeouts shrink (see timeout), so slow clients give their slots back sooner.
+    Every limit is off when it is 0.
+    :parameter min_timeout_fraction: the fraction of a timeout that is left when every slot is busy
+    """
+
+    def __init__(self, max_sessions=0, max_pending=0, max_per_ip=0, min_timeout_fraction=0.25):
+        self.max_sessions = max_sessions
+        self.max_pending = max_pending
+        self.max_per_ip = max_per_ip
+        self.min_timeout_fraction = min_timeout_fraction
+        self.active = 0  # connections holding a slot
+        self.pending = collections.deque()  # (start, queued at) of the connections waiting for a slot
+        self.per_ip = {}  # address -> its connections, playing or waiting
+        self.lock = threading.Lock()
+
+    def submit(self, ip, start):
+        """
+        Asks for a slot for a connection from ip. start() is called once the connection may play: right here when
+        a slot is free, later from release() when it had to wait in the pending queue.
+        Returns False when the connection is rejected, the caller then closes it. Every accepted connection must
+        call release(ip) once it is done.
+        """
+        with self.lock:
+            connections = self.per_ip.get(ip, 0)
+            if self.max_per_ip and connections >= self.max_per_ip:
+                REJECTED_PER_IP.inc()
+                return False
+            if self.max_sessions and self.active >= self.max_sessions:
+                if len(self.pending) >= self.max_pending:
+                    REJECTED_FULL.inc()
+                    return False
+                self.pending.append((start, time.perf_counter()))
+                self.per_ip[ip] = connections + 1
+                QUEUED.inc()
+                PENDING.inc()
+                return True
+            self.active += 1
+            self.per_ip[ip] = connections + 1
+        ADMITTED.inc()
+        start()
+        return True
+
+    def release(self, ip):
+        """A connection of ip is done, its slot goes to the connection that waited longest."""
+        with self.lock:
+            connections = self.per_ip.get(ip, 0) - 1
+            if connections > 0:
+                self.per_ip[ip] = connections
+            else:
+                self.per_ip.pop(ip, None)
+            if not self.pending:
+                self.active -= 1
+                return
+            start, queued_at = self.pending.popleft()  # the slot passes on, so active stays the same
+            PENDING.dec()
+        PENDING_WAIT.observe(time.perf_counter() - queued_at)
+        start()
+
+    def timeout(self, seconds):
+        """
+        seconds scaled to the current load: unchanged while at most half of max_sessions play, then shrinking
+        linearly down to min_timeout_fraction of it once every slot is busy, or as soon as anyone waits for one.
+        """
+        if not self.max_sessions:
+            return seconds
+        if self.pending:
+            return seconds * self.min_timeout_fraction
+        load = self.active / self.max_sessions
+        if load <= 0.5:
+            return seconds
+        return seconds * max(self.min_timeout_fraction, 1 - (load - 0.5) * 2 * (1 - self.min_timeout_fraction))
@@ -0,0 +1,192 @@
+import argparse
+import json
+import multiprocessing
+import platform
+import random
+import subprocess
+import sys
+import time
+from BotClient import LoadGenerator, stand_at
+from Deck import Deck, get_card_value, CARDS
+from EventLog import EventLog, OFF
+from Protocol import HIT_PAYLOAD, STAND_PAYLOAD
+from ProtocolBenchmark import codec_benchmarks, reader_benchmarks, ns_per_op
+from Server import Server
+from ServerGameSession import ServerGameSession, SEND
+from Shuffling import make_rng
+
+# every result name ends with its unit, the unit says which direction is better
+LOWER_IS_BETTER = ("_ns", "_ms")
+HIGHER_IS_BETTER = ("_per_sec",)
+QUIET = EventLog(OFF)
+
+
+def micro_benchmarks(number):
+    """Protocol codec, socket reader and Deck costs, in ns per operation."""
+    results = {}
+    # only the current codec, ProtocolBenchmark also measures the legacy one for comparison
+    for name, ns in {**codec_benchmarks(number), **reader_benchmarks(number // 2)}.items():
+        if name.endswith(" (after)"):
+            # "read + unpack_client_payload (after)" -> read_unpack_client_payload_ns
+            results[name[:-len(" (after)")].replace(" + ", "_").split(" ")[0].replace(".", "_") + "_ns"] = ns
+    random.seed(0)
+    deck = Deck()
+    six_decks = Deck(6)
+    card = CARDS[40]
+
+    def deal_shoe():
+        deck.shuffle()
+        while deck.deal_code() is not None:
+            pass
+
+    results['deck_new_ns'] = ns_per_op(Deck, number // 10)
+    results['deck_shuffle_ns'] = ns_per_op(deck.shuffle, number // 10)
+    results['deck_shuffle_6_decks_ns'] = ns_per_op(six_decks.shuffle, number // 50)
+    results['deck_deal_52_ns'] = ns_per_op(deal_shoe, number // 50)
+    results['get_card_value_ns'] = ns_per_op(lambda: get_card_value(card), number)
+    # every generator on a 6 deck shoe, pcg only when numpy is there
+    for kind in ("mt", "pcg", "secure"):
+        try:
+            shoe = Deck(6, rng=make_rng(kind, 0))
+        except ValueError:
+            continue
+        results[f'shuffle_{kind}_6_decks_ns'] = ns_per_op(shoe.shuffle, number // 50)
+    return results
+
+
+def session_logic_benchmark(sessions=40, rounds=255):
+    """
+    Rounds per second of the ServerGameSession rules alone: the round steps are driven in process without a socket,
+    the decisions come from a stand on 17 player. Seeded, so every run plays the same hands.
+    """
+    played = 0
+    started = time.perf_counter()
+    for seed in range(sessions):
+        game = ServerGameSession(None, rounds, "bench", "bench", log=QUIET, seed=seed)
+        steps = game._game()
+        reply = None
+        while True:
+            try:
+                op = steps.send(reply)
+            except StopIteration:
+                break
+            reply = None if op[0] == SEND else (HIT_PAYLOAD if game.client_hand.total < 17 else STAND_PAYLOAD)
+        played += game.rounds_played
+    return {'session_logic_rounds_per_sec': played / (time.perf_counter() - started)}
+
+
+def serve(mode, ports, options):
+    """Entry point of the server process of the loopback benchmarks."""
+    server = Server(broadcast=False, log=QUIET, **options)
+    ports.put(server.tcp_port)
+    server.start(mode)
+
+
+def loopback_benchmark(mode, sessions, concurrency, rounds, pipeline=False, options=None, keep_alive=False):
+    """
+    Runs a Server in its own process (so it does not share our GIL) and plays bot sessions against it over loopback.
+    Returns the LoadGenerator report.
+    """
+    context = multiprocessing.get_context("fork")
+    ports = context.Queue()
+    process = context.Process(target=serve, args=(mode, ports, options or {}), daemon=True)
+    process.start()
+    try:
+        port = ports.get(timeout=10)
+        load = LoadGenerator("127.0.0.1", port, sessions, concurrency, rounds, stand_at(17), pipeline, keep_alive)
+        return load.run()
+    finally:
+        process.terminate()
+        process.join()
+
+
+def end_to_end_benchmarks(modes, sessions, concurrency, rounds):
+    """A single session and many concurrent sessions against the server in every mode."""
+    results = {}
+    for mode in modes:
+        single = loopback_benchmark(mode, 1, 1, 255)
+        results[f'{mode}_single_session_rounds_per_sec'] = single['rounds_per_sec']
+        results[f'{mode}_single_session_p50_ms'] = single['p50_ms']
+        load = loopback_benchmark(mode, sessions, concurrency, rounds)
+        results[f'{mode}_concurrent_rounds_per_sec'] = load['rounds_per_sec']
+        results[f'{mode}_concurrent_sessions_per_sec'] = load['sessions_per_sec']
+        for name in ('p50_ms', 'p95_ms', 'p99_ms'):
+            results[f'{mode}_concurrent_{name}'] = load[name]
+        # the same load with every bot keeping its connection alive between sessions
+        reused = loopback_benchmark(mode, sessions, concurrency, rounds, keep_alive=True)
+        results[f'{mode}_keep_alive_sessions_per_sec'] = reused['sessions_per_sec']
+        for report in (load, reused):
+            if report['errors']:
+                print(f"warning: {report['errors']} sessions failed in {mode} mode", file=sys.stderr)
+    return results
+
+
+def environment():
+    """What the results were measured on, a baseline is only comparable on the same machine and Python."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {'python': platform.python_version(), 'implementation': platform.python_implementation(),
+            'platform': platform.platform(), 'cpus': multiprocessing.cpu_count(), 'commit': commit,
+            'time': time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares results with a baseline's results.
+    Returns [(name, baseline value, value, change)] of every result that got worse by more than tolerance (0.1 = 10%).
+    """
+    regressions = []
+    for name, value in results.items():
+        old = baseline.get(name)
+        if not old:
+            continue
+        change = (value - old) / old
+        if name.endswith(LOWER_IS_BETTER) and change > tolerance:
+            regressions.append((name, old, value, change))
+        elif name.endswith(HIGHER_IS_BETTER) and -change > tolerance:
+            regressions.append((name, old, value, change))
+    return regressions
+
+
+def display_results(results, baseline=None):
+    """Display every result, with its change against the baseline when there is one."""
+    for name, value in results.items():
+        old = (baseline or {}).get(name)
+        change = f"  ({(value - old) / old * 100:+.1f}%)" if old else ""
+        print(f"{name:<44} {value:14.2f}{change}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Black Jack benchmark suite, everything runs on loopback")
+    parser.add_argument("--output", default=None, help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="JSON file of an earlier run to flag regressions against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed slowdown before it is a regression")
+    parser.add_argument("--quick", action="store_true", help="smaller runs, for a fast sanity check")
+    parser.add_argument("--modes", nargs="+", default=["threads", "asyncio", "selectors"],
+                        choices=["threads", "asyncio", "selectors"])
+    parser.add_argument("--skip-end-to-end", action="store_true", help="only the in process benchmarks")
+    args = parser.parse_args()
+
+    number = 20_000 if args.quick else 200_000
+    results = micro_benchmarks(number)
+    results.update(session_logic_benchmark(5 if args.quick else 40))
+    if not args.skip_end_to_end:
+        sessions, concurrency = (200, 100) if args.quick else (2000, 500)
+        results.update(end_to_end_benchmarks(args.modes, sessions, concurrency, 10))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)['results']
+    display_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'environment': environment(), 'results': results}, file, indent=2)
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for name, old, value, change in regressions:
+            print(f"REGRESSION {name}: {old:.2f} -> {value:.2f} ({change * 100:+.1f}%)")
+        sys.exit(1 if regressions else 0)
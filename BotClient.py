@@ -0,0 +1,322 @@
+import argparse
+import asyncio
+import time
+from Protocol import (request_Message, unpack_server_payload, unpack_table_result, pack_Client_Payload, pack_hit_until,
+                      FLAG_PIPELINE, FLAG_KEEP_ALIVE, FLAG_TABLE_RESULTS, MAX_INVALID_FRAMES)
+from ClientGameSession import Phase
+from Deck import CARD_VALUE
+from Hand import add_card
+from ShoeTracker import ShoeTracker
+from StrategyTables import get_tables
+
+
+def stand_at(threshold):
+    """Strategy callback that hits while the bot's sum is below threshold."""
+    def strategy(total, soft, up):
+        return "Hit" if total < threshold else "Stand"
+    return strategy
+
+
+def basic_strategy(total, soft, up):
+    """Strategy callback that plays the precomputed best decision of StrategyTables."""
+    return get_tables().decision(total, soft, up)
+
+
+def policy_strategy(path, rank=0):
+    """Strategy callback of a policy in the ranked table StrategyOptimizer wrote, rank 0 is the best one."""
+    from StrategyOptimizer import load_ranking  # the optimizer needs numpy, the bots do not otherwise
+    stand_at = load_ranking(path)[rank]['stand_at']
+
+    def strategy(total, soft, up):
+        return "Hit" if total < stand_at[up] else "Stand"
+    return strategy
+
+
+def counting_strategy(tracker):
+    """Strategy callback that plays the best decision for the composition of the shoe tracker has seen."""
+    return tracker.decision
+
+
+def card_value(rank, suit):
+    """Value of a card received from the server, looked up in the Deck tables."""
+    return CARD_VALUE[(rank - 1) * 4 + suit]
+
+
+class BotSession:
+    """
+    Non interactive version of ClientGameSession: it follows the same phases but asks a strategy callback
+    (total, soft, dealer up card value) -> "Hit" / "Stand" instead of input(), and prints nothing.
+    """
+
+    def __init__(self, strategy, rounds, client_name="Just_One_More_Hit", latencies=None, pipeline=False,
+                 keep_alive=False, tracker=None, table_results=None):
+        """
+        :parameter latencies: list that gets the seconds between every decision we send and the server's answer
+        :parameter pipeline: negotiate FLAG_PIPELINE and send one "hit until" decision per round instead of one per card,
+            this assumes the strategy keeps standing once it stood on a lower total
+        :parameter keep_alive: negotiate FLAG_KEEP_ALIVE, the connection stays open for another game after ours
+        :parameter tracker: ShoeTracker that gets to see every card the server sends us
+        :parameter table_results: list that gets (result, seat number, seats) of the other seats at our table, giving
+            one negotiates FLAG_TABLE_RESULTS
+        """
+        self.strategy = strategy
+        self.rounds = rounds
+        self.client_name = client_name
+        self.latencies = latencies if latencies is not None else []
+        self.pipeline = pipeline
+        self.keep_alive = keep_alive
+        self.tracker = tracker
+        self.table_results = table_results
+        self.stats = {'wins': 0, 'losses': 0, 'ties': 0}
+        self.rounds_played = 0
+
+    async def play(self, reader, writer, timeout=12.0):
+        """Plays all the rounds over an open connection."""
+        flags = ((FLAG_PIPELINE if self.pipeline else 0) | (FLAG_KEEP_ALIVE if self.keep_alive else 0) |
+                 (FLAG_TABLE_RESULTS if self.table_results is not None else 0))
+        writer.write(request_Message(self.rounds, self.client_name, flags))
+        phase = Phase.P_INIT
+        my_cards = 0
+        total = soft = up = 0
+        hit_until = None  # threshold of the pipelined decision of this round
+        sent_at = None
+        tracker = self.tracker
+        invalid = 0  # invalid frames in a row
+        while self.rounds_played < self.rounds:
+            frame = await asyncio.wait_for(reader.readexactly(9), timeout)
+            parsed = unpack_server_payload(frame)
+            if sent_at is not None:
+                self.latencies.append(time.perf_counter() - sent_at)
+                sent_at = None
+            if not parsed and self.table_results is not None:
+                # another seat's result, they arrive between our rounds
+                parsed = unpack_table_result(frame)
+                if parsed:
+                    self.table_results.append(parsed)
+                    invalid = 0
+                    continue
+            if not parsed:
+                invalid += 1
+                if invalid >= MAX_INVALID_FRAMES:
+                    raise ConnectionError(f"{invalid} invalid frames in a row")
+                continue
+            invalid = 0
+            result, rank, suit = parsed
+            if tracker is not None:
+                if phase == Phase.P_INIT and not my_cards:
+                    tracker.start_round()
+                tracker.see(rank, suit)
+            if result != 0:
+                if tracker is not None and phase == Phase.P_TURN:
+                    tracker.skip()  # we busted, so the dealer's hidden card was never shown to us
+                self._update_stats(result)
+                phase = Phase.P_INIT
+                my_cards = total = soft = 0
+                hit_until = None
+                continue
+            value = card_value(rank, suit)
+            if phase in (Phase.P_INIT, Phase.P_TURN):
+                total, soft = add_card(total, soft, value)
+                my_cards += 1
+                if phase == Phase.P_INIT:
+                    if my_cards == 2:
+                        phase = Phase.D_UP
+                    continue
+                if hit_until is not None:
+                    # the server plays our hand out by itself, once we reach the threshold the dealer's cards follow
+                    if total >= hit_until:
+                        phase = Phase.D_TURN
+                    continue
+            elif phase == Phase.D_UP:
+                up = value
+            else:  # Phase.D_TURN, the dealer reveals his cards until the round result arrives
+                continue
+            if self.pipeline:
+                hit_until = total
+                while hit_until <= 21 and self.strategy(hit_until, soft > 0, up) == "Hit":
+                    hit_until += 1
+                decision = "Hit" if hit_until > total else "Stand"
+                writer.write(pack_hit_until(hit_until) if decision == "Hit" else pack_Client_Payload("Stand"))
+            else:
+                decision = self.strategy(total, soft > 0, up)
+                writer.write(pack_Client_Payload(decision))
+            sent_at = time.perf_counter()
+            phase = Phase.P_TURN if decision == "Hit" else Phase.D_TURN
+        return self.stats
+
+    def _update_stats(self, result):
+        """Update statistics based on round result."""
+        self.rounds_played += 1
+        if result == 1:
+            self.stats['ties'] += 1
+        elif result == 2:
+            self.stats['losses'] += 1
+        else:
+            self.stats['wins'] += 1
+
+
+class LoadGenerator:
+    """Opens many concurrent bot sessions against one server and measures how fast it serves them."""
+
+    def __init__(self, host, port, sessions, concurrency, rounds, strategy=basic_strategy, pipeline=False,
+                 keep_alive=False, shoe=None, tournament=False, timeout=12.0):
+        """
+        :parameter sessions: total sessions to play
+        :parameter concurrency: how many sessions are connected at the same time
+        :parameter rounds: rounds per session
+        :parameter pipeline: whether the bots use pipelined "hit until" decisions
+        :parameter keep_alive: whether every bot plays its sessions one after the other on one kept alive connection
+        :parameter shoe: (decks, penetration) of the server's shoe, every session then tracks it with a ShoeTracker
+            and plays by counting_strategy instead of strategy
+        :parameter tournament: every one of the sessions bots enters the server's tournament and plays its stages
+            (rounds each) on one connection until the server closes it, concurrency is ignored
+        :parameter timeout: seconds a bot waits for the server, a tournament bot also waits this long for the other
+            tables between stages
+        """
+        self.host = host
+        self.port = port
+        self.sessions = sessions
+        self.concurrency = concurrency
+        self.rounds = rounds
+        self.strategy = strategy
+        self.pipeline = pipeline
+        self.keep_alive = keep_alive
+        self.shoe = shoe
+        self.tournament = tournament
+        self.timeout = timeout
+        self.latencies = []
+        self.stats = {'wins': 0, 'losses': 0, 'ties': 0}
+        self.completed = 0
+        self.errors = 0
+
+    def run(self):
+        """Runs the whole load and returns the report."""
+        return asyncio.run(self.run_async())
+
+    async def run_async(self):
+        """Coroutine version of run."""
+        started = time.perf_counter()
+        if self.tournament:
+            await asyncio.gather(*(self._entrant(f"Bot_{number}") for number in range(1, self.sessions + 1)))
+            return self._report(time.perf_counter() - started)
+        pending = iter(range(self.sessions))
+        await asyncio.gather(*(self._worker(pending) for _ in range(min(self.concurrency, self.sessions))))
+        return self._report(time.perf_counter() - started)
+
+    async def _worker(self, pending):
+        """Plays sessions one after the other until there are none left to play."""
+        reader = writer = None
+        for _ in pending:
+            # a kept alive connection may have been closed by the server meanwhile (a table, an older server or the
+            # idle timeout), then we play the session again on a new connection
+            for retry in (False, True):
+                reused = writer is not None
+                if writer is None:
+                    try:
+                        reader, writer = await asyncio.open_connection(self.host, self.port)
+                    except OSError:
+                        self.errors += 1
+                        break
+                session = self._session(self.keep_alive)
+                try:
+                    stats = await session.play(reader, writer, self.timeout)
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    writer.close()
+                    writer = None
+                    if reused and not session.rounds_played and not retry:
+                        continue
+                    self.errors += 1
+                    break
+                for key in self.stats:
+                    self.stats[key] += stats[key]
+                self.completed += 1
+                if not self.keep_alive:
+                    writer.close()
+                    writer = None
+                break
+        if writer is not None:
+            writer.close()
+
+    async def _entrant(self, client_name):
+        """A tournament bot: plays one stage after the other on its connection until it is out or the tournament ended."""
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        except OSError:
+            self.errors += 1
+            return
+        try:
+            while True:
+                session = self._session(True, client_name)
+                try:
+                    stats = await session.play(reader, writer, self.timeout)
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    # the server closes the connection of whoever is out between two stages
+                    if session.rounds_played:
+                        self.errors += 1
+                    return
+                for key in self.stats:
+                    self.stats[key] += stats[key]
+                self.completed += 1
+        finally:
+            writer.close()
+
+    def _session(self, keep_alive, client_name="Just_One_More_Hit"):
+        """A BotSession for the next game."""
+        # every game starts on a new shoe, a kept alive connection too (see ServerGameSession.reset)
+        tracker = ShoeTracker(*self.shoe) if self.shoe else None
+        strategy = counting_strategy(tracker) if tracker else self.strategy
+        return BotSession(strategy, self.rounds, client_name, self.latencies, self.pipeline, keep_alive, tracker)
+
+    def _report(self, elapsed):
+        """Throughput and decision round-trip percentiles of the run."""
+        rounds = sum(self.stats.values())
+        latencies = sorted(self.latencies)
+        report = {'sessions': self.completed, 'errors': self.errors, 'rounds': rounds, 'seconds': elapsed,
+                  'sessions_per_sec': self.completed / elapsed, 'rounds_per_sec': rounds / elapsed,
+                  'decisions': len(latencies)}
+        for name, quantile in (('p50_ms', 0.50), ('p95_ms', 0.95), ('p99_ms', 0.99)):
+            report[name] = latencies[min(len(latencies) - 1, int(quantile * len(latencies)))] * 1000 if latencies else 0.0
+        report.update(self.stats)
+        return report
+
+
+def display_report(report):
+    """Display the report of a load run."""
+    print(f"\n{'=' * 50}")
+    print(f"{report['sessions']} sessions ({report['errors']} errors), {report['rounds']} rounds "
+          f"in {report['seconds']:.2f}s")
+    print(f"{report['sessions_per_sec']:.1f} sessions/sec, {report['rounds_per_sec']:.1f} rounds/sec")
+    print(f"decision round-trip over {report['decisions']} decisions: p50 {report['p50_ms']:.2f}ms, "
+          f"p95 {report['p95_ms']:.2f}ms, p99 {report['p99_ms']:.2f}ms")
+    print(f"{'=' * 50}\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Black Jack load generating bot client")
+    parser.add_argument("host")
+    parser.add_argument("port", type=int)
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=10, help="rounds per session (1..65535)")
+    parser.add_argument("--stand-at", type=int, default=None,
+                        help="hit below this sum instead of playing the basic strategy")
+    parser.add_argument("--policy", default=None, help="play a policy of this ranked table of StrategyOptimizer")
+    parser.add_argument("--policy-rank", type=int, default=0, help="which policy of --policy, 0 is the best")
+    parser.add_argument("--pipeline", action="store_true", help="send one pipelined decision per round")
+    parser.add_argument("--keep-alive", action="store_true",
+                        help="play every bot's sessions on one connection instead of connecting for each")
+    parser.add_argument("--count", type=int, default=None, metavar="DECKS",
+                        help="track the server's shoe of this many decks and play by its composition")
+    parser.add_argument("--penetration", type=float, default=0.0, help="the server's penetration, used with --count")
+    parser.add_argument("--tournament", action="store_true",
+                        help="every one of --sessions bots enters the server's tournament, --rounds must be its "
+                             "--stage-rounds")
+    parser.add_argument("--timeout", type=float, default=12.0, help="seconds to wait for the server")
+    args = parser.parse_args()
+    if args.policy:
+        strategy = policy_strategy(args.policy, args.policy_rank)
+    else:
+        strategy = basic_strategy if args.stand_at is None else stand_at(args.stand_at)
+    shoe = None if args.count is None else (args.count, args.penetration)
+    display_report(LoadGenerator(args.host, args.port, args.sessions, args.concurrency, args.rounds, strategy,
+                                 args.pipeline, args.keep_alive, shoe, args.tournament, args.timeout).run())
@@ -1,47 +1,39 @@
+import argparse
 import socket
-from Protocol import unpack_offer
+import time
 from ClientGameSession import ClientGameSession
-
-
-UDP_PORT = 13122
+from Discovery import Discovery, UDP_PORT
+from StatsStore import StatsStore
 
 
 class Client:
     """Handles network discovery and connection to the server."""
 
-    def __init__(self):
+    def __init__(self, stats_db="client_stats.db", interfaces=None):
+        """
+        :parameter interfaces: local addresses to hear offers on, by default our network address and loopback
+            (so a server on this machine can be found with Server --offer-to 127.0.0.1)
+        """
         self.server_ip = None
         self.server_port = None
+        # our lifetime results against every server we played, kept across games and restarts
+        self.stats_store = StatsStore(stats_db) if stats_db else None
+        # we get our actual IP address to make sure we listen on broadcasts in our network and not virtual machine
+        if interfaces is None:
+            interfaces = [self.get_local_ip(), "127.0.0.1"]
+        # keeps listening between games, so we know the live servers the moment we want to play again
+        self.discovery = Discovery(interfaces, UDP_PORT)
+        self.discovery.start()
 
-    def listen_for_offers(self):
+    def find_servers(self):
         """
-        Listen for a server offer to play black jack.
+        Returns the live servers, the fastest to connect first, waiting for the first offer if we know of none yet.
         """
-        print("Client started, listening for offer requests...")
-        # we create our socket, since its UDP socket we dont need any connection setup
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        # in case of crashes this allows me to reuse the port, without it if i restart the program quicly i could get errors.
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        # we get our actual IP address to make sure we listen on broadcasts in our network and not virtual machine
-        local_ip = self.get_local_ip()
-        sock.bind((local_ip, UDP_PORT))
-
-        try:
-            while True:
-                # the buffer size is exactly 39 bytes becuase we know that the offer message is supposed to be 39
-                # bytes long.
-                data, addr = sock.recvfrom(39)
-                server_tcp_port, server_name = unpack_offer(data)
-                if server_tcp_port and server_name:
-                    self.server_ip = addr[0]
-                    self.server_port = server_tcp_port
-                    print(f"Received offer from {self.server_ip}, attempting to connect...")
-                    sock.close()
-                    return server_name
-                else:
-                    print("Received invalid packet, ignoring...")
-        finally:
-            sock.close()
+        servers = self.discovery.live_servers()
+        if not servers:
+            print("Client started, listening for offer requests...")
+            servers = self.discovery.wait_for_servers()
+        return servers
 
     def get_local_ip(self):
         """returns the local IP address."""
@@ -57,17 +49,44 @@ class Client:
         except:
             return "127.0.0.1"
 
-    def connect_and_play(self,server_name):
+    def connect(self):
+        """
+        Connects to the live server with the lowest connect latency, trying the next one if it fails.
+        Returns (socket, server name), or (None, None) if none of them answered.
+        """
+        for server in self.find_servers():
+            print(f"Received offer from {server.name} at {server.ip}, attempting to connect...")
+            tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # to prevent any connections issues we wait up to 12 seconds to connect. in case we dont we give up and try the next server.
+            tcp_sock.settimeout(12.0)
+            started = time.perf_counter()
+            try:
+                tcp_sock.connect(server.address)
+            except OSError as e:
+                print(f"Could not connect to {server.ip}:{server.port}: {e}")
+                tcp_sock.close()
+                self.discovery.forget(server)
+                continue
+            self.discovery.record_latency(server, time.perf_counter() - started)
+            self.server_ip, self.server_port = server.address
+            return tcp_sock, server.name
+        return None, None
+
+    def connect_and_play(self):
         """Establishes TCP connection and runs the black jack game session."""
         tcp_sock = None
         try:
-            tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            # to prevent any connections issues we wait up to 12 seconds to connect. in case we dont we give up and look for offers agim.
-            tcp_sock.settimeout(12.0)
-            tcp_sock.connect((self.server_ip, self.server_port))
+            tcp_sock, server_name = self.connect()
+            if tcp_sock is None:
+                return
             print(f'Connected to {self.server_ip}:{self.server_port}\n')
-            game_session = ClientGameSession(tcp_sock,server_name)
+            game_session = ClientGameSession(tcp_sock,server_name,
+                                             self.stats_store.record if self.stats_store else None)
             game_session.play()
+            if self.stats_store:
+                lifetime = self.stats_store.player(server_name)
+                print(f"Lifetime against {server_name}: {lifetime['wins']} wins, {lifetime['losses']} losses, "
+                      f"{lifetime['ties']} ties\n")
         except Exception as e:
             print(f"Client error: {e}")
         finally:
@@ -79,7 +98,11 @@ class Client:
 
 
 if __name__ == "__main__":
-    client = Client()
+    parser = argparse.ArgumentParser(description="Black Jack client")
+    parser.add_argument("--interface", action="append", default=None,
+                        help="local address to hear offers on, may be given several times, \"\" listens on all")
+    parser.add_argument("--stats-db", default="client_stats.db", help="SQLite file of our lifetime stats")
+    args = parser.parse_args()
+    client = Client(args.stats_db, args.interface)
     while True:
-        server_name =client.listen_for_offers()
-        client.connect_and_play(server_name)
\ No newline at end of file
+        client.connect_and_play()
\ No newline at end of file
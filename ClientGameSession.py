@@ -1,6 +1,8 @@
 import socket
-from Protocol import request_Message, unpack_server_payload, pack_Client_Payload, recv_exact
-from Deck import decode_card
+from Protocol import (request_Message, unpack_server_payload, pack_Client_Payload, recv_exact, MAX_ROUNDS,
+                      MAX_INVALID_FRAMES)
+from Deck import CARD_NAMES
+from Hand import Hand
 from enum import Enum
 
 
@@ -14,22 +16,25 @@ class Phase(Enum):
 class ClientGameSession:
     """Manages the gameplay logic for the client side."""
 
-    def __init__(self, tcp_socket, server_name):
+    def __init__(self, tcp_socket, server_name, on_round_end=None):
         self.tcp_socket = tcp_socket
         self.client_name = "Just_One_More_Hit"
         self.server_name = server_name
-        self.my_hand = []
-        self.dealer_hand = []
+        self.my_hand = Hand()
+        self.dealer_hand = Hand()
         self.phase = Phase.P_INIT
         self.stats = {'wins': 0, 'losses': 0, 'ties': 0}
         self.rounds_played = 0
         self.total_rounds = 0
+        # optional callable(server_name, result) to keep our results beyond this session (e.g. StatsStore.record)
+        self.on_round_end = on_round_end
 
     def play(self):
         """Main game loop."""
         self.total_rounds = self._get_rounds()
         self.tcp_socket.sendall(request_Message(self.total_rounds, self.client_name))
         print(f"\nStarting game for {self.total_rounds} rounds\n")
+        invalid = 0  # corrupt packets in a row
         while True:
             try:
                 # we set a 12 seconds timeout, if the server needs more than 12 seconds to send its payload message it probably means its disconnected or something
@@ -44,10 +49,15 @@ class ClientGameSession:
             # in case of a corrupt packet we make sure that the data is not "None"
             parsed = unpack_server_payload(data)
             if not parsed:
+                invalid += 1
+                if invalid >= MAX_INVALID_FRAMES:
+                    print("Server keeps sending corrupt packets. Returning to offer listening.")
+                    self.tcp_socket.close()
+                    return
                 continue
+            invalid = 0
             result, rank, suit = parsed
-            card = self._format_card(rank, suit)
-            self._handle_card_received(result, card)
+            self._handle_card_received(result, (rank - 1) * 4 + suit)
             # if result  != 0 aka result != 0x0 means the round is over, we update the statistics and reset the game for the next round
             if result != 0:
                 self._handle_round_end(result)
@@ -58,18 +68,18 @@ class ClientGameSession:
                     return
 
     def _handle_card_received(self, result, card):
-        """Process a card received from server based on current phase."""
+        """Process a card (its code, see Deck) received from server based on current phase."""
 
         # display who drew the card
         if self.phase in (Phase.P_INIT, Phase.P_TURN):
-            print(f'{self.client_name} drew {card}')
+            print(f'{self.client_name} drew {CARD_NAMES[card]}')
         else:
-            print(f'{self.server_name} drew {card}')
+            print(f'{self.server_name} drew {CARD_NAMES[card]}')
 
         # if round is ongoing (result == 0)
         if result == 0:
             if self.phase == Phase.P_INIT:
-                self.my_hand.append(card)
+                self.my_hand.add(card)
                 # since its client turn and its the start of the game, i check if the client already received 2 cards
                 # if yeah then its time for the dealer to receives his cards so i update the phase.
                 if len(self.my_hand) == 2:
@@ -77,7 +87,7 @@ class ClientGameSession:
             # behind the scenes ( check ServerGameSession ) dealer already received his 2 cards but in client part
             # we only show the first card the dealer got
             elif self.phase == Phase.D_UP:
-                self.dealer_hand.append(card)
+                self.dealer_hand.add(card)
                 self._display_hands(hide_dealer_second=True)
                 # after both client and dealer got their cards we ask the client if he wishes to stand or hit
                 decision = self._get_decision()
@@ -89,7 +99,7 @@ class ClientGameSession:
 
             # if client chose to Hit then we add the new card to his hand, display both his and dealer hands then ask for hit or stand again
             elif self.phase == Phase.P_TURN:
-                self.my_hand.append(card)
+                self.my_hand.add(card)
                 self._display_hands(hide_dealer_second=True)
                 decision = self._get_decision()
                 self._send_decision(decision)
@@ -98,31 +108,28 @@ class ClientGameSession:
                     print(f"\n--- Dealer's Turn ---")
             # if client chose to stand then we show the dealer shows his hidden card and behind the scenes ( check ServerGameSession ) he receives another card.
             elif self.phase == Phase.D_TURN:
-                self.dealer_hand.append(card)
+                self.dealer_hand.add(card)
                 self._display_hands()
         else:  # a reminder that this 'else' belongs to the "if" that checks if the result is 0 meaning round isn't over.
             # since we got here means the dealer or the client busted ( or both of them are in between 17 and 21 )
             if self.phase in (Phase.P_INIT,Phase.P_TURN):  # if we are in client turn then the final card that ended the round belongs to the client
-                self.my_hand.append(card)
+                self.my_hand.add(card)
             else:  # else means it belongs to the dealer
-                self.dealer_hand.append(card)
+                self.dealer_hand.add(card)
 
     def _handle_round_end(self, result):
         """Handles end of round - update stats and display results."""
         self.rounds_played += 1
         self._update_stats(result)
+        if self.on_round_end:
+            self.on_round_end(self.server_name, result)
         self._display_round_end(result)
 
         # reset everything for the next round
-        self.my_hand = []
-        self.dealer_hand = []
+        self.my_hand.clear()
+        self.dealer_hand.clear()
         self.phase = Phase.P_INIT
 
-    def _format_card(self, rank, suit):
-        """Convert rank and suit to readable card string."""
-        card_suit, card_rank = decode_card(rank, suit)
-        return f"{card_rank} of {card_suit}"
-
     def _send_decision(self, decision):
         """Send player's decision to server."""
         action = "Hittt" if decision == "1" else "Stand"
@@ -131,10 +138,11 @@ class ClientGameSession:
     def _display_hands(self, hide_dealer_second=False):
         """Display current hands."""
         if hide_dealer_second and len(self.dealer_hand) > 1:
-            dealer_display = [self.dealer_hand[0], "[Hidden]"]
+            dealer_display = self.dealer_hand.names(1) + ["[Hidden]"]
         else:
-            dealer_display = self.dealer_hand
+            dealer_display = self.dealer_hand.names()
 
+        # the totals are kept by the Hand as the cards arrive, an ace counts as 11 while that does not bust us
         print(f'{self.client_name} hand: {self.my_hand}')
         print(f'{self.server_name} hand: {dealer_display}\n')
 
@@ -182,9 +190,9 @@ class ClientGameSession:
             rounds = input("How many rounds do you want to play?\n")
             try:
                 rounds = int(rounds)
-                if 1 <= rounds <= 255:
+                if 1 <= rounds <= MAX_ROUNDS:
                     return rounds
                 else:
-                    print("Please enter a number between 1 and 255.")
+                    print(f"Please enter a number between 1 and {MAX_ROUNDS}.")
             except ValueError:
                 print("Invalid number, please try again.")
\ No newline at end of file
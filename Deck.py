@@ -1,35 +1,80 @@
 import random
+from Shuffling import timed_shuffle
+
+
 class Deck:
     """
-    this class represents a deck of Black Jack cards.
-    :parameter None
-    :var deck: list of cards where each card is represented by a tuple of (int: suit, int rank)
-    returns deck of black jack cards
+    this class represents a shoe of Black Jack cards (one or more 52 card decks).
+    every card is stored as one byte code in 0..51, code = (rank - 1) * 4 + suit, and the tables at the bottom of this
+    module turn a code into its suit, rank, value or display name without computing anything.
+    the shoe is allocated once and reused, dealing only moves a cursor forward.
+    :parameter decks: how many 52 card decks are in the shoe
+    :parameter penetration: fraction of the shoe dealt before the cut card asks for a reshuffle.
+        0 (the default) reshuffles before every round, like the old fresh deck per round.
+    :parameter rng: generator to shuffle with (see Shuffling.make_rng), a seeded one makes every shuffle reproducible.
+        defaults to the global random module
+    :parameter pool: Shuffling.ShoePool to take pre-shuffled shoes from, rng is only used when the pool is empty
+    :var cards: bytearray of card codes in dealing order
+    returns a shoe of black jack cards
     """
-    def __init__(self):
-        self.deck = [] # stores the 52 needed cards for the game
-        for value in range(1, 14):
-            for suit in range(0,4):
-                self.deck.append((suit, value))
-
+    def __init__(self, decks=1, penetration=0.0, rng=None, pool=None):
+        self.cards = bytearray(range(52)) * decks  # stores the 52 needed cards of every deck in the shoe
+        # index of the next card to deal, a new shoe counts as dealt out so it gets shuffled before the first round
+        self.position = len(self.cards)
+        # we always keep at least one full deck behind the cut card so a round never runs out of cards
+        self.cut = max(0, min(int(len(self.cards) * penetration), len(self.cards) - 52))
+        self.rng = rng or random
+        self.pool = pool
 
     def shuffle(self):
         """
-            this function shuffles the deck
+            this function shuffles the whole shoe in place and starts dealing from its top,
+            with a pool it swaps in a shoe that is shuffled already
         """
-        random.shuffle(self.deck)
+        if self.pool is not None:
+            cards = self.pool.take(self.cards)
+            if cards is not None:
+                self.cards = cards
+                self.position = 0
+                return
+        timed_shuffle(self.rng, self.cards)
+        self.position = 0
+
+    def reseed(self, rng):
+        """
+            this function starts the shoe over as if it was new and shuffled with rng, without allocating a new one:
+            the cards go back to their initial order so the same seed deals the same shoe again
+        """
+        self.cards[:] = bytes(range(52)) * (len(self.cards) // 52)
+        self.position = len(self.cards)
+        self.rng = rng
+
+    def needs_shuffle(self):
+        """returns True once the cut card was reached and the shoe should be shuffled before the next round."""
+        return self.position >= self.cut
+
+    def deal_code(self):
+        """
+        this function deals the next card and returns its code, or None if the shoe is empty
+        """
+        if self.position >= len(self.cards):
+            return None
+        code = self.cards[self.position]
+        self.position += 1
+        return code
 
     def deal(self):
         """"
-        this function removes the top card from the deck and returns it
+        this function deals the next card and returns it as a (suit, rank) tuple
         """
-        if len(self.deck) == 0:
+        code = self.deal_code()
+        if code is None:
             return None
-        return self.deck.pop()
+        return CARDS[code]
 
 def get_card_value(card):
     """"
-    this function returns the value of a card
+    this function returns the value of a card, an ace is 11 here and a Hand counts it as 1 when 11 would bust it
     :parameter card: card that has a suit and a rank
      returns value of the card
     """
@@ -52,3 +97,11 @@ def decode_card(rank,suit):
     else:
         mapped_rank = rank
     return suit_map[suit], mapped_rank
+
+
+# lookup tables indexed by card code, computed once when the module loads
+CARD_SUIT = bytes(code % 4 for code in range(52))
+CARD_RANK = bytes(code // 4 + 1 for code in range(52))
+CARDS = tuple((CARD_SUIT[code], CARD_RANK[code]) for code in range(52))  # the (suit, rank) tuple of every code
+CARD_VALUE = bytes(get_card_value(card) for card in CARDS)
+CARD_NAMES = tuple("{1} of {0}".format(*decode_card(card[1], card[0])) for card in CARDS)
@@ -0,0 +1,148 @@
+import selectors
+import socket
+import threading
+import time
+from Metrics import metrics
+from Protocol import unpack_offer, OFFER_STRUCT
+
+# the port servers broadcast their offers to
+UDP_PORT = 13122
+# a server offers every second, one that missed this many seconds of offers is gone
+DEFAULT_EXPIRY = 3.5
+# weight of the newest connect time in a server's latency average
+LATENCY_WEIGHT = 0.3
+
+INVALID_OFFERS = metrics.counter("invalid_offers")  # packets on the offer port that are not an offer
+
+
+class ServerOffer:
+    """One server we heard offers from."""
+    __slots__ = ('ip', 'port', 'name', 'last_seen', 'latency')
+
+    def __init__(self, ip, port, name, last_seen):
+        self.ip = ip
+        self.port = port
+        self.name = name
+        self.last_seen = last_seen
+        self.latency = None  # average seconds a connect took, None until we connected once
+
+    @property
+    def address(self):
+        return self.ip, self.port
+
+
+class Discovery:
+    """
+    Listens for server offers in the background and keeps every live server in a cache, so the client can connect
+    the moment it wants to play instead of waiting for the next broadcast. A server whose offers stop for expiry
+    seconds drops out of the cache. Servers are ranked by their measured connect latency (see record_latency).
+    :parameter interfaces: local addresses to listen on, one socket each ("" listens on all of them)
+    :parameter port: UDP port the offers arrive on
+    :parameter expiry: seconds without an offer before a server is forgotten
+    """
+
+    def __init__(self, interfaces=("",), port=UDP_PORT, expiry=DEFAULT_EXPIRY):
+        self.port = port
+        self.expiry = expiry
+        self.servers = {}  # (ip, tcp port) -> ServerOffer
+        self.lock = threading.Lock()
+        self.offered = threading.Condition(self.lock)  # notified on every valid offer
+        self.selector = selectors.DefaultSelector()
+        self.sockets = []
+        for interface in dict.fromkeys(interfaces):  # the same address twice would just fail to bind
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            # in case of crashes this allows me to reuse the port, it also lets several clients share it.
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((interface, port))
+            sock.setblocking(False)
+            self.selector.register(sock, selectors.EVENT_READ)
+            self.sockets.append(sock)
+        self.thread = None
+        self.closed = False
+
+    def start(self):
+        """Starts listening in the background."""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._listen, daemon=True)
+            self.thread.start()
+
+    def _listen(self):
+        """Background thread: reads offers from every socket and refreshes the cache."""
+        while not self.closed:
+            for key, _ in self.selector.select(0.5):
+                try:
+                    while True:
+                        # a bigger buffer than an offer, so an oversized packet fails unpack_offer instead of being cut
+                        data, addr = key.fileobj.recvfrom(OFFER_STRUCT.size * 2)
+                        self._offer(data, addr[0])
+                except (BlockingIOError, ConnectionError):
+                    pass
+
+    def _offer(self, data, ip):
+        """Caches the server of one offer packet, invalid packets are ignored."""
+        server_tcp_port, server_name = unpack_offer(data)
+        if not server_tcp_port or not server_name:
+            INVALID_OFFERS.inc()
+            return
+        now = time.monotonic()
+        with self.lock:
+            server = self.servers.get((ip, server_tcp_port))
+            if server is None:
+                self.servers[ip, server_tcp_port] = ServerOffer(ip, server_tcp_port, server_name, now)
+            else:
+                server.name = server_name
+                server.last_seen = now
+            self.offered.notify_all()
+
+    def live_servers(self):
+        """
+        Every server that offered within the expiry, the fastest to connect first.
+        The ones we never connected to come before all others, so each gets measured once.
+        """
+        with self.lock:
+            self._expire()
+            servers = list(self.servers.values())
+        servers.sort(key=lambda server: -1.0 if server.latency is None else server.latency)
+        return servers
+
+    def wait_for_servers(self, timeout=None):
+        """Like live_servers, but first waits up to timeout seconds (None forever) while there are none."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.lock:
+            self._expire()
+            while not self.servers:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self.offered.wait(remaining)
+                self._expire()
+        return self.live_servers()
+
+    def record_latency(self, server, seconds):
+        """Adds one connect time of server to its average."""
+        with self.lock:
+            if server.latency is None:
+                server.latency = seconds
+            else:
+                server.latency += LATENCY_WEIGHT * (seconds - server.latency)
+
+    def forget(self, server):
+        """Drops a server we could not connect to, its next offer brings it back."""
+        with self.lock:
+            if self.servers.get(server.address) is server:
+                del self.servers[server.address]
+
+    def _expire(self):
+        """Drops the servers whose offers stopped, the lock must be held."""
+        oldest = time.monotonic() - self.expiry
+        for address in [address for address, server in self.servers.items() if server.last_seen < oldest]:
+            del self.servers[address]
+
+    def close(self):
+        """Stops listening and closes the sockets."""
+        self.closed = True
+        if self.thread is not None:
+            self.thread.join()
+        for sock in self.sockets:
+            sock.close()
+        self.selector.close()
@@ -0,0 +1,145 @@
+import atexit
+import json
+import queue
+import sys
+import threading
+import time
+
+# levels, same numbers as the logging module
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100  # above every level, nothing is logged
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR, "off": OFF}
+
+
+class EventLog:
+    """
+    Structured event log for the game hot path.
+    event() only checks the level and puts a tuple on a bounded queue, a background thread formats and writes it,
+    so game threads never wait on the stdout lock or on the disk. when the queue is full the event is dropped
+    and counted instead of blocking the game.
+    Every event has a name, a message template and fields, the template is only formatted by the writer thread.
+    :parameter level: lowest level written, OFF disables the log (no thread is ever started)
+    :parameter stream: where to write, defaults to stdout
+    :parameter fmt: "text" writes the formatted message only (the old console output), "json" writes one JSON object per line
+    :parameter queue_size: how many events may wait for the writer
+    """
+
+    def __init__(self, level=DEBUG, stream=None, fmt="text", queue_size=10000):
+        self.level = level
+        self.stream = stream or sys.stdout
+        self.fmt = fmt
+        self.dropped = 0
+        self.queue = queue.Queue(queue_size)
+        self.thread = None  # the writer starts with the first event
+        self.lock = threading.Lock()
+
+    def enabled_for(self, level):
+        """Whether events of this level are written, check it before building anything expensive to log."""
+        return level >= self.level
+
+    def event(self, level, name, message, **fields):
+        """
+        Logs one event.
+        :parameter name: short machine readable event name, e.g. "card_dealt"
+        :parameter message: str.format template filled from fields, e.g. "{player} drew {card}"
+        """
+        if level < self.level:
+            return
+        if self.thread is None:
+            self._start()
+        try:
+            self.queue.put_nowait((time.time(), level, name, message, fields))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout=5.0):
+        """Writes whatever is still queued and stops the writer thread."""
+        with self.lock:
+            if self.thread is not None:
+                self.queue.put(None)
+                self.thread.join(timeout)
+                self.thread = None
+
+    def _start(self):
+        """Starts the writer thread, once."""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._write_events, daemon=True)
+                self.thread.start()
+                # the writer is a daemon, so we make sure the last events still get written when the program exits
+                atexit.register(self.close)
+
+    def _write_events(self):
+        """Background writer: formats queued events and writes them, flushing whenever the queue runs empty."""
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    self.stream.flush()
+                    return
+                self.stream.write(self._format(*item))
+                if self.queue.empty():
+                    self.stream.flush()
+            except (OSError, ValueError):
+                self.dropped += 1  # a closed or broken stream must not kill the writer
+
+    def _format(self, timestamp, level, name, message, fields):
+        """One output line of an event."""
+        text = message.format(**fields) if fields else message
+        if self.fmt == "json":
+            record = {'ts': round(timestamp, 6), 'level': LEVEL_NAMES[level], 'event': name, 'msg': text}
+            record.update(fields)
+            return json.dumps(record, default=str) + "\n"
+        return text + "\n"
+
+
+class RateLimit:
+    """
+    Lets a recurring event (an invalid packet, a client that timed out) through to the log at most once per interval.
+    A flood of garbage then costs a clock read per packet instead of a queued and formatted line each, the event
+    that does go through carries how many were suppressed since the last one. Count the events in a metrics counter,
+    the log only samples them.
+    """
+    __slots__ = ('interval', 'next_at', 'suppressed')
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.next_at = 0.0
+        self.suppressed = 0
+
+    def event(self, log, level, name, message, **fields):
+        """Logs one event like EventLog.event, unless one already went through within the interval."""
+        if level < log.level:
+            return
+        now = time.monotonic()
+        if now < self.next_at:
+            self.suppressed += 1
+            return
+        self.next_at = now + self.interval
+        suppressed, self.suppressed = self.suppressed, 0
+        log.event(level, name, message, suppressed=suppressed, **fields)
+
+
+# the log sessions use when nobody gives them one, prints everything to stdout like the game always did
+default_log = EventLog()
+
+
+def add_log_arguments(parser):
+    """Adds the --log, --log-level and --log-file options to an argparse parser."""
+    parser.add_argument("--log", choices=["text", "json", "off"], default="text",
+                        help="text: the readable console output, json: one event per line, off: no logging at all")
+    parser.add_argument("--log-level", choices=["debug", "info", "warning", "error"], default="debug",
+                        help="debug logs every card, info only rounds and games")
+    parser.add_argument("--log-file", default=None, help="append the log to this file instead of stdout")
+
+
+def log_from_args(args):
+    """Builds the EventLog the options of add_log_arguments describe."""
+    if args.log == "off":
+        return EventLog(OFF)
+    stream = open(args.log_file, 'a', buffering=1 << 16) if args.log_file else None
+    return EventLog(LEVELS[args.log_level], stream, args.log)
@@ -0,0 +1,71 @@
+from Deck import CARD_NAMES, CARD_VALUE
+
+
+def add_card(total, soft, value):
+    """
+    Adds a card value (an ace is 11, see Deck.CARD_VALUE) to a hand, returns the new (total, soft).
+    soft counts the aces of the hand that still count as 11, whenever the hand would bust such an ace counts as 1
+    instead. Only arithmetic and comparisons, so total, soft and value may just as well be numpy arrays of
+    many hands, the Simulator plays whole batches through this same function.
+    """
+    total = total + value
+    soft = soft + (value == 11)
+    # an ace on a soft 21 makes two aces count as 11 at once, so we may have to demote twice
+    for _ in range(2):
+        demote = (total > 21) & (soft > 0)
+        total = total - 10 * demote
+        soft = soft - demote
+    return total, soft
+
+
+class Hand:
+    """
+    The cards of one player in a round, as card codes (see Deck), with its total kept up to date card by card:
+    adding a card is a constant amount of work however long the hand is.
+    :var total: best total of the hand, an ace counts as 11 while that does not bust it
+    :var soft: how many aces currently count as 11 (0 or 1 unless the hand busted)
+    :var blackjack: the first two cards make 21
+    :var busted: the total is over 21
+    """
+    __slots__ = ('cards', 'total', 'soft', 'blackjack', 'busted')
+
+    def __init__(self):
+        self.cards = []
+        self.total = 0
+        self.soft = 0
+        self.blackjack = False
+        self.busted = False
+
+    def add(self, card):
+        """Adds a card code to the hand, returns the new total."""
+        cards = self.cards
+        cards.append(card)
+        total, self.soft = add_card(self.total, self.soft, CARD_VALUE[card])
+        self.total = total
+        self.busted = total > 21
+        self.blackjack = total == 21 and len(cards) == 2
+        return total
+
+    def clear(self):
+        """Empties the hand for a new round, the list of cards is reused."""
+        self.cards.clear()
+        self.total = 0
+        self.soft = 0
+        self.blackjack = False
+        self.busted = False
+
+    def names(self, shown=None):
+        """Display names of the first shown cards (all of them by default)."""
+        return [CARD_NAMES[card] for card in self.cards[:shown]]
+
+    def __len__(self):
+        return len(self.cards)
+
+    def __getitem__(self, index):
+        return self.cards[index]
+
+    def __iter__(self):
+        return iter(self.cards)
+
+    def __str__(self):
+        return f"{self.names()} ({'soft ' if self.soft else ''}{self.total})"
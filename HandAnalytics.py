@@ -0,0 +1,262 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+from Deck import CARD_VALUE
+from Hand import add_card
+from HandHistory import HandHistoryReader, HEADER
+
+# card value of every card code as a numpy table, indexing it with an array of codes gives their values
+VALUES = np.frombuffer(CARD_VALUE, dtype=np.uint8)
+# the columns of a store, one fixed width value per hand (a round of a recorded session)
+COLUMNS = {'session': np.uint32, 'player': np.uint32, 'result': np.uint8, 'up': np.uint8, 'hits': np.uint8,
+           'client_total': np.uint8, 'dealer_total': np.uint8}
+# how many groups a group-by on a small column has, session and player group by every one of them
+KEY_SIZES = {'result': 4, 'up': 12, 'hits': 32, 'client_total': 32, 'dealer_total': 32}
+# what a group-by counts for every group
+STATS = ('hands', 'ties', 'losses', 'wins', 'client_busts', 'dealer_busts')
+# the group-bys every chunk is rolled up into as it is appended, they are answered without reading the chunks
+ROLLUPS = ('up', 'hits', 'player')
+MANIFEST = "manifest.json"
+
+
+def aggregate(keys, results, client_totals, dealer_totals, size):
+    """
+    Vectorized group-by of hands: counts STATS for every key value below size.
+    Returns an int64 array (size, len(STATS)), row v holds the counts of the hands whose key is v.
+    """
+    keys = keys.astype(np.intp)
+    counts = np.zeros((size, len(STATS)), dtype=np.int64)
+    counts[:, 0] = np.bincount(keys, minlength=size)
+    counts[:, 1:4] = np.bincount(keys * 4 + results, minlength=size * 4).reshape(size, 4)[:, 1:]
+    counts[:, 4] = np.bincount(keys[client_totals > 21], minlength=size)
+    # the dealer only draws against a client who did not bust, two cards never bust him
+    counts[:, 5] = np.bincount(keys[dealer_totals > 21], minlength=size)
+    return counts
+
+
+def hand_columns(cards, hits):
+    """
+    Replays the totals of a batch of hands from their recorded cards (see HandHistory), all hands at once:
+    client, client, dealer up, dealer hidden, one card per hit, then the dealer's draws.
+    :parameter cards: the card codes of every hand, as bytes
+    :parameter hits: numpy array of the hits of every hand
+    Returns (dealer up card value, client total, dealer total) as numpy arrays.
+    """
+    lengths = np.fromiter(map(len, cards), dtype=np.intp, count=len(cards))
+    width = max(4, int(lengths.max()) if len(cards) else 0)
+    # every hand's cards in one row, padded with value 0 which adds nothing to a hand
+    rows = np.repeat(np.arange(len(cards)), lengths)
+    columns = np.arange(int(lengths.sum())) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    values = np.zeros((len(cards), width), dtype=np.int16)
+    values[rows, columns] = VALUES[np.frombuffer(b"".join(cards), dtype=np.uint8)]
+
+    client_total, client_soft = add_card(*add_card(0, 0, values[:, 0]), values[:, 1])
+    for hit in range(int(hits.max()) if len(cards) else 0):
+        drawing = hits > hit
+        total, soft = add_card(client_total, client_soft, values[:, min(4 + hit, width - 1)])
+        client_total = np.where(drawing, total, client_total)
+        client_soft = np.where(drawing, soft, client_soft)
+
+    dealer_total, dealer_soft = add_card(*add_card(0, 0, values[:, 2]), values[:, 3])
+    draws = np.maximum(lengths - 4 - hits, 0)
+    every = np.arange(len(cards))
+    for draw in range(int(draws.max()) if len(cards) else 0):
+        drawing = draws > draw
+        total, soft = add_card(dealer_total, dealer_soft, values[every, np.minimum(4 + hits + draw, width - 1)])
+        dealer_total = np.where(drawing, total, dealer_total)
+        dealer_soft = np.where(drawing, soft, dealer_soft)
+    return values[:, 2], client_total, dealer_total
+
+
+class HandAnalytics:
+    """
+    A columnar store of recorded hands for queries over hundreds of millions of them: every column of COLUMNS is
+    kept in chunks of about chunk_rows hands, one .npy file per column and chunk, memory mapped when a query reads it.
+    Queries are numpy group-bys over whole columns, never a python object per hand.
+    Hand history files are ingested incrementally, every ingest only appends the sessions recorded since the last one.
+    Every appended chunk is also added to the ROLLUPS, so win rate by up card, bust rate by hits or EV per player
+    never scan the chunks. The manifest is rewritten last on every append, a crash leaves the store as it was.
+    :parameter path: directory of the store, created if missing
+    :parameter chunk_rows: hands per chunk, a chunk ends with the session that fills it
+    """
+
+    def __init__(self, path, chunk_rows=1_000_000):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        os.makedirs(path, exist_ok=True)
+        self.chunks = []  # hands of every chunk
+        self.players = []  # client name of every player number
+        self.sources = {}  # history file -> offset of the first session not ingested yet
+        self.sessions = 0
+        self.rollups = {key: np.zeros((KEY_SIZES.get(key, 0), len(STATS)), dtype=np.int64) for key in ROLLUPS}
+        try:
+            with open(os.path.join(path, MANIFEST)) as file:
+                manifest = json.load(file)
+            self.chunks = manifest['chunks']
+            self.players = manifest['players']
+            self.sources = manifest['sources']
+            self.sessions = manifest['sessions']
+            self.rollups = {key: np.array(counts, dtype=np.int64).reshape(-1, len(STATS))
+                            for key, counts in manifest['rollups'].items()}
+        except FileNotFoundError:
+            pass
+        self.player_numbers = {name: number for number, name in enumerate(self.players)}
+        self.mapped = {}  # chunk -> its columns, memory mapped on first use
+
+    @property
+    def hands(self):
+        return sum(self.chunks)
+
+    def ingest(self, history_path):
+        """Appends the sessions of a hand history file that were not ingested before, returns how many hands."""
+        source = os.path.abspath(history_path)
+        reader = HandHistoryReader(history_path)
+        batch = {'session': [], 'player': [], 'result': [], 'hits': [], 'cards': []}
+        added = 0
+        try:
+            for history, offset in reader.sessions(self.sources.get(source, len(HEADER))):
+                player = self._player_number(history.client_name)
+                for result, cards, decisions in history.rounds():
+                    batch['session'].append(self.sessions)
+                    batch['player'].append(player)
+                    batch['result'].append(result)
+                    batch['hits'].append(sum(decisions))
+                    batch['cards'].append(bytes(cards))
+                self.sessions += 1
+                if len(batch['result']) >= self.chunk_rows:
+                    added += self._append(batch, source, offset)
+                    batch = {name: [] for name in batch}
+            if batch['result']:
+                added += self._append(batch, source, offset)
+        finally:
+            reader.close()
+        return added
+
+    def _player_number(self, name):
+        number = self.player_numbers.get(name)
+        if number is None:
+            number = self.player_numbers[name] = len(self.players)
+            self.players.append(name)
+        return number
+
+    def _append(self, batch, source, offset):
+        """Writes a batch of hands as the next chunk, rolls it up and commits it with the manifest."""
+        hits = np.array(batch['hits'], dtype=np.uint8)
+        up, client_total, dealer_total = hand_columns(batch['cards'], hits.astype(np.intp))
+        columns = {'session': batch['session'], 'player': batch['player'], 'result': batch['result'], 'up': up,
+                   'hits': hits, 'client_total': client_total, 'dealer_total': dealer_total}
+        columns = {name: np.asarray(columns[name], dtype=dtype) for name, dtype in COLUMNS.items()}
+        chunk = len(self.chunks)
+        for name, column in columns.items():
+            np.save(self._file(chunk, name), column)
+        for key in ROLLUPS:
+            counts = aggregate(columns[key], columns['result'], columns['client_total'], columns['dealer_total'],
+                               self._size(key))
+            rollup = self.rollups[key]
+            if len(rollup) < len(counts):
+                rollup = np.concatenate([rollup, np.zeros((len(counts) - len(rollup), len(STATS)), dtype=np.int64)])
+            rollup[:len(counts)] += counts
+            self.rollups[key] = rollup
+        self.chunks.append(len(hits))
+        self.sources[source] = offset
+        self._save()
+        return len(hits)
+
+    def _save(self):
+        manifest = {'chunks': self.chunks, 'players': self.players, 'sources': self.sources, 'sessions': self.sessions,
+                    'rollups': {key: counts.tolist() for key, counts in self.rollups.items()}}
+        path = os.path.join(self.path, MANIFEST)
+        with open(path + ".tmp", 'w') as file:
+            json.dump(manifest, file)
+        os.replace(path + ".tmp", path)
+
+    def _file(self, chunk, name):
+        return os.path.join(self.path, f"{chunk:06d}.{name}.npy")
+
+    def _size(self, key):
+        """How many groups a group-by on key has."""
+        if key == 'player':
+            return len(self.players)
+        if key == 'session':
+            return self.sessions
+        return KEY_SIZES[key]
+
+    def chunk(self, chunk):
+        """The columns of a chunk as read only memory maps."""
+        columns = self.mapped.get(chunk)
+        if columns is None:
+            columns = self.mapped[chunk] = {name: np.load(self._file(chunk, name), mmap_mode='r') for name in COLUMNS}
+        return columns
+
+    def group_by(self, key, **where):
+        """
+        Counts STATS for every value of the column key, over the hands whose columns equal the values of where
+        (e.g. group_by('up', player=3, hits=0)) or over every hand. Returns an int64 array (groups, len(STATS)).
+        A rolled up key without conditions is answered from its rollup, otherwise every chunk is scanned.
+        """
+        if key not in COLUMNS:
+            raise ValueError(f"unknown column {key}, use one of {tuple(COLUMNS)}")
+        if not where and key in self.rollups:
+            return self.rollups[key].copy()
+        size = self._size(key)
+        counts = np.zeros((size, len(STATS)), dtype=np.int64)
+        for chunk in range(len(self.chunks)):
+            columns = self.chunk(chunk)
+            selected = None
+            for name, value in where.items():
+                matches = columns[name] == value
+                selected = matches if selected is None else selected & matches
+            if selected is not None:
+                columns = {name: columns[name][selected] for name in (key, 'result', 'client_total', 'dealer_total')}
+            counts += aggregate(columns[key], columns['result'], columns['client_total'], columns['dealer_total'], size)
+        return counts
+
+
+def rates(counts):
+    """The rates of group-by counts, every one an array with a value per group (nan for empty groups)."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        hands = counts[:, 0].astype(float)
+        return {'win_rate': counts[:, 3] / hands, 'loss_rate': counts[:, 2] / hands, 'tie_rate': counts[:, 1] / hands,
+                'client_bust_rate': counts[:, 4] / hands, 'dealer_bust_rate': counts[:, 5] / hands,
+                'ev': (counts[:, 3] - counts[:, 2]) / hands}
+
+
+def display_groups(counts, key, labels=None):
+    """Display the non empty groups of a group-by."""
+    rate = rates(counts)
+    print(f"{key:>16} {'hands':>12} {'win':>7} {'loss':>7} {'tie':>7} {'bust':>7} {'d.bust':>7} {'EV':>8}")
+    for group in np.flatnonzero(counts[:, 0]):
+        label = labels[group] if labels else group
+        print(f"{label:>16} {counts[group, 0]:>12,} {rate['win_rate'][group]:>7.2%} {rate['loss_rate'][group]:>7.2%} "
+              f"{rate['tie_rate'][group]:>7.2%} {rate['client_bust_rate'][group]:>7.2%} "
+              f"{rate['dealer_bust_rate'][group]:>7.2%} {rate['ev'][group]:>+8.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Columnar analytics over Black Jack hand histories")
+    parser.add_argument("store", help="directory of the columnar store")
+    parser.add_argument("--ingest", nargs="*", default=[], help="hand history files to append to the store first")
+    parser.add_argument("--chunk-rows", type=int, default=1_000_000)
+    parser.add_argument("--by", choices=tuple(COLUMNS), default="up", help="column to group the hands by")
+    parser.add_argument("--player", default=None, help="only the hands of this client name")
+    parser.add_argument("--up", type=int, default=None, help="only the hands against this dealer up card value")
+    parser.add_argument("--hits", type=int, default=None, help="only the hands with this many hits")
+    args = parser.parse_args()
+
+    analytics = HandAnalytics(args.store, args.chunk_rows)
+    for history_path in args.ingest:
+        started = time.perf_counter()
+        added = analytics.ingest(history_path)
+        print(f"ingested {added:,} hands of {history_path} in {time.perf_counter() - started:.2f}s")
+    where = {name: value for name, value in (('up', args.up), ('hits', args.hits)) if value is not None}
+    if args.player is not None:
+        if args.player not in analytics.player_numbers:
+            parser.error(f"no hands of {args.player} in the store")
+        where['player'] = analytics.player_numbers[args.player]
+    started = time.perf_counter()
+    counts = analytics.group_by(args.by, **where)
+    elapsed = time.perf_counter() - started
+    print(f"{analytics.hands:,} hands in {len(analytics.chunks)} chunks, grouped by {args.by} in {elapsed * 1000:.1f}ms")
+    display_groups(counts, args.by, analytics.players if args.by == 'player' else None)
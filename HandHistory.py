@@ -0,0 +1,278 @@
+import argparse
+import atexit
+import mmap
+import os
+import struct
+import threading
+import time
+from Deck import CARD_NAMES
+from EventLog import EventLog, OFF
+from Protocol import HIT_PAYLOAD, STAND_PAYLOAD
+from ServerGameSession import ServerGameSession, SEND
+from Shuffling import RNG_KINDS, SEEDED
+
+# a history file is this header followed by one record per session, appended as the sessions end:
+#   length (4B) of the rest of the record, then SESSION_STRUCT:
+#   seed (8B), start time (8B), decks (1B), penetration in 1/10000 (2B), flags (1B), rounds asked (2B),
+#   shuffling generator (1B, its index in Shuffling.RNG_KINDS), client name (32B),
+#   then the number of recorded rounds (2B) and for every round:
+#   result (1B, 0 if the session ended inside the round), card count (1B), every card code dealt from the shoe
+#   in that round in dealing order (1B each), decision count (1B), the decisions as bits (1 hit, 0 stand, lowest bit first)
+HEADER = b"BJHH\x03"
+LENGTH_STRUCT = struct.Struct('!I')
+SESSION_STRUCT = struct.Struct('!QdBHBHB32s')
+COUNT_STRUCT = struct.Struct('!H')
+QUIET = EventLog(OFF)
+
+
+class SessionRecorder:
+    """Collects the record of one session while it is played, ServerGameSession feeds it."""
+    __slots__ = ('session', 'started', 'data', 'rounds', 'deck', 'round_start', 'decisions', 'decision_count')
+
+    def __init__(self, session):
+        self.session = session
+        self.started = time.time()
+        self.data = bytearray()  # the encoded rounds
+        self.rounds = 0
+        self.deck = None  # the shoe of the round in progress, None between rounds
+
+    def start_round(self, deck):
+        """A round starts dealing from deck (after a reshuffle if there was one)."""
+        self.deck = deck
+        self.round_start = deck.position
+        self.decisions = 0
+        self.decision_count = 0
+
+    def decision(self, hit):
+        """The client hit (True) or stood (False)."""
+        if hit:
+            self.decisions |= 1 << self.decision_count
+        self.decision_count += 1
+
+    def end_round(self, result):
+        """The round ended with result (0 when the session ended in the middle of it)."""
+        data = self.data
+        data.append(result)
+        cards = self.deck.cards[self.round_start:self.deck.position]
+        data.append(len(cards))
+        data += cards
+        data.append(self.decision_count)
+        data += self.decisions.to_bytes((self.decision_count + 7) // 8, 'little')
+        self.rounds += 1
+        self.deck = None
+
+    def to_bytes(self):
+        """The whole session record, a round still in progress is closed with result 0."""
+        if self.deck is not None:
+            self.end_round(0)
+        session = self.session
+        body = SESSION_STRUCT.pack(session.seed, self.started, session.decks, round(session.penetration * 10000),
+                                   session.flags, session.rounds, RNG_KINDS.index(session.rng_kind),
+                                   session.client_name.encode('utf-8')[:32])
+        return (LENGTH_STRUCT.pack(len(body) + COUNT_STRUCT.size + len(self.data)) + body +
+                COUNT_STRUCT.pack(self.rounds) + self.data)
+
+
+class HandHistoryWriter:
+    """
+    Appends session records to a history file through one buffered file object, a record is a single write so
+    sessions ending on different threads never interleave. Every record is flushed to the file as soon as it is
+    appended: a session ends once per hundreds of rounds, and a worker process that is killed or leaves through
+    os._exit never runs atexit, so nothing may wait in the buffer for it.
+    """
+
+    def __init__(self, path, buffer_size=1 << 16):
+        self.path = path
+        self.file = open(path, 'ab', buffering=buffer_size)
+        if self.file.tell() == 0:
+            self.file.write(HEADER)
+            self.file.flush()
+        self.lock = threading.Lock()
+        self.sessions = 0
+        # the Server closes us when it stops, this only covers a writer that nobody closed
+        atexit.register(self.close)
+
+    def recorder(self, session):
+        """A new SessionRecorder for session."""
+        return SessionRecorder(session)
+
+    def append(self, recorder):
+        """Appends the record of a finished session."""
+        record = recorder.to_bytes()
+        with self.lock:
+            if self.file.closed:
+                return  # a session that ended while the server was shutting down
+            self.file.write(record)
+            self.file.flush()
+            self.sessions += 1
+
+    def flush(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+        atexit.unregister(self.close)
+
+
+class SessionHistory:
+    """One recorded session, a view into the history file, fields are decoded on access."""
+    __slots__ = ('view',)
+
+    def __init__(self, view):
+        self.view = view
+
+    @property
+    def fields(self):
+        """(seed, start time, decks, penetration, flags, rounds asked, client name)"""
+        seed, started, decks, penetration, flags, rounds, _, name = SESSION_STRUCT.unpack_from(self.view)
+        return seed, started, decks, penetration / 10000, flags, rounds, name.decode('utf-8').rstrip('\x00')
+
+    @property
+    def rng_kind(self):
+        """The generator the session's shoe was shuffled with, only "mt" and "pcg" sessions can be replayed."""
+        return RNG_KINDS[self.view[SESSION_STRUCT.size - 33]]
+
+    @property
+    def client_name(self):
+        return bytes(self.view[SESSION_STRUCT.size - 32:SESSION_STRUCT.size]).decode('utf-8').rstrip('\x00')
+
+    @property
+    def rounds_data(self):
+        """The encoded rounds, comparable byte for byte with SessionRecorder.data."""
+        return self.view[SESSION_STRUCT.size + COUNT_STRUCT.size:]
+
+    def rounds(self):
+        """Yields (result, card codes, decisions) of every recorded round, decisions as a list of bools (True hit)."""
+        view = self.view
+        offset = SESSION_STRUCT.size + COUNT_STRUCT.size
+        for _ in range(COUNT_STRUCT.unpack_from(view, SESSION_STRUCT.size)[0]):
+            result, count = view[offset], view[offset + 1]
+            cards = view[offset + 2:offset + 2 + count]
+            offset += 2 + count
+            decision_count = view[offset]
+            size = (decision_count + 7) // 8
+            bits = int.from_bytes(view[offset + 1:offset + 1 + size], 'little')
+            offset += 1 + size
+            yield result, cards, [bool(bits >> index & 1) for index in range(decision_count)]
+
+
+class HandHistoryReader:
+    """
+    Iterates the sessions of a history file through a memory map, records are only read when they are looked at,
+    so a file with millions of hands is scanned without loading it. A record cut short by a crash ends the scan.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        if self.map[:len(HEADER)] != HEADER:
+            raise ValueError(f"{path} is not a hand history file")
+
+    def __iter__(self):
+        for history, _ in self.sessions():
+            yield history
+
+    def sessions(self, offset=len(HEADER)):
+        """
+        Yields (SessionHistory, offset of the next record) of every session from the record at offset on, so a scan
+        of a file that is still being appended to can pick up later where it stopped.
+        """
+        view = memoryview(self.map)
+        end = len(view)
+        while offset + 4 <= end:
+            (length,) = LENGTH_STRUCT.unpack_from(view, offset)
+            if offset + 4 + length > end:
+                return
+            yield SessionHistory(view[offset + 4:offset + 4 + length]), offset + 4 + length
+            offset += 4 + length
+
+    def close(self):
+        if isinstance(self.map, mmap.mmap):
+            try:
+                self.map.close()
+            except BufferError:
+                pass  # SessionHistory views still point into the map, it goes away with them
+        self.file.close()
+
+
+def replay(history):
+    """
+    Re-runs a recorded session through the ServerGameSession rules with its seed, answering every decision the way
+    the client did. Returns the SessionRecorder of the replay, its data equals history.rounds_data when the
+    recorded session is what the rules and the seed produce.
+    Raises ValueError for a session whose shoe was not shuffled by a seeded generator.
+    """
+    if history.rng_kind not in SEEDED:
+        raise ValueError(f"a session shuffled by the {history.rng_kind} generator can not be replayed")
+    seed, _, decks, penetration, _, rounds, client_name = history.fields
+    game = ServerGameSession(None, rounds, client_name, "replay", decks=decks, penetration=penetration, log=QUIET,
+                             seed=seed, rng=history.rng_kind)
+    game.recorder = recorder = SessionRecorder(game)
+    decisions = iter([hit for _, _, round_decisions in history.rounds() for hit in round_decisions])
+    steps = game._game()
+    reply = None
+    while True:
+        try:
+            op = steps.send(reply)
+        except StopIteration:
+            break
+        reply = None
+        if op[0] == SEND:
+            continue
+        hit = next(decisions, None)
+        if hit is None:
+            break  # the recorded session ended while waiting for this decision
+        reply = HIT_PAYLOAD if hit else STAND_PAYLOAD
+    if recorder.deck is not None:
+        recorder.end_round(0)
+    return recorder
+
+
+def display_session(history):
+    """Display every round of a recorded session."""
+    seed, started, decks, penetration, flags, rounds, client_name = history.fields
+    print(f"{client_name} at {time.ctime(started)}, {history.rng_kind} seed {seed}, {decks} decks, "
+          f"{rounds} rounds asked")
+    for number, (result, cards, decisions) in enumerate(history.rounds(), 1):
+        moves = " ".join("hit" if hit else "stand" for hit in decisions)
+        print(f"  round {number}: result {result}, cards {[CARD_NAMES[card] for card in cards]}, decisions: {moves}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scan, show and replay Black Jack hand history files")
+    parser.add_argument("path")
+    parser.add_argument("--client", default=None, help="only the sessions of this client name")
+    parser.add_argument("--show", action="store_true", help="print every round of the selected sessions")
+    parser.add_argument("--verify", action="store_true", help="replay every selected session and compare")
+    args = parser.parse_args()
+
+    reader = HandHistoryReader(args.path)
+    started = time.perf_counter()
+    sessions = rounds = mismatches = skipped = 0
+    results = [0, 0, 0, 0]
+    for history in reader:
+        if args.client and history.client_name != args.client:
+            continue
+        sessions += 1
+        for result, _, _ in history.rounds():
+            rounds += 1
+            results[result] += 1
+        if args.show:
+            display_session(history)
+        if args.verify:
+            if history.rng_kind not in SEEDED:
+                skipped += 1
+            elif replay(history).data != history.rounds_data:
+                mismatches += 1
+                print(f"session {sessions} of {history.client_name} does not replay to its record")
+    elapsed = time.perf_counter() - started
+    print(f"{sessions} sessions, {rounds} rounds: {results[3]} client wins, {results[2]} losses, {results[1]} ties, "
+          f"{results[0]} unfinished, in {elapsed:.2f}s")
+    if args.verify:
+        print(f"replayed {sessions - skipped} sessions, {mismatches} mismatches, "
+              f"{skipped} skipped (not seeded)")
+    reader.close()
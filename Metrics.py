@@ -0,0 +1,181 @@
+import os
+import socket
+import threading
+import time
+
+# histogram bucket i counts observations below 2**i microseconds, 32 buckets reach more than an hour
+BUCKETS = 32
+
+
+class Counter:
+    """A number that only goes up. inc() is one attribute update, cheap enough to stay on in production."""
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge:
+    """A number that goes up and down, like the number of active sessions."""
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+
+class Histogram:
+    """
+    Distribution of durations in power of two microsecond buckets, observing is a multiply, a bit_length and
+    two additions. Percentiles are estimated from the buckets when a snapshot is taken.
+    """
+    __slots__ = ('buckets', 'count', 'total')
+
+    def __init__(self):
+        self.buckets = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        """Records one duration in seconds."""
+        bucket = int(seconds * 1e6).bit_length()
+        self.buckets[bucket if bucket < BUCKETS else BUCKETS - 1] += 1
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, quantile):
+        """Upper bound in seconds of the bucket holding the quantile (0..1) of the observations."""
+        if not self.count:
+            return 0.0
+        wanted = quantile * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= wanted:
+                return (1 << bucket) / 1e6
+        return (1 << (BUCKETS - 1)) / 1e6
+
+
+class Metrics:
+    """
+    Registry of all the counters, gauges and histograms of the process.
+    Instruments are created once (usually at import time) and updated directly on the hot path, updates are plain
+    attribute increments without locks: under heavy thread contention an update can be lost, which is fine for monitoring.
+    Reading happens in snapshot(), render_text() turns it into "name value" lines for the text endpoint and snapshot file.
+    Every reader keeps his own baseline for the per second rates, so the endpoint and the file never reset each other's.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        # the baseline of a reader's first snapshot: all counters at zero when the registry was created
+        self.started = (time.monotonic(), {})
+
+    def counter(self, name):
+        return self.counters.setdefault(name, Counter())
+
+    def gauge(self, name):
+        return self.gauges.setdefault(name, Gauge())
+
+    def histogram(self, name):
+        return self.histograms.setdefault(name, Histogram())
+
+    def snapshot(self, previous=None):
+        """
+        Current value of every instrument, the rate of every counter since previous and histogram percentiles.
+        Returns (snapshot, baseline), the baseline is what the same reader passes as previous next time.
+        :parameter previous: baseline returned by this reader's last snapshot, None for his first one
+        """
+        now = time.monotonic()
+        last_time, last_values = previous or self.started
+        values = {name: counter.value for name, counter in self.counters.items()}
+        elapsed = now - last_time
+        snapshot = dict(values)
+        for name, value in values.items():
+            snapshot[name + "_per_sec"] = (value - last_values.get(name, 0)) / elapsed if elapsed > 0 else 0.0
+        for name, gauge in self.gauges.items():
+            snapshot[name] = gauge.value
+        for name, histogram in self.histograms.items():
+            snapshot[name + "_count"] = histogram.count
+            snapshot[name + "_avg_seconds"] = histogram.total / histogram.count if histogram.count else 0.0
+            for label, quantile in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99)):
+                snapshot[f"{name}_{label}_seconds"] = histogram.percentile(quantile)
+        return snapshot, (now, values)
+
+    def render_text(self, previous=None):
+        """The snapshot as sorted "name value" lines, returns (text, baseline) like snapshot."""
+        snapshot, baseline = self.snapshot(previous)
+        return "".join(f"{name} {value:g}\n" if isinstance(value, float) else f"{name} {value}\n"
+                       for name, value in sorted(snapshot.items())), baseline
+
+    def serve(self, port, host="127.0.0.1"):
+        """
+        Starts a background text endpoint: every connection to host:port gets the current metrics and is closed,
+        e.g. `nc 127.0.0.1 port`. Returns the listening socket.
+        """
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((host, port))
+        listener.listen()
+
+        def answer():
+            baseline = None  # the rates are between two connections, whatever the snapshot file does
+            while True:
+                connection, _ = listener.accept()
+                try:
+                    text, baseline = self.render_text(baseline)
+                    connection.sendall(text.encode())
+                except OSError:
+                    pass
+                finally:
+                    connection.close()
+
+        threading.Thread(target=answer, daemon=True).start()
+        return listener
+
+    def write_snapshots(self, path, interval=10.0):
+        """Starts a background thread that rewrites the snapshot file at path every interval seconds."""
+        def write():
+            baseline = None  # the rates are over the last interval, whoever else reads the metrics
+            while True:
+                time.sleep(interval)
+                text, baseline = self.render_text(baseline)
+                temporary = path + ".tmp"
+                with open(temporary, 'w') as file:
+                    file.write(text)
+                os.replace(temporary, path)  # readers never see a half written file
+
+        threading.Thread(target=write, daemon=True).start()
+
+
+# the registry of this process, every module registers its instruments here
+metrics = Metrics()
+
+
+def add_metrics_arguments(parser):
+    """Adds the --metrics-port, --metrics-file and --metrics-interval options to an argparse parser."""
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve the metrics as text on this localhost port")
+    parser.add_argument("--metrics-file", default=None, help="rewrite a metrics snapshot into this file periodically")
+    parser.add_argument("--metrics-interval", type=float, default=10.0, help="seconds between snapshot files")
+
+
+def expose_metrics(args, worker=None):
+    """
+    Starts the endpoints the options of add_metrics_arguments asked for.
+    :parameter worker: index of a Supervisor worker, it serves on metrics port + worker and suffixes the snapshot file
+    """
+    if args.metrics_port is not None:
+        metrics.serve(args.metrics_port + (worker or 0))
+    if args.metrics_file:
+        metrics.write_snapshots(args.metrics_file if worker is None else f"{args.metrics_file}.{worker}",
+                                args.metrics_interval)
@@ -3,8 +3,31 @@ MAGIC_COOKIE = 0xabcddcba
 MESSAGE_TYPE_OFFER = 0x2
 MSG_TYPE_REQUEST = 0x3
 MSG_TYPE_PAYLOAD = 0x4
+# an extended request is a normal request with this type followed by one flags byte, old clients keep sending 0x3
+MSG_TYPE_REQUEST_EXT = 0x5
+# a wide request is an extended request whose flags byte is followed by the number of rounds in 2 bytes, clients only
+# send it for more than 255 rounds. its 1 byte rounds field holds 255, a server that does not know it closes on us
+MSG_TYPE_REQUEST_WIDE = 0x6
+# the result of another seat at the client's table, only sent to clients that asked for FLAG_TABLE_RESULTS
+MSG_TYPE_TABLE_RESULT = 0x7
+MAX_ROUNDS = 0xFFFF
 UDP_PORT = 13122
 
+# protocol extensions a client can ask for in the flags byte of an extended request
+FLAG_PIPELINE = 0x1  # the client may send "hit until" decisions and the server plays them out without waiting
+FLAG_KEEP_ALIVE = 0x2  # after the last round the connection stays open for the client's next request
+FLAG_TABLE_RESULTS = 0x4  # at a table, the client also gets the result of every other seat after each round
+
+# a peer that sends this many malformed frames in a row is dropped: every frame has a fixed size, so after a bad one
+# the stream is most likely misaligned and reading on only turns more garbage into more work
+MAX_INVALID_FRAMES = 3
+
+# every message layout is compiled once here instead of parsing the format string on every pack/unpack
+OFFER_STRUCT = struct.Struct('!IBH32s')  # 39 bytes
+REQUEST_STRUCT = struct.Struct('!IBB32s')  # 38 bytes
+CLIENT_PAYLOAD_STRUCT = struct.Struct('!IB5s')  # 10 bytes
+SERVER_PAYLOAD_STRUCT = struct.Struct('!IBBHB')  # 9 bytes
+ROUNDS_STRUCT = struct.Struct('!H')  # the rounds of a wide request
 
 
 def offer_Message(server_port,server_name):
@@ -13,84 +36,138 @@ def offer_Message(server_port,server_name):
         Format: Magic Cookie (4B), Type (1B), Server Port (2B), Server Name (32B)
         Total size: 4 + 1 + 2 + 32 = 39 bytes
         """
-    server_name_bytes = server_name.encode('utf-8')
-    server_name_bytes=server_name_bytes.ljust(32, b'\x00')
-    return struct.pack('!IBH32s',MAGIC_COOKIE,MESSAGE_TYPE_OFFER,server_port,server_name_bytes)
+    # the 32s field pads the name with zero bytes itself
+    return OFFER_STRUCT.pack(MAGIC_COOKIE,MESSAGE_TYPE_OFFER,server_port,server_name.encode('utf-8'))
 
 
 def unpack_offer(packet):
     """
     Unpacks the 'Offer' packet to get the server port.
-    Returns: server_port (int) or None if invalid.
+    Returns: (server_port, server_name) or (None, None) if invalid.
     """
-    try:
-        # we expect exactly 39 bytes. ff we get less or more itss not our packet
-        if len(packet) != 39:
-            return None,None
-        cookie, msg_type, server_port, name_bytes = struct.unpack('!IBH32s', packet)
-        # validation checks
-        if cookie != MAGIC_COOKIE:
-            return None,None
-        if msg_type != MESSAGE_TYPE_OFFER:
-            return None,None
-        server_name = name_bytes.decode('utf-8').rstrip('\x00')
-        return server_port, server_name
-    except Exception as e:
-        print(f"Error unpacking offer: {e}")
+    # we expect exactly 39 bytes of our type, anything else is not our packet and only costs these two checks
+    if len(packet) != 39 or packet[4] != MESSAGE_TYPE_OFFER:
         return None,None
+    cookie, msg_type, server_port, name_bytes = OFFER_STRUCT.unpack(packet)
+    if cookie != MAGIC_COOKIE:
+        return None,None
+    server_name = decode_name(name_bytes)
+    if server_name is None:
+        return None,None
+    return server_port, server_name
+
 
-def request_Message(num_of_rounds,client_name):
+def decode_name(name_bytes):
+    """The team name of a 32 bytes name field, None if it is not valid UTF-8."""
+    try:
+        return name_bytes.rstrip(b'\x00').decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+
+
+def request_Message(num_of_rounds,client_name, flags=0):
     """
             Packs the 'request' packet (Client -> Server).
             Format: Magic Cookie (4B), Type (1B), Number Of Rounds (1B), Client Team Name (32B)
             Total size: 4 + 1 + 1 + 32 = 38 bytes
+            With flags the type is MSG_TYPE_REQUEST_EXT and one flags byte follows (39 bytes).
+            More than 255 rounds (up to MAX_ROUNDS) need MSG_TYPE_REQUEST_WIDE: flags (1B) and rounds (2B) follow (41 bytes).
             """
-    client_name_bytes = client_name.encode('utf-8')
-    client_name_bytes=client_name_bytes.ljust(32, b'\x00')
-    return struct.pack("!IBB32s",MAGIC_COOKIE,MSG_TYPE_REQUEST,num_of_rounds,client_name_bytes)
+    client_name_bytes = client_name.encode('utf-8')  # the 32s field pads it with zero bytes
+    if num_of_rounds > 255:
+        return (REQUEST_STRUCT.pack(MAGIC_COOKIE,MSG_TYPE_REQUEST_WIDE,255,client_name_bytes) + bytes((flags,)) +
+                ROUNDS_STRUCT.pack(num_of_rounds))
+    if flags:
+        return REQUEST_STRUCT.pack(MAGIC_COOKIE,MSG_TYPE_REQUEST_EXT,num_of_rounds,client_name_bytes) + bytes((flags,))
+    return REQUEST_STRUCT.pack(MAGIC_COOKIE,MSG_TYPE_REQUEST,num_of_rounds,client_name_bytes)
 
 def unpack_request(packet):
     """
      Unpacks the 'request' packet to get the number of rounds.
      Returns: number of rounds (int) or None if invalid.
      """
-    if len(packet) != 38:
+    if len(packet) != 38 or packet[4] != MSG_TYPE_REQUEST:
+        return None,None
+    cookie, msg_type, rounds, name_bytes = REQUEST_STRUCT.unpack(packet)
+    if cookie != MAGIC_COOKIE:
         return None,None
-    cookie, msg_type, rounds, name_bytes = struct.unpack('!IBB32s',packet)
-    if cookie != MAGIC_COOKIE or msg_type != MSG_TYPE_REQUEST :
+    client_name = decode_name(name_bytes)
+    if client_name is None:
         return None,None
-    client_name = name_bytes.decode('utf-8').rstrip('\x00')
     return rounds ,client_name
 
+def request_extension_size(header):
+    """
+    Given the first 38 bytes of a request, returns how many more bytes belong to it (the flags of an extended request,
+    also the rounds of a wide one).
+    """
+    if len(header) < 5:
+        return 0
+    if header[4] == MSG_TYPE_REQUEST_EXT:
+        return 1
+    return 3 if header[4] == MSG_TYPE_REQUEST_WIDE else 0
+
+def unpack_request_ext(packet):
+    """
+    Unpacks a plain (38 bytes), extended (39 bytes) or wide (41 bytes) request.
+    Returns: (number of rounds, client name, flags) or (None, None, 0) if invalid.
+    """
+    if len(packet) == 38:
+        rounds, client_name = unpack_request(packet)
+        return rounds, client_name, 0
+    if len(packet) == 39:
+        if packet[4] != MSG_TYPE_REQUEST_EXT:
+            return None,None,0
+    elif len(packet) != 41 or packet[4] != MSG_TYPE_REQUEST_WIDE:
+        return None,None,0
+    cookie, msg_type, rounds, name_bytes = REQUEST_STRUCT.unpack_from(packet)
+    if cookie != MAGIC_COOKIE:
+        return None,None,0
+    if len(packet) == 41:
+        (rounds,) = ROUNDS_STRUCT.unpack_from(packet, 39)
+    client_name = decode_name(name_bytes)
+    if client_name is None:
+        return None,None,0
+    return rounds, client_name, packet[38]
+
 def pack_Client_Payload(decision):
     """
        Packs the client decision (Client -> Server).
        Format: Magic Cookie (4B), Type (1B), decision (5B)
        Total size: 4 + 1 + 5 = 10 bytes
       """
-    if decision == "Hit":
-        decision = "Hittt"
+    if decision == "Hit" or decision == "Hittt":
+        return HIT_PAYLOAD
+    if decision == "Stand":
+        return STAND_PAYLOAD
     decision_bytes = decision.encode('utf-8')
-    return struct.pack('!IB5s', MAGIC_COOKIE, MSG_TYPE_PAYLOAD, decision_bytes)
+    return CLIENT_PAYLOAD_STRUCT.pack(MAGIC_COOKIE, MSG_TYPE_PAYLOAD, decision_bytes)
 
 
 def unpack_client_payload(packet):
     """
     Unpacks the client's decision.
-    Returns: 'Hit' , 'Stand', or None.
+    Returns: 'Hit' , 'Stand', 'HitUntil' (see pack_hit_until) or None for anything else.
     """
+    # one lookup among every valid decision frame, garbage of any size or content costs the same lookup and no more
     try:
-        if len(packet) != 10:
-            return None
-        cookie, msg_type, decision_bytes = struct.unpack('!IB5s', packet)
-        if cookie != MAGIC_COOKIE or msg_type != MSG_TYPE_PAYLOAD:
-            return None
-        decision = decision_bytes.decode('utf-8')
-        if decision == "Hittt":
-            return "Hit"
-        return decision
-    except:
-        return None
+        return CLIENT_PAYLOADS.get(packet)
+    except (TypeError, ValueError):  # a bytearray or a writable memoryview can not be hashed
+        return CLIENT_PAYLOADS.get(bytes(packet))
+
+
+def pack_hit_until(threshold):
+    """
+    Packs a pipelined decision (needs FLAG_PIPELINE): the server keeps hitting while the client's sum is below
+    threshold and then stands, without waiting for another decision.
+    Format: Magic Cookie (4B), Type (1B), "HitU" (4B), threshold (1B)
+    """
+    return CLIENT_PAYLOAD_STRUCT.pack(MAGIC_COOKIE, MSG_TYPE_PAYLOAD, b"HitU" + bytes((threshold,)))
+
+
+def unpack_hit_until(packet):
+    """Returns the threshold of a "HitUntil" decision packet."""
+    return packet[9]
 
 
 def pack_server_payload(result, rank, suit):
@@ -99,7 +176,7 @@ def pack_server_payload(result, rank, suit):
     Format: Magic (4B) + Type (1B) + Result (1B) + Rank (2B) + Suit (1B)
     """
 
-    return struct.pack('!IBBHB', MAGIC_COOKIE, MSG_TYPE_PAYLOAD, result, rank, suit)
+    return SERVER_PAYLOAD_STRUCT.pack(MAGIC_COOKIE, MSG_TYPE_PAYLOAD, result, rank, suit)
 
 
 def unpack_server_payload(packet):
@@ -107,24 +184,93 @@ def unpack_server_payload(packet):
     Unpacks the game state.
     Returns: tuple (result, rank, suit) or None.
     """
+    # a client parses one of these per card, so a frame is one lookup among every valid frame: a wrong size, cookie,
+    # type, result or a card that does not exist is simply not there
     try:
-        if len(packet) != 9:  # 4 + 1 + 1 + 2 + 1 = 9 bytes
-            return None
+        return SERVER_PAYLOADS.get(packet)
+    except (TypeError, ValueError):  # a bytearray or a writable memoryview can not be hashed
+        return SERVER_PAYLOADS.get(bytes(packet))
 
-        cookie, msg_type, result, rank, suit = struct.unpack('!IBBHB', packet)
 
-        if cookie != MAGIC_COOKIE or msg_type != MSG_TYPE_PAYLOAD:
-            return None
+def pack_table_result(result, seat, seats):
+    """
+    Packs the result of another seat at the table (Server -> Client, needs FLAG_TABLE_RESULTS).
+    Format: Magic (4B) + Type (1B) + Result (1B) + Seat number (2B) + Seats at the table (1B)
+    Same size as a server payload, result 0 means the seat left the table during the round.
+    """
+    return SERVER_PAYLOAD_STRUCT.pack(MAGIC_COOKIE, MSG_TYPE_TABLE_RESULT, result, seat, seats)
+
 
-        return result, rank, suit
-    except:
+def unpack_table_result(packet):
+    """
+    Unpacks the result of another seat.
+    Returns: tuple (result, seat number, seats at the table) or None.
+    """
+    if len(packet) != 9 or packet[4] != MSG_TYPE_TABLE_RESULT:
+        return None
+    cookie, msg_type, result, seat, seats = SERVER_PAYLOAD_STRUCT.unpack(packet)
+    if cookie != MAGIC_COOKIE or result > 3:
         return None
+    return result, seat, seats
+
+
+# the two client decisions never change, so they are packed once
+HIT_PAYLOAD = CLIENT_PAYLOAD_STRUCT.pack(MAGIC_COOKIE, MSG_TYPE_PAYLOAD, b"Hittt")
+STAND_PAYLOAD = CLIENT_PAYLOAD_STRUCT.pack(MAGIC_COOKIE, MSG_TYPE_PAYLOAD, b"Stand")
+# everything of a "hit until" decision but its threshold
+HIT_UNTIL_PREFIX = CLIENT_PAYLOAD_STRUCT.pack(MAGIC_COOKIE, MSG_TYPE_PAYLOAD, b"HitU")[:9]
+# every decision frame a client can send, "hit until" with any threshold
+CLIENT_PAYLOADS = {HIT_PAYLOAD: "Hit", STAND_PAYLOAD: "Stand",
+                   **{HIT_UNTIL_PREFIX + bytes((threshold,)): "HitUntil" for threshold in range(256)}}
+# every frame the server can send: results 0 (keep playing) to 3 and the 52 cards, (rank - 1) * 4 + suit is a card code
+SERVER_PAYLOADS = {SERVER_PAYLOAD_STRUCT.pack(MAGIC_COOKIE, MSG_TYPE_PAYLOAD, result, rank, suit): (result, rank, suit)
+                   for result in range(4) for rank in range(1, 14) for suit in range(4)}
+
+
 def recv_exact(sock, size):
     """Makes sure we receive exactly size bytes."""
-    data = b''
-    while len(data) < size:
-        chunk = sock.recv(size - len(data))
-        if not chunk:
+    data = sock.recv(size)
+    if len(data) == size:
+        return data  # the usual case, the whole message arrived in one piece
+    if not data:
+        raise ConnectionError("Server disconnected")
+    # otherwise we fill one buffer in place instead of creating a new bytes object for every chunk
+    buffer = bytearray(size)
+    buffer[:len(data)] = data
+    view = memoryview(buffer)
+    received = len(data)
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
             raise ConnectionError("Server disconnected")
-        data += chunk
-    return data
+        received += count
+    return buffer
+
+
+class FrameBuffer:
+    """
+    Collects outgoing server payload frames, so a whole burst of cards (the initial deal, the dealer's reveals)
+    leaves in a single write instead of one write per card. Joining the packed frames once per burst is cheaper than
+    packing each of them into a shared buffer (see ProtocolBenchmark).
+    """
+
+    def __init__(self):
+        self.frames = []
+        self.size = 0
+
+    def add(self, result, rank, suit):
+        """Appends one server payload frame."""
+        self.frames.append(SERVER_PAYLOAD_STRUCT.pack(MAGIC_COOKIE, MSG_TYPE_PAYLOAD, result, rank, suit))
+        self.size += 9
+
+    def append(self, frame):
+        """Appends a frame that is already packed (e.g. a table result)."""
+        self.frames.append(frame)
+        self.size += len(frame)
+
+    def take(self):
+        """Returns the collected frames as one bytes object and empties the buffer."""
+        frames = b"".join(self.frames)
+        self.frames.clear()
+        self.size = 0
+        return frames
@@ -0,0 +1,194 @@
+import argparse
+import socket
+import struct
+import timeit
+from Protocol import (MAGIC_COOKIE, MESSAGE_TYPE_OFFER, MSG_TYPE_REQUEST, MSG_TYPE_PAYLOAD, SERVER_PAYLOAD_STRUCT,
+                      pack_server_payload, unpack_server_payload, pack_Client_Payload, unpack_client_payload,
+                      request_Message, unpack_request, offer_Message, unpack_offer, recv_exact, HIT_PAYLOAD, FrameBuffer)
+
+
+# the codec as it was before the precompiled structs, kept here so every run measures before against after
+def legacy_pack_server_payload(result, rank, suit):
+    return struct.pack('!IBBHB', MAGIC_COOKIE, MSG_TYPE_PAYLOAD, result, rank, suit)
+
+
+def legacy_unpack_server_payload(packet):
+    if len(packet) != 9:
+        return None
+    cookie, msg_type, result, rank, suit = struct.unpack('!IBBHB', packet)
+    if cookie != MAGIC_COOKIE or msg_type != MSG_TYPE_PAYLOAD:
+        return None
+    return result, rank, suit
+
+
+def legacy_pack_client_payload(decision):
+    if decision == "Hit":
+        decision = "Hittt"
+    return struct.pack('!IB5s', MAGIC_COOKIE, MSG_TYPE_PAYLOAD, decision.encode('utf-8'))
+
+
+def legacy_unpack_client_payload(packet):
+    try:
+        if len(packet) != 10:
+            return None
+        cookie, msg_type, decision_bytes = struct.unpack('!IB5s', packet)
+        if cookie != MAGIC_COOKIE or msg_type != MSG_TYPE_PAYLOAD:
+            return None
+        decision = decision_bytes.decode('utf-8')
+        if decision == "Hittt":
+            return "Hit"
+        return decision
+    except:
+        return None
+
+
+def legacy_request_message(num_of_rounds, client_name):
+    client_name_bytes = client_name.encode('utf-8').ljust(32, b'\x00')
+    return struct.pack("!IBB32s", MAGIC_COOKIE, MSG_TYPE_REQUEST, num_of_rounds, client_name_bytes)
+
+
+def legacy_unpack_request(packet):
+    if len(packet) != 38:
+        return None, None
+    cookie, msg_type, rounds, name_bytes = struct.unpack('!IBB32s', packet)
+    if cookie != MAGIC_COOKIE or msg_type != MSG_TYPE_REQUEST:
+        return None, None
+    return rounds, name_bytes.decode('utf-8').rstrip('\x00')
+
+
+def legacy_offer_message(server_port, server_name):
+    server_name_bytes = server_name.encode('utf-8').ljust(32, b'\x00')
+    return struct.pack('!IBH32s', MAGIC_COOKIE, MESSAGE_TYPE_OFFER, server_port, server_name_bytes)
+
+
+def legacy_unpack_offer(packet):
+    try:
+        if len(packet) != 39:
+            return None, None
+        cookie, msg_type, server_port, name_bytes = struct.unpack('!IBH32s', packet)
+        if cookie != MAGIC_COOKIE or msg_type != MESSAGE_TYPE_OFFER:
+            return None, None
+        return server_port, name_bytes.decode('utf-8').rstrip('\x00')
+    except Exception as e:
+        print(f"Error unpacking offer: {e}")
+        return None, None
+
+
+class LegacyFrameBuffer:
+    """The first coalescing buffer: every frame packed into one preallocated bytearray, taken as a view of it."""
+
+    def __init__(self, capacity=512):
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.size = 0
+
+    def add(self, result, rank, suit):
+        SERVER_PAYLOAD_STRUCT.pack_into(self.buffer, self.size, MAGIC_COOKIE, MSG_TYPE_PAYLOAD, result, rank, suit)
+        self.size += 9
+
+    def take(self):
+        frames = self.view[:self.size]
+        self.size = 0
+        return frames
+
+
+def burst(frames):
+    """Coalesces the four frames of an initial deal into one write, like a session does."""
+    for _ in range(4):
+        frames.add(0, 12, 3)
+    return frames.take()
+
+
+def legacy_recv_exact(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Server disconnected")
+        data += chunk
+    return data
+
+
+def ns_per_op(statement, number):
+    """Best of 5 runs of statement, in nanoseconds per call."""
+    return min(timeit.repeat(statement, number=number, repeat=5)) / number * 1e9
+
+
+def before_after(before, after, number):
+    """
+    Best of 5 runs of each statement in nanoseconds per call, the runs of the two alternate so a machine that gets
+    busier half way through slows both and not only the one measured last.
+    """
+    before_runs, after_runs = [], []
+    for _ in range(5):
+        before_runs.append(timeit.timeit(before, number=number))
+        after_runs.append(timeit.timeit(after, number=number))
+    return min(before_runs) / number * 1e9, min(after_runs) / number * 1e9
+
+
+def codec_benchmarks(number=200_000):
+    """Encode/decode cost of every message, returns {name: ns/op}."""
+    server_packet = pack_server_payload(0, 12, 3)
+    client_packet = pack_Client_Payload("Hit")
+    request_packet = request_Message(10, "bot")
+    offer_packet = offer_Message(4242, "server")
+    legacy_frames, frames = LegacyFrameBuffer(), FrameBuffer()
+    pairs = (
+        ('pack_server_payload', lambda: legacy_pack_server_payload(0, 12, 3), lambda: pack_server_payload(0, 12, 3)),
+        ('unpack_server_payload', lambda: legacy_unpack_server_payload(server_packet),
+         lambda: unpack_server_payload(server_packet)),
+        ('pack_client_payload', lambda: legacy_pack_client_payload("Hit"), lambda: pack_Client_Payload("Hit")),
+        ('unpack_client_payload', lambda: legacy_unpack_client_payload(client_packet),
+         lambda: unpack_client_payload(client_packet)),
+        ('request_Message', lambda: legacy_request_message(10, "bot"), lambda: request_Message(10, "bot")),
+        ('unpack_request', lambda: legacy_unpack_request(request_packet), lambda: unpack_request(request_packet)),
+        ('offer_Message', lambda: legacy_offer_message(4242, "server"), lambda: offer_Message(4242, "server")),
+        ('unpack_offer', lambda: legacy_unpack_offer(offer_packet), lambda: unpack_offer(offer_packet)),
+        ('FrameBuffer burst of 4', lambda: burst(legacy_frames), lambda: burst(frames)),
+    )
+    results = {}
+    for name, before, after in pairs:
+        results[f'{name} (before)'], results[f'{name} (after)'] = before_after(before, after, number)
+    return results
+
+
+def reader_benchmarks(messages=100_000):
+    """
+    Cost of receiving messages off a local socket pair, alone and together with their parser the way the sessions
+    read them (the server a 10 byte decision, the client a 9 byte payload), returns {name: ns/op}.
+    """
+    results = {}
+    sender, receiver = socket.socketpair()
+    decisions = HIT_PAYLOAD * 100
+    payloads = pack_server_payload(0, 12, 3) * 100
+    readers = (('recv_exact (before)', payloads, lambda: legacy_recv_exact(receiver, 9)),
+               ('recv_exact (after)', payloads, lambda: recv_exact(receiver, 9)),
+               ('read + unpack_client_payload (before)', decisions,
+                lambda: legacy_unpack_client_payload(legacy_recv_exact(receiver, 10))),
+               ('read + unpack_client_payload (after)', decisions,
+                lambda: unpack_client_payload(recv_exact(receiver, 10))),
+               ('read + unpack_server_payload (before)', payloads,
+                lambda: legacy_unpack_server_payload(legacy_recv_exact(receiver, 9))),
+               ('read + unpack_server_payload (after)', payloads,
+                lambda: unpack_server_payload(recv_exact(receiver, 9))))
+    for name, payload, read in readers:
+        best = None
+        for _ in range(5):
+            elapsed = 0.0
+            # we send 100 messages at a time so the socket buffer never fills up, only the reads are timed
+            for _ in range(messages // 100):
+                sender.sendall(payload)
+                elapsed += timeit.timeit(read, number=100)
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = best / (messages // 100 * 100) * 1e9
+    sender.close()
+    receiver.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Protocol codec microbenchmarks (ns/op, lower is better)")
+    parser.add_argument("--number", type=int, default=200_000)
+    args = parser.parse_args()
+    for name, ns in {**codec_benchmarks(args.number), **reader_benchmarks(args.number // 2)}.items():
+        print(f"{name:<40} {ns:8.1f} ns/op")
@@ -0,0 +1,352 @@
+import argparse
+import asyncio
+import collections
+import multiprocessing
+import os
+import random
+import socket
+import threading
+import time
+from BotClient import BotSession, basic_strategy
+from Discovery import Discovery, INVALID_OFFERS
+from EventLog import EventLog, WARNING
+from Metrics import metrics
+from Protocol import (offer_Message, unpack_offer, request_Message, unpack_request_ext, pack_Client_Payload,
+                      pack_hit_until, unpack_client_payload, pack_server_payload, unpack_server_payload,
+                      STAND_PAYLOAD, MAX_INVALID_FRAMES)
+from Server import Server
+
+# what the flooded processes log: everything a real server would, written nowhere, so its cost is measured too
+SINK = EventLog(WARNING, open(os.devnull, 'w'))
+
+
+def mutate(frame, rng):
+    """
+    A malformed copy of a valid frame, of the same size: random bytes, a wrong cookie, a wrong type or a name that is
+    not UTF-8.
+    """
+    frame = bytearray(frame)
+    mutation = rng.randrange(4)
+    if mutation == 0:
+        return rng.randbytes(len(frame))
+    if mutation == 1:
+        frame[rng.randrange(4)] ^= 0xff
+    elif mutation == 2:
+        frame[4] ^= rng.randrange(1, 256)
+    else:
+        frame[-1] = 0xff  # never a valid byte of UTF-8, in a frame without a name it is just a wrong value
+    return bytes(frame)
+
+
+def frame_sets(count, seed=0):
+    """
+    count valid, malformed (see mutate) and truncated (valid ones cut anywhere) frames for every parser.
+    Returns {parser name: (parser, {kind: frames})}.
+    """
+    rng = random.Random(seed)
+    valid = {
+        'unpack_offer': (unpack_offer, lambda: offer_Message(rng.randrange(1, 65536), f"server{rng.randrange(99)}")),
+        'unpack_request_ext': (unpack_request_ext, lambda: request_Message(rng.randrange(1, 1000), "bot",
+                                                                           rng.randrange(4))),
+        'unpack_client_payload': (unpack_client_payload, lambda: rng.choice(
+            (pack_Client_Payload("Hit"), STAND_PAYLOAD, pack_hit_until(rng.randrange(12, 22))))),
+        'unpack_server_payload': (unpack_server_payload, lambda: pack_server_payload(rng.randrange(4),
+                                                                                     rng.randrange(1, 14),
+                                                                                     rng.randrange(4))),
+    }
+    sets = {}
+    for name, (parser, make) in valid.items():
+        frames = [make() for _ in range(count)]
+        sets[name] = (parser, {'valid': frames,
+                               'malformed': [mutate(frame, rng) for frame in frames],
+                               'truncated': [frame[:rng.randrange(len(frame))] for frame in frames]})
+    return sets
+
+
+def parser_stress(count=100_000):
+    """
+    Throughput of every parser on every kind of frame, best of 3 passes over count frames.
+    Returns {"<parser>_<kind>_ns": wall ns per frame, "<parser>_<kind>_cpu_ns": CPU ns per frame}.
+    """
+    results = {}
+    for name, (parser, kinds) in frame_sets(count).items():
+        for kind, frames in kinds.items():
+            best = best_cpu = None
+            for _ in range(3):
+                started, started_cpu = time.perf_counter(), time.process_time()
+                collections.deque(map(parser, frames), maxlen=0)
+                elapsed, cpu = time.perf_counter() - started, time.process_time() - started_cpu
+                best = elapsed if best is None else min(best, elapsed)
+                best_cpu = cpu if best_cpu is None else min(best_cpu, cpu)
+            results[f'{name}_{kind}_ns'] = best / count * 1e9
+            results[f'{name}_{kind}_cpu_ns'] = best_cpu / count * 1e9
+    return results
+
+
+def slow_rejects(results, tolerance=1.1):
+    """
+    The parsers of parser_stress results that spend more CPU on a malformed or truncated frame than on a valid one,
+    tolerance leaves room for timer noise. Rejecting garbage must never cost more than accepting a frame.
+    """
+    slow = []
+    for name in ('unpack_offer', 'unpack_request_ext', 'unpack_client_payload', 'unpack_server_payload'):
+        valid = results[f'{name}_valid_cpu_ns']
+        if max(results[f'{name}_malformed_cpu_ns'], results[f'{name}_truncated_cpu_ns']) > valid * tolerance:
+            slow.append(name)
+    return slow
+
+
+def serve(mode, control):
+    """
+    Server process of the TCP floods: serves on a background thread and answers every message on control with
+    (its CPU seconds so far, metrics snapshot), until it gets None.
+    """
+    server = Server(broadcast=False, log=SINK)
+    threading.Thread(target=server.start, args=(mode,), daemon=True).start()
+    control.send(server.tcp_port)
+    while control.recv() is not None:
+        control.send((time.process_time(), metrics.snapshot()[0]))
+
+
+def listen(port, control):
+    """Client process of the UDP flood: a Discovery on port, reports like serve."""
+    discovery = Discovery(("127.0.0.1",), port)
+    discovery.start()
+    control.send(port)
+    while control.recv() is not None:
+        control.send((time.process_time(), {'invalid_offers': INVALID_OFFERS.value,
+                                            'servers': len(discovery.live_servers())}))
+
+
+def play_bots(port, control):
+    """
+    Client process of the mid-session flood: bots connect to our fake server on port one after the other and play
+    until it drops them or they drop it, reports like serve with how many bots dropped the server.
+    """
+    dropped = [0]
+
+    async def bots():
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            except OSError:
+                await asyncio.sleep(0.05)
+                continue
+            try:
+                await BotSession(basic_strategy, 1).play(reader, writer, 5.0)
+            except ConnectionError:
+                dropped[0] += 1  # MAX_INVALID_FRAMES invalid frames in a row
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                pass
+            finally:
+                writer.close()
+
+    threading.Thread(target=asyncio.run, args=(bots(),), daemon=True).start()
+    control.send(port)
+    while control.recv() is not None:
+        control.send((time.process_time(), {'dropped': dropped[0]}))
+
+
+class Flooded:
+    """
+    A server or client in its own process, so its CPU is not mixed up with the flood's.
+    measure(flood) runs flood() and returns (seconds the flood took, CPU seconds the process spent on it,
+    its counters before, after).
+    """
+
+    def __init__(self, target, *args):
+        context = multiprocessing.get_context("fork")
+        self.control, child = context.Pipe()
+        self.process = context.Process(target=target, args=args + (child,), daemon=True)
+        self.process.start()
+        if not self.control.poll(10):
+            raise RuntimeError("the flooded process did not start")
+        self.port = self.control.recv()
+
+    def report(self):
+        self.control.send(True)
+        return self.control.recv()
+
+    def measure(self, flood):
+        cpu, before = self.report()
+        started = time.perf_counter()
+        flood()
+        elapsed = time.perf_counter() - started
+        # whatever the flood left in the socket buffers is processed before we look
+        time.sleep(0.2)
+        cpu_after, after = self.report()
+        return elapsed, cpu_after - cpu, before, after
+
+    def close(self):
+        self.control.send(None)
+        self.process.join(2)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+
+def run_connections(port, connections, concurrency, connection):
+    """Runs connection(sock) on connections new connections to the server, concurrency at a time."""
+    remaining = iter(range(connections))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            sock = socket.create_connection(("127.0.0.1", port))
+            sock.settimeout(15.0)
+            try:
+                connection(sock)
+            except OSError:
+                pass  # the server may reset a connection it dropped while we were still writing
+            finally:
+                sock.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def wait_closed(sock):
+    """Reads until the server closed the connection."""
+    while sock.recv(4096):
+        pass
+
+
+def tcp_stress(mode, connections=2000, concurrency=32, seed=0):
+    """
+    Floods a Server with connections that send a malformed request, a truncated one, or a valid request followed by
+    garbage instead of decisions, and as a baseline with valid one round sessions. Every connection waits until the
+    server dropped it. Returns {name: value} with connections per second and server CPU per connection.
+    """
+    rng = random.Random(seed)
+    request = request_Message(1, "stress")
+    floods = {
+        'bad_request': lambda sock: (sock.sendall(mutate(request, rng)), wait_closed(sock)),
+        'truncated_request': lambda sock: (sock.sendall(request[:rng.randrange(38)]), sock.shutdown(socket.SHUT_WR),
+                                           wait_closed(sock)),
+        'bad_decisions': lambda sock: (sock.sendall(request), recv_all(sock, 27),
+                                       sock.sendall(b"".join(rng.randbytes(10) for _ in range(MAX_INVALID_FRAMES))),
+                                       wait_closed(sock)),
+        'valid_session': lambda sock: (sock.sendall(request), recv_all(sock, 27), sock.sendall(STAND_PAYLOAD),
+                                       wait_closed(sock)),
+    }
+    results = {}
+    server = Flooded(serve, mode)
+    try:
+        for name, connection in floods.items():
+            elapsed, cpu, before, after = server.measure(
+                lambda: run_connections(server.port, connections, concurrency, connection))
+            results[f'{mode}_{name}_connections_per_sec'] = connections / elapsed
+            results[f'{mode}_{name}_server_cpu_us'] = cpu / connections * 1e6
+            for counter in ('invalid_requests', 'request_timeouts', 'invalid_decisions', 'invalid_clients'):
+                if after.get(counter, 0) != before.get(counter, 0):
+                    results[f'{mode}_{name}_{counter}'] = after[counter] - before[counter]
+    finally:
+        server.close()
+    return results
+
+
+def recv_all(sock, size):
+    """Receives exactly size bytes."""
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Server disconnected")
+        data += chunk
+    return data
+
+
+def client_stress(connections=2000, seed=0):
+    """
+    Floods bots mid-session: a fake server answers every request with well formed frames that are no valid payload
+    (a wrong cookie or type, a card that does not exist), and every bot must drop it after MAX_INVALID_FRAMES of them.
+    Returns {name: value} with the bot's CPU per connection, its MAX_INVALID_FRAMES invalid frames and the connection
+    itself (the parsers alone are measured by parser_stress).
+    """
+    rng = random.Random(seed)
+    cards = [pack_server_payload(0, rng.randrange(1, 14), rng.randrange(4)) for _ in range(1000)]
+    garbage = [mutate(card, rng) for card in cards] + [pack_server_payload(0, rank, suit)
+                                                       for rank, suit in ((0, 0), (14, 1), (255, 2), (5, 4), (13, 255))]
+    garbage = [frame for frame in garbage if unpack_server_payload(frame) is None]
+    listener = socket.create_server(("127.0.0.1", 0))
+    client = Flooded(play_bots, listener.getsockname()[1])
+
+    def flood():
+        for _ in range(connections):
+            sock, _ = listener.accept()
+            with sock:
+                sock.settimeout(15.0)
+                recv_all(sock, 38)
+                sock.sendall(b"".join(rng.choice(garbage) for _ in range(MAX_INVALID_FRAMES)))
+                try:
+                    wait_closed(sock)
+                except OSError:
+                    pass
+
+    try:
+        elapsed, cpu, before, after = client.measure(flood)
+    finally:
+        client.close()
+        listener.close()
+    return {'client_connections_per_sec': connections / elapsed,
+            'client_dropped_servers': after['dropped'] - before['dropped'],
+            'client_cpu_per_connection_us': cpu / connections * 1e6}
+
+
+def udp_stress(packets=200_000, seed=0):
+    """
+    Floods a client's Discovery with offer port traffic: mostly malformed and truncated offers, every 100th a valid one.
+    Returns {name: value} with the packets the client processed and its CPU per packet.
+    """
+    rng = random.Random(seed)
+    offer = offer_Message(4242, "stress")
+    garbage = [mutate(offer, rng) if rng.random() < 0.5 else offer[:rng.randrange(39)] for _ in range(1000)]
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    client = Flooded(listen, port)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def flood():
+        address = ("127.0.0.1", port)
+        for number in range(packets):
+            sender.sendto(offer if number % 100 == 0 else garbage[number % 1000], address)
+
+    try:
+        elapsed, cpu, before, after = client.measure(flood)
+    finally:
+        sender.close()
+        client.close()
+    # the kernel drops what the client's socket buffer cannot hold, only the processed packets cost it anything
+    invalid = after['invalid_offers'] - before['invalid_offers']
+    return {'udp_packets_per_sec': packets / elapsed, 'udp_invalid_offers_processed': invalid,
+            'udp_client_cpu_per_invalid_ns': cpu / invalid * 1e9 if invalid else 0.0,
+            'udp_servers_found': after['servers']}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Flood the protocol parsers, a Server, bots mid-session and a client's "
+                                                 "Discovery with valid, malformed and truncated frames")
+    parser.add_argument("--frames", type=int, default=100_000, help="frames of every kind per parser")
+    parser.add_argument("--connections", type=int, default=2000, help="connections of every TCP flood")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--modes", nargs="*", default=["threads", "asyncio", "selectors"], help="server modes to flood")
+    parser.add_argument("--packets", type=int, default=200_000, help="packets of the UDP flood")
+    args = parser.parse_args()
+
+    results = parser_stress(args.frames)
+    slow = slow_rejects(results)
+    if slow:
+        raise SystemExit(f"rejecting garbage costs more than parsing a valid frame in {', '.join(slow)}")
+    for mode in args.modes:
+        results.update(tcp_stress(mode, args.connections, args.concurrency))
+    results.update(client_stress(args.connections))
+    results.update(udp_stress(args.packets))
+    for name, value in results.items():
+        print(f"{name:<56} {value:14,.1f}" if isinstance(value, float) else f"{name:<56} {value:14,}")
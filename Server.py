@@ -1,20 +1,93 @@
+import argparse
+import asyncio
+import functools
+import signal
 import socket
 import time
 import threading
-from Protocol import offer_Message, unpack_request, recv_exact
-from ServerGameSession import ServerGameSession
+from AdmissionController import AdmissionController
+from EventLog import default_log, add_log_arguments, log_from_args, RateLimit, INFO, WARNING
+from Metrics import metrics, add_metrics_arguments, expose_metrics
+from Protocol import offer_Message, unpack_request_ext, request_extension_size, recv_exact, FLAG_KEEP_ALIVE
+from ServerGameSession import ServerGameSession, RECV, reject_request
+from SessionScheduler import SessionScheduler
+from Shuffling import ShoePool
+from StatsStore import StatsStore
+from HandHistory import HandHistoryWriter
+from TableGameSession import TableGameSession, MAX_SEATS
+from Tournament import Tournament, FORMATS
 BROADCAST_PORT = 13122
+# how many pending connections the kernel may queue for us, thousands of bots connect at once in asyncio mode.
+LISTEN_BACKLOG = 4096
+# seconds a client has to send his request after connecting (shrinks under load, see AdmissionController.timeout)
+REQUEST_TIMEOUT = 12.0
+
+CONNECTIONS = metrics.counter("connections_accepted")
+ACTIVE_SESSIONS = metrics.gauge("active_sessions")
+REQUEST_TIMEOUTS = metrics.counter("request_timeouts")  # clients that never sent a full request
+# a flood of half requests must not become a flood of log lines, the counter above has them all
+REQUEST_TIMEOUT_LOG = RateLimit()
 
 
 class Server:
     """Handles network connections and client management."""
-    def __init__(self):
-        # TCP socket which listens for players request to play black jack.
-        self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.tcp_socket.bind(('0.0.0.0', 0))  # 0 means the OS picks an available port number
-        self.tcp_socket.listen()
+    def __init__(self, tcp_socket=None, broadcast=True, decks=1, penetration=0.0, log=None, table_seats=1,
+                 stats_db=None, history=None, rng="mt", shoe_pool=0, offer_to=(), max_sessions=0, max_pending=0,
+                 max_per_ip=0, tournament=None):
+        """
+        :parameter tcp_socket: an already listening socket to accept on (a worker process shares its supervisor's port),
+            None means we open our own on a port picked by the OS.
+        :parameter broadcast: whether this server sends the UDP offers, only one process per port should.
+        :parameter decks: decks in every session's shoe
+        :parameter penetration: fraction of the shoe dealt before it is reshuffled, 0 reshuffles every round
+        :parameter log: the EventLog of the server and all its sessions
+        :parameter table_seats: clients seated at one table with a shared shoe and dealer (up to MAX_SEATS),
+            1 plays every client alone in his own session
+        :parameter stats_db: SQLite file keeping every client's lifetime stats (see StatsStore), None keeps none
+        :parameter history: file every session is recorded in for replays (see HandHistory), tables are not recorded
+        :parameter rng: generator every shoe is shuffled with, "mt" or "pcg" (seeded, replayable) or "secure"
+        :parameter shoe_pool: shuffled shoes a background thread keeps ready for all sessions (see ShoePool),
+            0 shuffles inline. pooled shoes are not replayable
+        :parameter offer_to: addresses that get every offer sent to them directly besides the broadcast,
+            e.g. 127.0.0.1 for clients on this machine
+        :parameter max_sessions: connections playing at once, the next ones wait or are rejected (0: no limit)
+        :parameter max_pending: connections that may wait for a free slot, beyond it they are rejected right away
+        :parameter max_per_ip: connections one address may hold, playing or waiting (0: no limit)
+        :parameter tournament: keyword arguments of a Tournament (format, entrants, stage_rounds, ...): every client
+            then registers for the running tournament instead of playing alone, table_seats players per table.
+            one tournament follows the other
+        """
+        if tcp_socket is None:
+            # TCP socket which listens for players request to play black jack.
+            tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            tcp_socket.bind(('0.0.0.0', 0))  # 0 means the OS picks an available port number
+            tcp_socket.listen(LISTEN_BACKLOG)
+        self.tcp_socket = tcp_socket
         self.tcp_port = self.tcp_socket.getsockname()[1]
         self.server_name = "Definitely_Not_Rigged"
+        self.broadcast = broadcast
+        self.offer_to = list(offer_to)
+        self.decks = decks
+        self.penetration = penetration
+        self.rng = rng
+        self.shoe_pool = ShoePool(decks, rng, shoe_pool) if shoe_pool > 0 else None
+        self.log = log or default_log
+        self.admission = AdmissionController(max_sessions, max_pending, max_per_ip)
+        self.table_seats = min(table_seats, MAX_SEATS)
+        self.tables = []  # the open tables, new clients sit at the first one with a free seat
+        self.tables_lock = threading.Lock()
+        self.tournament_settings = tournament
+        self.tournament = None  # the tournament clients register for right now
+        # wins/losses/ties of every client this server played with, sessions report each round through record_result
+        self.stats = {'wins': 0, 'losses': 0, 'ties': 0}
+        # rounds end on every session thread and scheduler worker at once, += on a dict entry is not atomic
+        self.stats_lock = threading.Lock()
+        # extra callables(client_name, result) notified on every finished round
+        self.result_listeners = []
+        self.stats_store = StatsStore(stats_db) if stats_db else None
+        if self.stats_store:
+            self.result_listeners.append(self.stats_store.record)
+        self.history = HandHistoryWriter(history) if history else None
         # UDP socket which broadcasts offers to play black jack
         self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         # i enable permission to send broadcasts via this socket
@@ -25,7 +98,10 @@ class Server:
         # this is important because it forces the broadcast to go out through our
         # physical network card (like WiFi) instead of staying inside a virtual interface like WSL.
         self.udp_socket.bind((self.get_local_ip(), 0))
-        print(f"Server started, listening on IP address {self.get_local_ip()}")
+        # the direct offers go out through their own unbound socket, the OS picks the right source for each address
+        self.direct_udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) if self.offer_to else None
+        self.log.event(INFO, "server_start", "Server started, listening on IP address {ip}", ip=self.get_local_ip(),
+                       port=self.tcp_port)
 
     def get_local_ip(self):
         """returns the local IP address."""
@@ -43,41 +119,338 @@ class Server:
 
     def broadcast_offers(self):
         """Sends UDP offers so clients know where to connect."""
-        print(f"Server broadcasting on UDP port {BROADCAST_PORT}...")
+        self.log.event(INFO, "broadcast_start", "Server broadcasting on UDP port {port}...", port=BROADCAST_PORT)
         while True:
             message = offer_Message(self.tcp_port,self.server_name)
             self.udp_socket.sendto(message, ('<broadcast>', BROADCAST_PORT))
+            for address in self.offer_to:
+                try:
+                    self.direct_udp_socket.sendto(message, (address, BROADCAST_PORT))
+                except OSError:
+                    pass  # nobody is listening there right now, the next offer tries again
             time.sleep(1)
 
 
-    def handle_client(self, client_sock):
-        """Handle an individual client connection."""
-        client_sock.settimeout(12.0)
+    def handle_client(self, client_sock, ip=None):
+        """
+        Handle an individual client connection.
+        :parameter ip: the address the connection was admitted for, its admission slot is released when it is done
+        """
+        CONNECTIONS.inc()
+        release = functools.partial(self.admission.release, ip) if ip is not None else None
         try:
-            data = recv_exact(client_sock, 38)  # block waiting for exactly 38 bytes from client
-        except (socket.timeout, ConnectionError):  # client too slow or disconnected
-            print("Client disconnected or respond timed out. Returned to sending offers.")
-            client_sock.close()
-            return
-        rounds, client_name = unpack_request(data)
-        if not rounds or not client_name:  # if invalid or malformed request
-            print("Invalid data, Closing the connection.")
-            client_sock.close()
+            client_sock.settimeout(self.admission.timeout(REQUEST_TIMEOUT))
+            try:
+                data = recv_exact(client_sock, 38)  # block waiting for exactly 38 bytes from client
+                extension = request_extension_size(data)
+                if extension:  # an extended request carries its flags right after the 38 bytes
+                    data = bytes(data) + recv_exact(client_sock, extension)
+            except (socket.timeout, ConnectionError):  # client too slow or disconnected
+                REQUEST_TIMEOUTS.inc()
+                REQUEST_TIMEOUT_LOG.event(self.log, WARNING, "request_timeout",
+                                          "Client disconnected or respond timed out. Returned to sending offers.")
+                client_sock.close()
+                return
+            rounds, client_name, flags = unpack_request_ext(data)
+            if not rounds or not client_name:  # if invalid or malformed request
+                reject_request(self.log)
+                client_sock.close()
+                return
+            game = self.new_session(client_sock, rounds, client_name, flags)
+            if self.tournament_settings is not None:
+                # the tournament releases the slot once he is out of it
+                if self.tournament is not None and self.tournament.register(game, release):
+                    release = None
+                else:
+                    client_sock.close()
+                return
+            if self.table_seats > 1:
+                # the table releases the slot once this seat leaves it
+                game.on_close, release = release, None
+                table = self.seat_client(game)
+                if table is not None:  # we opened this table, so this thread deals it until it is empty
+                    table.play()
+                return
+            ACTIVE_SESSIONS.inc()
+            try:
+                game.play()
+            finally:
+                ACTIVE_SESSIONS.dec()
+                # closed right away, a dropped client must not keep his descriptor until the session is collected
+                client_sock.close()
+        finally:
+            if release:
+                release()
+
+    async def handle_client_async(self, reader, writer):
+        """Coroutine version of handle_client, used when the server runs in asyncio mode."""
+        ip = writer.get_extra_info('peername')[0]
+        admitted = asyncio.get_running_loop().create_future()
+        if not self.admission.submit(ip, functools.partial(admitted.set_result, None)):
+            writer.close()
             return
-        game = ServerGameSession(client_sock, rounds, client_name, self.server_name)
-        game.play()
+        await admitted  # only waits while we are at max_sessions and the connection sits in the pending queue
+        CONNECTIONS.inc()
+        release = functools.partial(self.admission.release, ip)
+        try:
+            timeout = self.admission.timeout(REQUEST_TIMEOUT)
+            try:
+                data = await asyncio.wait_for(reader.readexactly(38), timeout)
+                extension = request_extension_size(data)
+                if extension:
+                    data += await asyncio.wait_for(reader.readexactly(extension), timeout)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                REQUEST_TIMEOUTS.inc()
+                REQUEST_TIMEOUT_LOG.event(self.log, WARNING, "request_timeout",
+                                          "Client disconnected or respond timed out. Returned to sending offers.")
+                return
+            rounds, client_name, flags = unpack_request_ext(data)
+            if not rounds or not client_name:  # if invalid or malformed request
+                reject_request(self.log)
+                return
+            game = self.new_session(None, rounds, client_name, flags)
+            if self.table_seats > 1:
+                game.on_close, release = release, None
+                table = self.seat_client(game, (reader, writer))
+                if table is not None:
+                    await table.play_async()
+                else:
+                    writer = None  # the table's coroutine owns the connection now and closes it
+                return
+            ACTIVE_SESSIONS.inc()
+            try:
+                await game.play_async(reader, writer)
+            finally:
+                ACTIVE_SESSIONS.dec()
+        finally:
+            if writer is not None:
+                writer.close()
+            if release:
+                release()
+
+    def client_steps(self, client_sock, ip=None):
+        """
+        handle_client as round steps (see ServerGameSession, SEND / RECV), for the selectors mode:
+        reads the request and plays the whole game without ever blocking a thread.
+        """
+        CONNECTIONS.inc()
+        try:
+            timeout = self.admission.timeout(REQUEST_TIMEOUT)
+            try:
+                data = yield RECV, 38, timeout
+                extension = request_extension_size(data)
+                if extension:
+                    data += yield RECV, extension, timeout
+            except (socket.timeout, ConnectionError):
+                REQUEST_TIMEOUTS.inc()
+                REQUEST_TIMEOUT_LOG.event(self.log, WARNING, "request_timeout",
+                                          "Client disconnected or respond timed out. Returned to sending offers.")
+                return
+            rounds, client_name, flags = unpack_request_ext(data)
+            if not rounds or not client_name:  # if invalid or malformed request
+                reject_request(self.log)
+                return
+            game = self.new_session(client_sock, rounds, client_name, flags)
+            ACTIVE_SESSIONS.inc()
+            try:
+                yield from game._games()
+            except OSError:
+                pass  # timeouts and disconnects, the round that waited already logged them
+            except Exception as error:
+                game._failed(error)
+            finally:
+                ACTIVE_SESSIONS.dec()
+            self.log.event(INFO, "session_end", "Continuing to send offers...", client=client_name)
+        finally:
+            if ip is not None:
+                self.admission.release(ip)
+
+    def new_session(self, client_sock, rounds, client_name, flags):
+        """A ServerGameSession for a client's request with the server's settings."""
+        # tables are not recorded, tournaments play at tables too
+        recorded = self.table_seats == 1 and self.tournament_settings is None
+        game = ServerGameSession(client_sock, rounds, client_name, self.server_name, self.record_result,
+                                 self.decks, self.penetration, flags, self.log,
+                                 history=self.history if recorded else None, rng=self.rng,
+                                 pool=self.shoe_pool)
+        game.adapt_timeout = self.admission.timeout
+        return game
+
+    async def serve_async(self):
+        """Accepts every client on one event loop instead of a thread per client."""
+        self.tcp_socket.setblocking(False)
+        server = await asyncio.start_server(self.handle_client_async, sock=self.tcp_socket, backlog=LISTEN_BACKLOG)
+        async with server:
+            await server.serve_forever()
+
+    def seat_client(self, game, streams=None):
+        """
+        Seats a session at the first table with a free seat. When every table is full a new one is opened,
+        it is returned and the caller has to play it, otherwise returns None.
+        """
+        # a seat leaves the table after its last round, so a table never keeps a connection alive
+        game.flags &= ~FLAG_KEEP_ALIVE
+        with self.tables_lock:
+            self.tables = [table for table in self.tables if not table.closed]
+            for table in self.tables:
+                if table.join(game, streams):
+                    return None
+            table = TableGameSession(self.server_name, self.table_seats, self.decks, self.penetration, self.log,
+                                     self.rng, self.shoe_pool)
+            table.join(game, streams)
+            self.tables.append(table)
+            return table
+
+    def run_tournaments(self):
+        """Plays one tournament after the other, registration for the next opens once the last one is over."""
+        while True:
+            self.tournament = Tournament(self.server_name, seats=self.table_seats, decks=self.decks,
+                                         penetration=self.penetration, log=self.log, rng=self.rng, pool=self.shoe_pool,
+                                         on_round_end=self.record_result, **self.tournament_settings)
+            self.tournament.run()
+
+    def record_result(self, client_name, result):
+        """Counts the result of a finished round (1 tie, 2 client lost, 3 client won)."""
+        with self.stats_lock:
+            if result == 1:
+                self.stats['ties'] += 1
+            elif result == 2:
+                self.stats['losses'] += 1
+            else:
+                self.stats['wins'] += 1
+        for listener in self.result_listeners:
+            listener(client_name, result)
 
-    def start(self):
-        """Starts the server broadcast offers and accept connections."""
+    def start(self, mode="threads", scheduler_threads=4):
+        """
+        Starts the server broadcast offers and accept connections.
+        :parameter mode: "threads" one thread per client, "asyncio" one event loop, "selectors" a SessionScheduler
+        :parameter scheduler_threads: worker threads of the SessionScheduler in selectors mode
+        Serves until the main thread is interrupted (ctrl+c, or SIGTERM after stop_on_signals), then closes the server.
+        """
+        try:
+            self._serve(mode, scheduler_threads)
+        finally:
+            self.close()
+
+    def close(self):
+        """Writes out and closes what the server records into, sessions still running are no longer recorded."""
+        if self.history:
+            self.history.close()
+        if self.stats_store:
+            # the results of the last flush_interval are still in its write-behind buffer
+            self.result_listeners.remove(self.stats_store.record)
+            self.stats_store.close()
+
+    def _serve(self, mode, scheduler_threads):
+        """Accepts connections in the given mode, forever (see start)."""
+        if mode == "selectors" and self.table_seats > 1:
+            raise ValueError("tables drive their seats themselves, use the threads or asyncio mode for them")
+        if mode != "threads" and self.tournament_settings is not None:
+            raise ValueError("tournaments play their tables on threads, use the threads mode for them")
+        if self.tournament_settings is not None:
+            threading.Thread(target=self.run_tournaments, daemon=True).start()
         # start broadcasting in background
-        threading.Thread(target=self.broadcast_offers, daemon=True).start()
+        if self.broadcast:
+            threading.Thread(target=self.broadcast_offers, daemon=True).start()
+
+        if mode == "asyncio":
+            raise_open_files_limit()
+            asyncio.run(self.serve_async())
+            return
+
+        if mode == "selectors":
+            raise_open_files_limit()
+            scheduler = SessionScheduler(scheduler_threads)
+            scheduler.start()
+            while True:
+                client_sock, addr = self.tcp_socket.accept()
+                if not self.admission.submit(addr[0], functools.partial(
+                        scheduler.add, client_sock, self.client_steps(client_sock, addr[0]))):
+                    client_sock.close()
 
         while True:
             client_sock, addr = self.tcp_socket.accept()
-            client_thread = threading.Thread(target=self.handle_client, args=(client_sock,))
-            client_thread.start()
+            # a rejected client is closed before we spend a thread on him, a queued one gets his thread once admitted
+            client_thread = threading.Thread(target=self.handle_client, args=(client_sock, addr[0]))
+            if not self.admission.submit(addr[0], client_thread.start):
+                client_sock.close()
+
+
+def stop_on_signals():
+    """
+    Makes SIGTERM stop the server like ctrl+c does: the main thread gets a KeyboardInterrupt and Server.start closes
+    the server on its way out. Only the first SIGINT or SIGTERM interrupts, the ones after it are ignored so they
+    cannot cut that close short (a worker under ctrl+c gets the terminal's SIGINT and then its supervisor's).
+    """
+    def interrupt(signum, frame):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGINT, interrupt)
+    signal.signal(signal.SIGTERM, interrupt)
+
+
+def raise_open_files_limit():
+    """Every client is a file descriptor, so we lift the soft limit up to the hard one where the OS allows it."""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
 
 
 if __name__ == "__main__":
-    server = Server()
-    server.start()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Black Jack server")
+    parser.add_argument("--mode", choices=["threads", "asyncio", "selectors"], default="threads",
+                        help="threads: one thread per client, asyncio: all clients on one event loop, "
+                             "selectors: all clients on one selector thread and a few worker threads")
+    parser.add_argument("--scheduler-threads", type=int, default=4, help="worker threads of the selectors mode")
+    parser.add_argument("--stats-db", default=None, help="keep every client's lifetime stats in this SQLite file")
+    parser.add_argument("--history", default=None, help="record every session into this hand history file")
+    parser.add_argument("--decks", type=int, default=1, help="decks in every shoe, e.g. 6 or 8")
+    parser.add_argument("--penetration", type=float, default=0.0,
+                        help="fraction of the shoe dealt before reshuffling, 0 reshuffles every round")
+    parser.add_argument("--table-seats", type=int, default=1,
+                        help=f"clients sharing one table, shoe and dealer (1..{MAX_SEATS})")
+    parser.add_argument("--max-sessions", type=int, default=0, help="clients playing at once, 0 for no limit")
+    parser.add_argument("--max-pending", type=int, default=0,
+                        help="clients that may wait for a free session, the rest are rejected at once")
+    parser.add_argument("--max-per-ip", type=int, default=0, help="connections one address may hold, 0 for no limit")
+    parser.add_argument("--offer-to", action="append", default=[],
+                        help="also send every offer straight to this address, e.g. 127.0.0.1 for local clients")
+    parser.add_argument("--rng", choices=["mt", "pcg", "secure"], default="mt",
+                        help="shuffling generator: mt and pcg are seeded per session and replayable, "
+                             "secure uses the OS CSPRNG")
+    parser.add_argument("--shoe-pool", type=int, default=0,
+                        help="keep this many shoes shuffled ahead in a background thread, 0 shuffles inline")
+    parser.add_argument("--tournament", choices=FORMATS, default=None,
+                        help="run tournaments of this format at tables of --table-seats players instead of games")
+    parser.add_argument("--entrants", type=int, default=16, help="players a tournament waits for")
+    parser.add_argument("--stage-rounds", type=int, default=50,
+                        help="rounds of every tournament stage, players ask for exactly this many (1..65535)")
+    parser.add_argument("--stages", type=int, default=3, help="stages of a round-robin tournament")
+    parser.add_argument("--survivors", type=float, default=0.5,
+                        help="fraction of the players that go on after every stage of an elimination tournament")
+    parser.add_argument("--registration-timeout", type=float, default=10.0,
+                        help="seconds registration stays open after the first entrant")
+    add_log_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    expose_metrics(args)
+    tournament = None
+    if args.tournament:
+        tournament = {'format': args.tournament, 'entrants': args.entrants, 'stage_rounds': args.stage_rounds,
+                      'stages': args.stages, 'survivors': args.survivors,
+                      'registration_timeout': args.registration_timeout}
+    server = Server(decks=args.decks, penetration=args.penetration, log=log_from_args(args), table_seats=args.table_seats,
+                    stats_db=args.stats_db, history=args.history, rng=args.rng, shoe_pool=args.shoe_pool,
+                    offer_to=args.offer_to, max_sessions=args.max_sessions, max_pending=args.max_pending,
+                    max_per_ip=args.max_per_ip, tournament=tournament)
+    stop_on_signals()
+    try:
+        server.start(args.mode, args.scheduler_threads)
+    except KeyboardInterrupt:
+        pass
\ No newline at end of file
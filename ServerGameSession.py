@@ -1,201 +1,480 @@
+import asyncio
+import secrets
 import socket
-from Deck import Deck, get_card_value, decode_card
-from Protocol import pack_server_payload, unpack_client_payload, recv_exact
+import time
+import traceback
+from Deck import Deck, CARD_NAMES, CARD_RANK, CARD_SUIT, CARD_VALUE
+from EventLog import default_log, RateLimit, DEBUG, INFO, WARNING
+from Hand import Hand, add_card
+from Metrics import metrics
+from Protocol import (unpack_client_payload, unpack_hit_until, unpack_request_ext, request_extension_size, recv_exact,
+                      FrameBuffer, FLAG_PIPELINE, FLAG_KEEP_ALIVE, MAX_INVALID_FRAMES)
+from Shuffling import make_rng, SEEDED
+
+# the round logic never touches the socket itself, it yields I/O operations and a driver performs them.
+# this way the same rules run on a blocking socket (one thread per client) or on an asyncio event loop.
+# sent frames are collected and written together right before the next receive, so every burst of cards is one write.
+SEND = 0  # (SEND, result, rank, suit) -> None, queues one server payload frame
+RECV = 1  # (RECV, size, timeout) -> exactly size bytes
+
+# seconds a kept alive connection may stay idle between the last round of a game and the next request
+KEEP_ALIVE_TIMEOUT = 12.0
+
+# the dealer keeps drawing while his total is below this, he stands on every 17 (soft ones too)
+DEALER_STANDS_AT = 17
+
+ROUNDS = metrics.counter("rounds")
+RESULTS = {0x1: metrics.counter("results_tie"), 0x2: metrics.counter("results_loss"), 0x3: metrics.counter("results_win")}
+DECISION_WAIT = metrics.histogram("decision_wait")  # from asking the client to decide until his decision arrived
+SEND_LATENCY = metrics.histogram("send_latency")  # one coalesced write of frames
+DECISION_TIMEOUTS = metrics.counter("decision_timeouts")
+DISCONNECTS = metrics.counter("disconnects")
+DEALER_TURNS = metrics.counter("dealer_turns")
+DEALER_BUSTS = metrics.counter("dealer_busts")
+KEEP_ALIVE_GAMES = metrics.counter("keep_alive_games")  # games played on a connection that was kept alive
+INVALID_REQUESTS = metrics.counter("invalid_requests")  # the same counter the Server counts bad first requests in
+INVALID_DECISIONS = metrics.counter("invalid_decisions")  # malformed decisions, or "hit until" without FLAG_PIPELINE
+INVALID_CLIENTS = metrics.counter("invalid_clients")  # dropped after MAX_INVALID_FRAMES invalid decisions in a row
+SESSION_ERRORS = metrics.counter("session_errors")  # sessions that ended on an unexpected exception, not on the network
+
+# garbage is counted in full but only sampled into the log, a flood of it must not turn into a flood of log lines
+INVALID_REQUEST_LOG = RateLimit()
+INVALID_DECISION_LOG = RateLimit()
+
+
+def reject_request(log):
+    """Counts an invalid request, the caller closes the connection."""
+    INVALID_REQUESTS.inc()
+    INVALID_REQUEST_LOG.event(log, WARNING, "invalid_request", "Invalid data, Closing the connection.")
+
+
+def settle(client_sum, dealer_sum):
+    """
+    Result of a round where the client stood, once the dealer is done drawing.
+    Returns 0x1 tie, 0x2 dealer wins, 0x3 client wins (the result flag we send to the client).
+    """
+    if dealer_sum > 21:
+        return 0x3  # Dealer busted, client wins
+    elif client_sum > dealer_sum:
+        return 0x3  # Client wins
+    elif dealer_sum > client_sum:
+        return 0x2  # Dealer wins
+    return 0x1  # Tie
+
+
+def dealer_draw(deck, dealer_hand):
+    """
+    The dealer's turn: with the up card and the hidden card in dealer_hand (a Hand), draws from deck until he reaches
+    DEALER_STANDS_AT. The cards are only revealed to the clients afterwards (ServerGameSession._dealer_turn),
+    so a table runs this once per round for all of its seats. Returns the dealer's final total.
+    """
+    DEALER_TURNS.inc()
+    while dealer_hand.total < DEALER_STANDS_AT:
+        dealer_hand.add(deck.deal_code())
+    if dealer_hand.busted:
+        DEALER_BUSTS.inc()
+    return dealer_hand.total
 
 
 class ServerGameSession:
     """Manages the game logic for a single client's blackjack session."""
 
-    def __init__(self, client_socket, rounds, client_name,server_name):
-        self.client_socket = client_socket
+    def __init__(self, client_socket, rounds, client_name,server_name, on_round_end=None, decks=1, penetration=0.0,
+                 flags=0, log=None, seed=None, history=None, rng="mt", pool=None):
+        """
+        :parameter seed: seed of the session's own random generator, every shuffle of its shoe follows from it.
+            a random one by default, with it and the client's decisions the whole session can be replayed
+        :parameter rng: kind of generator the shoe is shuffled with (see Shuffling.RNG_KINDS)
+        :parameter pool: Shuffling.ShoePool the shoe takes pre-shuffled shoes from, such a session is not replayable
+        :parameter history: HandHistoryWriter that gets the record of this session once it ends
+        """
+        self.client_socket = client_socket  # None when the session is driven by play_async
+        self.frames = FrameBuffer()
+        # protocol extensions the client asked for in its request (see Protocol.FLAG_*)
+        self.flags = flags
+        # every card and hand is a DEBUG event, round results and game stats are INFO
+        self.log = log or default_log
         self.rounds = rounds
         self.client_name = client_name
         self.stats = {'wins': 0, 'losses': 0, 'ties': 0}
         self.rounds_played = 0
         self.server_name = server_name
+        # optional callable(client_name, result) the server uses to aggregate results across sessions
+        self.on_round_end = on_round_end
+        # one shoe for the whole session, reshuffled in place whenever the cut card comes out
+        # only the seeded generators can replay a session, the others record seed 0
+        self.rng_kind = "pool" if pool is not None else rng
+        self.seed = 0 if self.rng_kind not in SEEDED else seed if seed is not None else secrets.randbits(64)
+        self.decks = decks
+        self.penetration = penetration
+        self.deck = Deck(decks, penetration, make_rng(rng, self.seed), pool)
+        self.history = history
+        self.recorder = history.recorder(self) if history else None
+        self.client_hand = Hand()
+        self.dealer_hand = Hand()  # a table replaces it with the dealer hand all of its seats share
+        # seconds the client may think about each decision
+        self.decision_timeout = 30
+        # optional callable(seconds) -> seconds every wait's timeout goes through, the Server shrinks them under load
+        self.adapt_timeout = None
+        # optional callable() a TableGameSession calls once this seat left it, after closing his connection unless he
+        # asked for FLAG_KEEP_ALIVE: the connection then goes back to whoever seated him (see Tournament)
+        self.on_close = None
 
     def play(self):
-        """Run all rounds of blackjack."""
-        print(f"\nStarting game with {self.client_name} for {self.rounds} rounds")
-        for _ in range(self.rounds):
+        """Run all rounds of blackjack over the blocking client socket."""
+        try:
+            self._run(self._games())
+        except OSError:
+            pass  # timeouts and disconnects, the round that waited already logged them
+        except Exception as error:
+            self._failed(error)
+        self.log.event(INFO, "session_end", "Continuing to send offers...", client=self.client_name)
+
+    async def play_async(self, reader, writer):
+        """Coroutine version of play, runs all rounds over asyncio streams."""
+        try:
+            await self._run_async(self._games(), reader, writer)
+        except OSError:
+            pass
+        except Exception as error:
+            self._failed(error)
+        self.log.event(INFO, "session_end", "Continuing to send offers...", client=self.client_name)
+
+    def _failed(self, error):
+        """Logs an unexpected exception that ended the session: the error at WARNING, its traceback at DEBUG."""
+        SESSION_ERRORS.inc()
+        self.log.event(WARNING, "session_error", "Session of {client} failed: {error}", client=self.client_name,
+                       error=f"{type(error).__name__}: {error}")
+        if self.log.enabled_for(DEBUG):
+            self.log.event(DEBUG, "session_traceback", "{traceback}", client=self.client_name,
+                           traceback="".join(traceback.format_exception(type(error), error, error.__traceback__)))
+
+    def _run(self, steps, flush=True):
+        """
+        Drives a round generator with blocking socket calls.
+        :parameter flush: write the queued frames when the generator is done, a table keeps them queued between
+            the deal steps of its seats so every seat still gets one write per burst
+        """
+        reply, error = None, None
+        while True:
+            try:
+                op = steps.throw(error) if error else steps.send(reply)
+            except StopIteration as done:
+                if flush and self.frames.size:
+                    self._send(self.frames.take())
+                return done.value
+            reply, error = None, None
+            if op[0] == SEND:
+                self.frames.add(op[1], op[2], op[3])
+                continue
+            try:
+                if self.frames.size:
+                    self._send(self.frames.take())
+                self.client_socket.settimeout(op[2])
+                started = time.perf_counter()
+                reply = recv_exact(self.client_socket, op[1])
+                DECISION_WAIT.observe(time.perf_counter() - started)
+            except (socket.timeout, ConnectionError) as e:
+                # we hand the error back to the round so it fails at the exact point it was waiting
+                error = e
+
+    def _send(self, frames):
+        """Blocking write of the collected frames, timed for the send latency histogram."""
+        started = time.perf_counter()
+        self.client_socket.sendall(frames)
+        SEND_LATENCY.observe(time.perf_counter() - started)
+
+    async def _run_async(self, steps, reader, writer, flush=True):
+        """Drives a round generator on the event loop, same contract as _run."""
+        reply, error = None, None
+        while True:
             try:
-                self._play_round()
-            except Exception as e:
-                print(f'Continuing to send offers...')
+                op = steps.throw(error) if error else steps.send(reply)
+            except StopIteration as done:
+                if flush and self.frames.size:
+                    await self._send_async(writer, self.frames.take())
+                return done.value
+            reply, error = None, None
+            if op[0] == SEND:
+                self.frames.add(op[1], op[2], op[3])
+                continue
+            try:
+                if self.frames.size:
+                    await self._send_async(writer, self.frames.take())
+                started = time.perf_counter()
+                reply = await asyncio.wait_for(reader.readexactly(op[1]), op[2])
+                DECISION_WAIT.observe(time.perf_counter() - started)
+            except asyncio.TimeoutError:
+                error = socket.timeout("timed out")
+            except asyncio.IncompleteReadError:
+                error = ConnectionError("Client disconnected")
+            except ConnectionError as e:
+                error = e
+
+    async def _send_async(self, writer, frames):
+        """Coroutine version of _send."""
+        started = time.perf_counter()
+        writer.write(frames)
+        await writer.drain()
+        SEND_LATENCY.observe(time.perf_counter() - started)
+
+    def _games(self):
+        """
+        Every game of the connection: the one of the first request, then as long as the client asks for FLAG_KEEP_ALIVE
+        one more for every request he sends on the same connection. Each of them is played by this same session,
+        so its reader, buffers, hands and shoe stay warm.
+        """
+        while True:
+            yield from self._game()
+            if not self.flags & FLAG_KEEP_ALIVE:
                 return
+            timeout = self.adapt_timeout(KEEP_ALIVE_TIMEOUT) if self.adapt_timeout else KEEP_ALIVE_TIMEOUT
+            request = yield from self._next_request(timeout)
+            if request is None:
+                return
+            self.reset(*request)
+
+    def _next_request(self, timeout):
+        """
+        Reads the next request of a kept alive connection.
+        Returns (rounds, client name, flags), or None when he closed, stayed idle or sent garbage.
+        """
+        try:
+            data = yield RECV, 38, timeout
+            extension = request_extension_size(data)
+            if extension:
+                data += yield RECV, extension, timeout
+        except (socket.timeout, ConnectionError):
+            return None  # closing the connection or just staying idle both mean he is done
+        rounds, client_name, flags = unpack_request_ext(data)
+        if not rounds or not client_name:
+            reject_request(self.log)
+            return None
+        return rounds, client_name, flags
+
+    def reset(self, rounds, client_name, flags):
+        """Prepares the session for the next game of a kept alive connection."""
+        KEEP_ALIVE_GAMES.inc()
+        self.rounds = rounds
+        self.client_name = client_name
+        self.flags = flags
+        self.stats = {'wins': 0, 'losses': 0, 'ties': 0}
+        self.rounds_played = 0
+        # every game gets its own seed and a shoe that starts over, so it can be replayed on its own
+        if self.rng_kind in SEEDED:
+            self.seed = secrets.randbits(64)
+            self.deck.reseed(make_rng(self.rng_kind, self.seed))
+        self.recorder = self.history.recorder(self) if self.history else None
+
+    def _game(self):
+        """Play all the rounds, yields the I/O operations of every round in order."""
+        self.log.event(INFO, "session_start", "\nStarting game with {client} for {rounds} rounds",
+                       client=self.client_name, rounds=self.rounds)
+        try:
+            for _ in range(self.rounds):
+                yield from self._play_round()
+        finally:
+            # a session that failed half way is recorded too, that is usually the one somebody asks about
+            if self.history:
+                self.history.append(self.recorder)
         self._display_final_stats()
-        print(f'Continuing to send offers...')
 
     def _play_round(self):
         """Play a single round of blackjack."""
-        deck = Deck()
-        deck.shuffle()
-        dealer_hand = []
-        client_hand = []
-        client_sum = 0
-        dealer_sum = 0
-
-        print(f"\n--- Round {self.rounds_played + 1} ---")
-
-        # first give the client the first 2 cards
+        deck = self.deck
+        if deck.needs_shuffle():
+            deck.shuffle()
+        if self.recorder:
+            self.recorder.start_round(deck)
+        self._start_round()
+
+        # first give the client the first 2 cards, two cards never bust him since two aces make a soft 12
         for i in range(2):
-            card = deck.deal()
-            client_hand.append(card)
-            client_sum += get_card_value(card)
-
-            # i log the card being dealt
-            card_str = self._format_card(card[1], card[0])
-            print(f"{self.client_name} drew {card_str}")
-
-            # rare but possible for the client to already busts ( if he receives 2 aces )
-            result = 0x2 if (i == 1 and client_sum > 21) else 0x0
-            # if busted send the client a message that he lost this round along side the last card which made him lose.
-            self.client_socket.sendall(pack_server_payload(result, card[1], card[0]))
-
-        # if busted end the round already
-        if client_sum > 21:
-            print(f"{self.client_name} busted with {client_sum}")
-            self._display_hands(client_hand, dealer_hand)
-            self._handle_round_end(2)  # Client loss
-            return
+            yield from self._deal_to_client(deck.deal_code())
 
         # deal initial dealer cards, but we only show the client the first one
-        for i in range(2):
-            card = deck.deal()
-            dealer_hand.append(card)
-            if i == 0:
-                card_str = self._format_card(card[1], card[0])
-                print(f"{self.server_name} drew {card_str}")
-                self.client_socket.sendall(pack_server_payload(0x0, card[1], card[0]))
-                # we did not add the hidden card value to the dealer sum because as long as its hidden we dont really care
-                dealer_sum += get_card_value(card)
-            else:
-                card_str = self._format_card(card[1], card[0])
-                print(f"{self.server_name} drew {card_str} (hidden)")
-
-
-        self._display_hands(client_hand, dealer_hand, hide_dealer_second=True)
-
+        self.dealer_hand.add(deck.deal_code())
+        self.dealer_hand.add(deck.deal_code())
+        yield from self._show_dealer_cards()
+
+        if (yield from self._client_turn(deck)):
+            dealer_draw(deck, self.dealer_hand)
+            yield from self._dealer_turn()
+
+    # the steps of a round below are also what a TableGameSession plays for each of its seats,
+    # the table deals from its own shoe and shares its dealer hand with every seat
+
+    def _start_round(self):
+        """Empties the hands for a new round, the lists live as long as the session."""
+        self.client_hand.clear()
+        self.dealer_hand.clear()
+        self.log.event(DEBUG, "round_start", "\n--- Round {round} ---", client=self.client_name,
+                       round=self.rounds_played + 1)
+
+    def _deal_to_client(self, card):
+        """Gives the client one card, if it busts him the card goes out with the loss flag and the round ends."""
+        hand = self.client_hand
+        hand.add(card)
+        log = self.log
+        log.event(DEBUG, "card", "{player} drew {card}", player=self.client_name, card=CARD_NAMES[card])
+
+        # client loses if its hand cards value is over 21, he gets the loss along side the card which made him lose
+        result = 0x2 if hand.busted else 0x0
+        yield SEND, result, CARD_RANK[card], CARD_SUIT[card]
+        if result == 0x2:
+            log.event(DEBUG, "bust", "{player} busted with {total}", player=self.client_name, total=hand.total)
+            self._display_hands()
+            self._handle_round_end(2)  # Client loss
 
+    def _show_dealer_cards(self):
+        """Sends the dealer's up card, the second dealer card stays hidden until the dealer's turn."""
+        up, hidden = self.dealer_hand[0], self.dealer_hand[1]
+        self.log.event(DEBUG, "card", "{player} drew {card}", player=self.server_name, card=CARD_NAMES[up])
+        self.log.event(DEBUG, "card", "{player} drew {card} (hidden)", player=self.server_name, card=CARD_NAMES[hidden])
+        yield SEND, 0x0, CARD_RANK[up], CARD_SUIT[up]
+        self._display_hands(dealer_shown=1)
+
+    def _client_turn(self, deck):
+        """
+        Asks the client for decisions and deals his hits until he stands or busts.
+        Returns True when he stood and waits for the dealer, False when he busted (the round is over for him).
+        Raises ConnectionError once he sent MAX_INVALID_FRAMES invalid decisions in a row.
+        """
+        log = self.log
+        hand = self.client_hand
+        # set when the client pipelined a "hit until" decision, we then play his hand out without asking again
+        hit_until = None
+        invalid = 0  # invalid decisions in a row
         while True:
-            try:
-                print(f'Waiting for {self.client_name} to decide his move')
-                self.client_socket.settimeout(30)
-                packet = recv_exact(self.client_socket, 10)
-            except (socket.timeout, ConnectionError):
-                print("Client timed out or disconnected during decision make")
-                raise
-
-            decision = unpack_client_payload(packet)
-            print(f"{self.client_name} chose: {decision}")
+            if hit_until is None:
+                try:
+                    log.event(DEBUG, "decision_wait", "Waiting for {client} to decide his move", client=self.client_name)
+                    timeout = self.adapt_timeout(self.decision_timeout) if self.adapt_timeout else self.decision_timeout
+                    packet = yield RECV, 10, timeout
+                except (socket.timeout, ConnectionError) as e:
+                    (DECISION_TIMEOUTS if isinstance(e, socket.timeout) else DISCONNECTS).inc()
+                    log.event(WARNING, "decision_timeout", "Client timed out or disconnected during decision make",
+                              client=self.client_name)
+                    raise
+
+                decision = unpack_client_payload(packet)
+                if decision is None or decision == "HitUntil" and not self.flags & FLAG_PIPELINE:
+                    invalid += 1
+                    INVALID_DECISIONS.inc()
+                    INVALID_DECISION_LOG.event(log, WARNING, "invalid_decision", "Invalid decision from {client}",
+                                               client=self.client_name, in_a_row=invalid)
+                    if invalid >= MAX_INVALID_FRAMES:
+                        INVALID_CLIENTS.inc()
+                        raise ConnectionError(f"{invalid} invalid decisions in a row")
+                    continue
+                invalid = 0
+                log.event(DEBUG, "decision", "{client} chose: {decision}", client=self.client_name, decision=decision)
+                if decision == "HitUntil":
+                    hit_until = unpack_hit_until(packet)
+            if hit_until is not None:
+                decision = "Hit" if hand.total < hit_until else "Stand"
+
+            if self.recorder and decision in ("Hit", "Stand"):
+                self.recorder.decision(decision == "Hit")
 
             if decision == "Hit":
-                card = deck.deal()
-                client_hand.append(card)
-                client_sum += get_card_value(card)
-
-                card_str = self._format_card(card[1], card[0])
-                print(f"{self.client_name} drew {card_str}")
-                # client loses if its hand cards value is over 21
-                result = 0x2 if client_sum > 21 else 0x0
-                self.client_socket.sendall(pack_server_payload(result, card[1], card[0]))
-
-                if result == 0x2:
-                    print(f"{self.client_name} busted with {client_sum}")
-                    self._display_hands(client_hand, dealer_hand)
-                    self._handle_round_end(2)
-                    break
-                else:
-                    self._display_hands(client_hand, dealer_hand, hide_dealer_second=True)
+                yield from self._deal_to_client(deck.deal_code())
+                if hand.busted:
+                    return False
+                self._display_hands(dealer_shown=1)
 
             elif decision == "Stand":
-                print(f"{self.client_name} stands with {client_sum}")
-                result = self._dealer_turn(dealer_hand, dealer_sum, client_sum, deck, client_hand)
-                self._handle_round_end(result)
-                break
-
-    def _dealer_turn(self, dealer_hand, dealer_sum, client_sum, deck, client_hand):
-        """Execute the dealer's turn."""
-        print("\n--- Dealer's Turn ---")
-
-        while True:
-            # reveal current hidden card
-            hidden = dealer_hand[-1]
-            card_str = self._format_card(hidden[1], hidden[0])
-            print(f"{self.server_name} drew {card_str}")
-
-            # add its value to the dealer sum
-            dealer_sum += get_card_value(hidden)
-
-            # check if busted
+                log.event(DEBUG, "stand", "{client} stands with {total}", client=self.client_name, total=hand.total)
+                return True
+
+    def _dealer_turn(self):
+        """
+        Reveals the dealer's cards to a client who stood, the dealer already drew them all (see dealer_draw).
+        The last card goes out with the result of the round.
+        """
+        log = self.log
+        log.event(DEBUG, "dealer_turn", "\n--- Dealer's Turn ---", client=self.client_name)
+        dealer_hand = self.dealer_hand.cards
+        client_sum = self.client_hand.total
+        # the total the client has seen so far, it only reaches the dealer hand's total with the last card
+        dealer_sum, soft = add_card(0, 0, CARD_VALUE[dealer_hand[0]])
+
+        for shown in range(1, len(dealer_hand)):
+            # reveal the next card and add its value to the dealer sum
+            card = dealer_hand[shown]
+            log.event(DEBUG, "card", "{player} drew {card}", player=self.server_name, card=CARD_NAMES[card])
+            dealer_sum, soft = add_card(dealer_sum, soft, CARD_VALUE[card])
+
+            result = settle(client_sum, dealer_sum)
             if dealer_sum > 21:
-                result = 0x3  # Dealer busted, client wins
-                print(f"{self.server_name} busted with {dealer_sum}")
-            elif client_sum > dealer_sum:
-                result = 0x3  # Client wins
-            elif dealer_sum > client_sum:
-                result = 0x2  # Dealer wins
-            else:
-                result = 0x1  # Tie
-
-            if dealer_sum < 17:
+                log.event(DEBUG, "bust", "{player} busted with {total}", player=self.server_name, total=dealer_sum)
+
+            if dealer_sum < DEALER_STANDS_AT:
                 result = 0x0  # Keep playing
 
             # send the revealed card with correct result flag
-            self.client_socket.sendall(pack_server_payload(result, hidden[1], hidden[0]))
-
-            self._display_hands(client_hand, dealer_hand)
-
-            # if round ended we stop
-            if result != 0x0:
-                if result == 0x1:
-                    print(f"Tie! Both at {dealer_sum}")
-                elif result == 0x2:
-                    print(f"{self.server_name} wins! {self.server_name}: {dealer_sum}, {self.client_name}: {client_sum}")
-                else:  # result == 0x3
-                    print(f"{self.client_name} wins! {self.server_name}: {dealer_sum}, {self.client_name}: {client_sum}")
-                return result
-
-            # otherwise, draw next card but dont reveal it yet
-            card = deck.deal()
-            dealer_hand.append(card)
-
-    def _format_card(self, rank, suit):
-        """Convert rank and suit to readable card string."""
-        card_suit, card_rank = decode_card(rank, suit)
-        return f"{card_rank} of {card_suit}"
-
-    def _display_hands(self, client_hand, dealer_hand, hide_dealer_second=False):
-        """Display current hands."""
-        client_hand_str = [self._format_card(card[1], card[0]) for card in client_hand]
-
-        if hide_dealer_second and len(dealer_hand) > 1:
-            dealer_hand_str = [self._format_card(dealer_hand[0][1], dealer_hand[0][0]), "[Hidden]"]
+            yield SEND, result, CARD_RANK[card], CARD_SUIT[card]
+
+            self._display_hands(dealer_shown=shown + 1)
+
+        # the dealer stopped drawing, so the last card settled the round
+        if result == 0x1:
+            log.event(DEBUG, "showdown", "Tie! Both at {dealer}", client=self.client_name, dealer=dealer_sum)
         else:
-            dealer_hand_str = [self._format_card(card[1], card[0]) for card in dealer_hand]
+            log.event(DEBUG, "showdown", "{winner} wins! {server}: {dealer}, {client}: {total}",
+                      winner=self.server_name if result == 0x2 else self.client_name, server=self.server_name,
+                      dealer=dealer_sum, client=self.client_name, total=client_sum)
+        self._handle_round_end(result)
+        return result
+
+    def _display_hands(self, dealer_shown=None):
+        """Display current hands, dealer_shown is how many dealer cards the client has seen (None: all of them)."""
+        if not self.log.enabled_for(DEBUG):
+            return  # nobody would see them, so we do not even build the strings
+        client_hand_str = self.client_hand.names()
+        dealer_hand = self.dealer_hand
+
+        if dealer_shown is None or dealer_shown >= len(dealer_hand):
+            dealer_hand_str = dealer_hand.names()
+        else:
+            dealer_hand_str = dealer_hand.names(dealer_shown) + ["[Hidden]"]
 
-        print(f"{self.client_name} hand: {client_hand_str}")
-        print(f"{self.server_name} hand: {dealer_hand_str}\n")
+        self.log.event(DEBUG, "hands", "{client} hand: {client_hand}\n{server} hand: {dealer_hand}\n",
+                       client=self.client_name, client_hand=client_hand_str,
+                       server=self.server_name, dealer_hand=dealer_hand_str)
 
     def _handle_round_end(self, result):
         """Handles end of round - update stats."""
         self.rounds_played += 1
+        ROUNDS.inc()
+        RESULTS[result].inc()
+        if self.recorder:
+            self.recorder.end_round(result)
 
         if result == 1:
             self.stats['ties'] += 1
-            print(f"\nRound OVER: round ended in a tie.")
+            self.log.event(INFO, "round_end", "\nRound OVER: round ended in a tie.", client=self.client_name, result=result)
         elif result == 2:
             self.stats['losses'] += 1
-            print(f"\nRound OVER: round ended in a loss (client lost).")
+            self.log.event(INFO, "round_end", "\nRound OVER: round ended in a loss (client lost).",
+                           client=self.client_name, result=result)
         else:  # result == 3
             self.stats['wins'] += 1
-            print(f"\nRound OVER: round ended in a win (client won).")
+            self.log.event(INFO, "round_end", "\nRound OVER: round ended in a win (client won).",
+                           client=self.client_name, result=result)
+        if self.on_round_end:
+            self.on_round_end(self.client_name, result)
 
     def _display_final_stats(self):
         """Display final game statistics."""
-        print(f"\n{'=' * 50}")
-        print(f"GAME OVER: STATISTICS FOR {self.client_name} AFTER {self.rounds} rounds")
-        print(f"{self.client_name} wins: {self.stats['wins']} ({self.stats['wins'] / self.rounds * 100:.1f}%)")
-        print(f"{self.client_name} losses: {self.stats['losses']} ({self.stats['losses'] / self.rounds * 100:.1f}%)")
-        print(f"Ties: {self.stats['ties']} ({self.stats['ties'] / self.rounds * 100:.1f}%)")
-        print(f"{'=' * 50}\n")
\ No newline at end of file
+        if not self.log.enabled_for(INFO):
+            return
+        self.log.event(INFO, "game_over",
+                       "\n{line}\nGAME OVER: STATISTICS FOR {client} AFTER {rounds} rounds\n"
+                       "{client} wins: {wins} ({win_rate:.1f}%)\n"
+                       "{client} losses: {losses} ({loss_rate:.1f}%)\n"
+                       "Ties: {ties} ({tie_rate:.1f}%)\n{line}\n",
+                       line='=' * 50, client=self.client_name, rounds=self.rounds,
+                       wins=self.stats['wins'], win_rate=self.stats['wins'] / self.rounds * 100,
+                       losses=self.stats['losses'], loss_rate=self.stats['losses'] / self.rounds * 100,
+                       ties=self.stats['ties'], tie_rate=self.stats['ties'] / self.rounds * 100)
\ No newline at end of file
@@ -0,0 +1,227 @@
+import math
+import queue
+import selectors
+import socket
+import threading
+import time
+from Metrics import metrics
+from Protocol import FrameBuffer
+from ServerGameSession import SEND, DECISION_WAIT, SEND_LATENCY
+
+SCHEDULED = metrics.gauge("scheduler_sessions")  # sessions the scheduler currently drives
+WAITING = metrics.gauge("scheduler_waiting")  # of those, the ones parked in the selector waiting for bytes
+WAIT_TIMEOUTS = metrics.counter("scheduler_timeouts")  # waits the timer wheel expired
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel: a timeout is rounded up to whole ticks and hashed into one of the slots, scheduling and
+    cancelling are a dict insert and delete, and advancing only visits the slots whose tick passed.
+    Timeouts longer than the wheel wait some extra rotations in their slot. A timeout fires up to one tick late.
+    Not thread safe, only the scheduler's selector thread uses it.
+    """
+
+    def __init__(self, tick=0.1, slots=512):
+        self.tick = tick
+        self.slots = [{} for _ in range(slots)]  # entry -> rotations left before it expires
+        self.ticks = 0  # ticks done since started
+        self.started = time.monotonic()
+
+    def schedule(self, entry, timeout):
+        """Expires entry after timeout seconds, returns the slot to cancel it with."""
+        ticks = max(1, math.ceil(timeout / self.tick))
+        slot = (self.ticks + ticks) % len(self.slots)
+        self.slots[slot][entry] = (ticks - 1) // len(self.slots)
+        return slot
+
+    def cancel(self, entry, slot):
+        self.slots[slot].pop(entry, None)
+
+    def advance(self, now):
+        """Moves the wheel to now, returns the entries that expired on the way."""
+        expired = []
+        due = int((now - self.started) / self.tick)
+        while self.ticks < due:
+            self.ticks += 1
+            slot = self.slots[self.ticks % len(self.slots)]
+            if not slot:
+                continue
+            for entry, rotations in list(slot.items()):
+                if rotations:
+                    slot[entry] = rotations - 1
+                else:
+                    del slot[entry]
+                    expired.append(entry)
+        return expired
+
+
+class Task:
+    """One connection driven by the scheduler: its socket, its round steps and the receive in progress."""
+    __slots__ = ('sock', 'steps', 'frames', 'buffer', 'view', 'size', 'received', 'slot', 'waiting_since')
+
+    def __init__(self, sock, steps):
+        self.sock = sock
+        self.steps = steps
+        self.frames = FrameBuffer()
+        self.buffer = bytearray(64)
+        self.view = memoryview(self.buffer)
+        self.size = 0  # bytes the steps are waiting for
+        self.received = 0
+        self.slot = None  # timer wheel slot of the wait
+        self.waiting_since = 0.0
+
+
+class SessionScheduler:
+    """
+    Drives the round steps of many connections (see ServerGameSession, SEND / RECV) without a thread per client.
+    A generator is resumable already, so a session is a state machine that runs until it waits for its client:
+    a worker thread advances it until its next RECV, writes the frames it queued and parks it in the selector.
+    One selector thread waits on every parked socket with epoll (or the best selector of the platform), collects the
+    bytes of the wait and hands the session back to a worker once they are all there. Every wait's timeout lives in one
+    TimerWheel instead of a timeout per socket, an expired wait is thrown into the steps as socket.timeout like the
+    blocking driver does.
+    :parameter workers: threads advancing sessions, the game logic only runs between waits so a few are plenty
+    :parameter tick: timer wheel resolution in seconds, also the longest the selector sleeps
+    """
+
+    def __init__(self, workers=4, tick=0.1):
+        self.workers = workers
+        self.selector = selectors.DefaultSelector()
+        self.wheel = TimerWheel(tick)
+        self.ready = queue.SimpleQueue()  # (task, reply, error) for the workers
+        self.waits = queue.SimpleQueue()  # (task, timeout) for the selector thread to park
+        # workers wake the selector through this pair when they park a task
+        self.wake_reader, self.wake_writer = socket.socketpair()
+        self.wake_reader.setblocking(False)
+        self.wake_writer.setblocking(False)
+        self.selector.register(self.wake_reader, selectors.EVENT_READ, None)
+
+    def start(self):
+        """Starts the selector thread and the workers in the background."""
+        threading.Thread(target=self._select_loop, daemon=True).start()
+        for _ in range(self.workers):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def add(self, sock, steps):
+        """Drives steps (a generator of SEND / RECV operations) over sock, which is closed once the steps are done."""
+        sock.setblocking(False)
+        SCHEDULED.inc()
+        self.ready.put((Task(sock, steps), None, None))
+
+    def _work(self):
+        """Worker thread: advances the sessions that are ready until each waits again or ends."""
+        while True:
+            task, reply, error = self.ready.get()
+            self._advance(task, reply, error)
+
+    def _advance(self, task, reply, error):
+        steps = task.steps
+        while True:
+            try:
+                op = steps.throw(error) if error else steps.send(reply)
+            except Exception:  # StopIteration when the game is over, anything else is a failed session
+                self._finish(task)
+                return
+            reply, error = None, None
+            if op[0] == SEND:
+                task.frames.add(op[1], op[2], op[3])
+                continue
+            try:
+                self._flush(task)
+            except OSError as e:
+                error = ConnectionError(str(e))
+                continue
+            size = op[1]
+            if size > len(task.buffer):
+                task.buffer = bytearray(size)
+                task.view = memoryview(task.buffer)
+            task.size = size
+            task.received = 0
+            self.waits.put((task, op[2]))
+            try:
+                self.wake_writer.send(b'\0')
+            except BlockingIOError:
+                pass  # the selector has plenty of wake ups pending already
+            return
+
+    def _flush(self, task):
+        """Writes the queued frames of a task."""
+        if not task.frames.size:
+            return
+        started = time.perf_counter()
+        frames = task.frames.take()
+        try:
+            sent = task.sock.send(frames)
+        except BlockingIOError:
+            sent = 0
+        if sent < len(frames):
+            # the kernel buffer is full, rare with a few hundred bytes per burst, so we just finish blocking
+            task.sock.settimeout(5.0)
+            try:
+                task.sock.sendall(frames[sent:])
+            finally:
+                task.sock.setblocking(False)
+        SEND_LATENCY.observe(time.perf_counter() - started)
+
+    def _finish(self, task):
+        """The steps are done, the last frames go out and the connection closes."""
+        try:
+            self._flush(task)
+        except OSError:
+            pass
+        task.sock.close()
+        SCHEDULED.dec()
+
+    def _select_loop(self):
+        """Selector thread: parks waiting tasks, reads their bytes and expires their timeouts."""
+        selector = self.selector
+        wheel = self.wheel
+        while True:
+            for key, _ in selector.select(wheel.tick):
+                if key.data is None:
+                    try:
+                        while self.wake_reader.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    self._readable(key.data)
+            while True:
+                try:
+                    task, timeout = self.waits.get_nowait()
+                except queue.Empty:
+                    break
+                task.slot = wheel.schedule(task, timeout)
+                task.waiting_since = time.perf_counter()
+                selector.register(task.sock, selectors.EVENT_READ, task)
+                WAITING.inc()
+            for task in wheel.advance(time.monotonic()):
+                WAIT_TIMEOUTS.inc()
+                self._resume(task, None, socket.timeout("timed out"))
+
+    def _readable(self, task):
+        """Receives what arrived for a parked task, resumes it once the wait has all its bytes."""
+        try:
+            count = task.sock.recv_into(task.view[task.received:task.size])
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self.wheel.cancel(task, task.slot)
+            self._resume(task, None, ConnectionError(str(e)))
+            return
+        if not count:
+            self.wheel.cancel(task, task.slot)
+            self._resume(task, None, ConnectionError("Client disconnected"))
+            return
+        task.received += count
+        if task.received == task.size:
+            self.wheel.cancel(task, task.slot)
+            DECISION_WAIT.observe(time.perf_counter() - task.waiting_since)
+            # the parsers compare whole frames, on bytes that is twice as fast as on a view of our buffer
+            self._resume(task, bytes(task.view[:task.size]), None)
+
+    def _resume(self, task, reply, error):
+        """Takes a task out of the selector and hands it to a worker."""
+        self.selector.unregister(task.sock)
+        WAITING.dec()
+        self.ready.put((task, reply, error))
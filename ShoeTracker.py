@@ -0,0 +1,131 @@
+import functools
+from Deck import CARD_VALUE
+from StrategyTables import compute_tables, DECK_VALUES
+
+# Hi-Lo tag of every card value (index 0..11): 2 to 6 count +1, 7 to 9 count 0, tens and aces count -1
+HI_LO = (0, 0, 1, 1, 1, 1, 1, 0, 0, 0, -1, -1)
+
+
+def shoe_probabilities(counts):
+    """Probability of drawing each card value from a shoe holding counts[value] cards of it."""
+    total = sum(counts)
+    return tuple(count / total for count in counts)
+
+
+def difference(tables, base):
+    """tables - base, element by element, for the nested lists compute_tables returns (None entries stay None)."""
+    if tables is None:
+        return None
+    if isinstance(tables, (list, tuple)):
+        return [difference(item, base_item) for item, base_item in zip(tables, base)]
+    return tables - base
+
+
+@functools.lru_cache(maxsize=None)
+def removal_effects(decks):
+    """
+    The strategy tables (see StrategyTables.compute_tables) of a full shoe of decks, and the effect of removing one
+    card of each value on them: returns (base, effects), effects[value] is what the tables of the shoe short of one
+    such card differ from base by. Computed once per shoe size, a ShoeTracker only adds these effects up.
+    """
+    full = [count * decks for count in DECK_VALUES]
+    base = compute_tables(shoe_probabilities(full))
+    effects = [None] * 12
+    for value in range(2, 12):
+        short = list(full)
+        short[value] -= 1
+        effects[value] = difference(compute_tables(shoe_probabilities(short)), base)
+    return base, effects
+
+
+class ShoeTracker:
+    """
+    Client side memory of the shoe: which cards are left and the Hi-Lo running and true count, updated with every
+    card the server shows us (the raw rank and suit of unpack_server_payload). see() is constant time.
+    Dealer bust chances and Hit/Stand EVs follow the composition through the effects of removal: every card seen adds
+    its value's effect on the tables of a full shoe (see removal_effects), so nothing is recomputed per decision.
+    The effects are linear, they stay close to the exact numbers until deep into the shoe.
+    The server never tells us about its shuffles, so like Deck we reshuffle at the cut card (start_round) and
+    whenever a card shows up that our shoe has no copy of left.
+    We only know the cards we were shown: the dealer's hidden card of a round we busted in, or the hands of the
+    other seats at a table, go by unseen. skip() counts them so the cut card still comes at the right time.
+    :parameter decks: decks in the server's shoe (Server --decks)
+    :parameter penetration: the server's penetration (Server --penetration), 0 reshuffles every round
+    """
+
+    def __init__(self, decks=1, penetration=0.0):
+        self.decks = decks
+        self.size = 52 * decks
+        # the same cut card as Deck
+        self.cut = max(0, min(int(self.size * penetration), self.size - 52))
+        base, self.effects = removal_effects(decks)
+        self.base_dealer, self.base_stand_ev, self.base_hit_ev = base
+        self.reset()
+
+    def reset(self):
+        """A freshly shuffled shoe."""
+        self.ranks = [0] + [4 * self.decks] * 13  # cards left of every rank 1..13
+        self.removed = [0] * 12  # cards seen of every value since the shuffle
+        self.dealt = 0  # cards dealt since the shuffle, seen or not
+        self.running_count = 0
+        # dealer bust chance of every up card, kept up to date card by card
+        self.bust = [outcomes[-1] if outcomes else 0.0 for outcomes in self.base_dealer]
+
+    def see(self, rank, suit):
+        """A card the server showed us."""
+        if not self.ranks[rank]:
+            self.reset()  # no copy of it can be left, so the server must have shuffled
+        self.ranks[rank] -= 1
+        value = CARD_VALUE[(rank - 1) * 4 + suit]
+        self.removed[value] += 1
+        self.dealt += 1
+        self.running_count += HI_LO[value]
+        dealer_effect = self.effects[value][0]
+        bust = self.bust
+        for up in range(2, 12):
+            bust[up] += dealer_effect[up][-1]
+
+    def skip(self, count=1):
+        """count cards were dealt that we never saw."""
+        self.dealt += count
+
+    def start_round(self):
+        """A round starts, if the cut card came out the server shuffled before it."""
+        if self.dealt >= self.cut:
+            self.reset()
+
+    @property
+    def decks_remaining(self):
+        return max(self.size - self.dealt, 1) / 52
+
+    @property
+    def true_count(self):
+        """The running count per deck left in the shoe."""
+        return self.running_count / self.decks_remaining
+
+    def dealer_bust(self, up):
+        """Chance that the dealer busts when he shows a card of value up."""
+        return min(max(self.bust[up], 0.0), 1.0)
+
+    def _estimate(self, index, soft, total, up):
+        """One entry of the stand (index 1) or hit (index 2) EV table, moved by the effects of every card seen."""
+        base = self.base_stand_ev if index == 1 else self.base_hit_ev
+        ev = base[soft][total][up]
+        effects = self.effects
+        removed = self.removed
+        for value in range(2, 12):
+            if removed[value]:
+                ev += removed[value] * effects[value][index][soft][total][up]
+        return ev
+
+    def stand_ev(self, total, soft, up):
+        """EV of standing on total against up, in units won per round."""
+        return self._estimate(1, 1 if soft else 0, total, up)
+
+    def hit_ev(self, total, soft, up):
+        """EV of hitting total against up and playing on the best way, in units won per round."""
+        return self._estimate(2, 1 if soft else 0, total, up)
+
+    def decision(self, total, soft, up):
+        """Returns "Hit" or "Stand", whichever has the higher EV for the shoe that is left."""
+        return "Hit" if self.hit_ev(total, soft, up) > self.stand_ev(total, soft, up) else "Stand"
@@ -0,0 +1,97 @@
+import queue
+import random
+import threading
+import time
+from Metrics import metrics
+
+# the generators a shoe can be shuffled with, the index is what a hand history records
+#   mt: Python's Mersenne Twister, seeded per session so a session can be replayed
+#   pcg: numpy's PCG64, seeded too and much faster on big shoes
+#   secure: the operating system's CSPRNG (what secrets uses), unpredictable and so never replayable
+#   pool: the shoe came pre-shuffled from a ShoePool, not replayable either
+RNG_KINDS = ("mt", "pcg", "secure", "pool")
+SEEDED = ("mt", "pcg")
+
+SHUFFLES = metrics.counter("shuffles")
+SHUFFLED_CARDS = metrics.counter("shuffled_cards")
+SHUFFLE_TIME = metrics.histogram("shuffle")
+POOL_HITS = metrics.counter("shoe_pool_hits")  # rounds that started with a ready shoe
+POOL_MISSES = metrics.counter("shoe_pool_misses")  # rounds that had to shuffle inline because the pool was empty
+POOL_READY = metrics.gauge("shoe_pool_ready")
+
+
+class NumpyRng:
+    """Shuffles a shoe in place with numpy's PCG64 generator, through a numpy view of the bytearray."""
+
+    def __init__(self, seed=None):
+        try:
+            import numpy  # only this generator needs numpy, so the server does not import it otherwise
+        except ImportError:
+            raise ValueError("the pcg generator needs numpy")
+        self.numpy = numpy
+        self.generator = numpy.random.default_rng(seed)
+
+    def shuffle(self, cards):
+        self.generator.shuffle(self.numpy.frombuffer(cards, dtype=self.numpy.uint8))
+
+
+def make_rng(kind="mt", seed=None):
+    """A generator of the given kind (see RNG_KINDS) with a shuffle(cards) method, seed is ignored by "secure"."""
+    if kind == "mt":
+        return random.Random(seed)
+    if kind == "pcg":
+        return NumpyRng(seed)
+    if kind == "secure":
+        return random.SystemRandom()
+    raise ValueError(f"unknown generator {kind}")
+
+
+def timed_shuffle(rng, cards):
+    """Shuffles cards in place with rng and accounts for it in the shuffle metrics."""
+    started = time.perf_counter()
+    rng.shuffle(cards)
+    SHUFFLE_TIME.observe(time.perf_counter() - started)
+    SHUFFLES.inc()
+    SHUFFLED_CARDS.inc(len(cards))
+
+
+class ShoePool:
+    """
+    Keeps up to size shuffled shoes ready, so a round that needs a new shoe swaps one in instead of shuffling inline.
+    A background thread shuffles with its own generator, the shoes the decks give back are reshuffled and reused.
+    When the pool runs dry the deck shuffles inline and the miss is counted.
+    """
+
+    def __init__(self, decks=1, rng="mt", size=64):
+        self.decks = decks
+        self.rng = make_rng(rng)
+        self.ready = queue.Queue(size)
+        self.used = queue.SimpleQueue()  # shoes given back, shuffled again before anything new is allocated
+        threading.Thread(target=self._produce, daemon=True).start()
+
+    def take(self, used=None):
+        """
+        Returns a shuffled shoe and keeps used (the shoe it replaces) for reshuffling,
+        or returns None when no shoe is ready.
+        """
+        try:
+            cards = self.ready.get_nowait()
+        except queue.Empty:
+            POOL_MISSES.inc()
+            return None
+        POOL_HITS.inc()
+        POOL_READY.dec()
+        if used is not None:
+            self.used.put(used)
+        return cards
+
+    def _produce(self):
+        """Background thread: shuffles shoes until the pool is full, then waits for room."""
+        while True:
+            try:
+                cards = self.used.get_nowait()
+            except queue.Empty:
+                cards = bytearray(range(52)) * self.decks
+            timed_shuffle(self.rng, cards)
+            self.ready.put(cards)  # blocks while the pool is full
+            POOL_READY.inc()
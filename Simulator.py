@@ -0,0 +1,174 @@
+import argparse
+import math
+import time
+import numpy as np
+from Deck import CARD_VALUE
+from Hand import add_card
+from ServerGameSession import DEALER_STANDS_AT, settle
+
+# card value of every card code as a numpy table, indexing it with a batch of shuffled decks gives their values
+VALUES = np.frombuffer(CARD_VALUE, dtype=np.uint8)
+# z score of a 95% confidence interval
+Z_95 = 1.96
+
+
+def threshold_strategy(stand_at=17):
+    """
+    Builds a strategy table that hits while the client sum is below stand_at, whatever the dealer shows, or below
+    stand_at[up] when stand_at is a sequence of 12 sums indexed by the dealer up card value.
+    A strategy table is a boolean array indexed by [client sum (0..21), dealer up card value (0..11)], True means Hit.
+    """
+    table = np.zeros((22, 12), dtype=bool)
+    if isinstance(stand_at, int):
+        table[:stand_at, :] = True
+    else:
+        for up, threshold in enumerate(stand_at):
+            table[:threshold, up] = True
+    return table
+
+
+def edge_interval(wins, losses, rounds):
+    """
+    The house edge of rounds rounds the client won wins and lost losses of, with its 95% confidence interval:
+    returns (edge, low, high). The client wins or loses one unit per round, the edge is what the house keeps on average.
+    """
+    edge = (losses - wins) / rounds
+    variance = (losses + wins) / rounds - edge * edge
+    margin = Z_95 * math.sqrt(variance / rounds)
+    return edge, edge - margin, edge + margin
+
+
+class Simulator:
+    """
+    Headless Monte Carlo engine that plays millions of rounds with the server rules (see ServerGameSession._play_round
+    and _dealer_turn): client gets 2 cards, dealer shows 1 and hides 1, client hits by the strategy table,
+    dealer then draws until DEALER_STANDS_AT and the round is settled like settle() does.
+    Every round is played on a freshly shuffled 52 card deck, whole batches of rounds at once as numpy arrays.
+    """
+
+    def __init__(self, strategy, seed=None, batch_size=100_000):
+        """
+        :parameter strategy: strategy table, see threshold_strategy
+        :parameter seed: seed of the numpy generator (an int or a numpy SeedSequence), the same seed always deals the
+            same decks
+        :parameter batch_size: rounds played per numpy batch
+        """
+        self.strategy = np.asarray(strategy, dtype=bool)
+        self.seed = seed
+        self.batch_size = batch_size
+
+    def run(self, rounds, vectorized=True):
+        """
+        Play rounds rounds and return their statistics.
+        vectorized=False plays the exact same decks one round at a time in plain python, it is the reference path
+        the vectorized one must always agree with.
+        """
+        rng = np.random.default_rng(self.seed)
+        counts = np.zeros(4, dtype=np.int64)  # indexed by result: 1 tie, 2 loss, 3 win
+        started = time.perf_counter()
+        remaining = rounds
+        while remaining > 0:
+            size = min(remaining, self.batch_size)
+            values = self._deal_batch(rng, size)
+            if vectorized:
+                results = self._play_batch(values)
+            else:
+                results = np.array([self._play_round(row) for row in values.tolist()], dtype=np.int8)
+            counts += np.bincount(results, minlength=4)
+            remaining -= size
+        elapsed = time.perf_counter() - started
+        return self._summarize(counts, rounds, elapsed)
+
+    def _deal_batch(self, rng, size):
+        """Shuffles size decks and returns the card values in dealing order, shape (size, 52)."""
+        decks = rng.permuted(np.tile(np.arange(52, dtype=np.uint8), (size, 1)), axis=1)
+        return VALUES[decks]
+
+    def _play_batch(self, values):
+        """Plays one round per row of values and returns the result of each (1 tie, 2 loss, 3 win)."""
+        size = len(values)
+        rows = np.arange(size)
+        # cards are dealt in the server order: client, client, dealer up, dealer hidden, then hits and dealer draws.
+        # the hands are added up with the same add_card as a Hand, just on whole columns at once
+        values = values.astype(np.int16)
+        client_sum, client_soft = add_card(*add_card(0, 0, values[:, 0]), values[:, 1])
+        up = values[:, 2].astype(np.intp)
+        dealer_sum, dealer_soft = add_card(*add_card(0, 0, values[:, 2]), values[:, 3])
+        position = np.full(size, 4, dtype=np.intp)
+
+        busted = np.zeros(size, dtype=bool)
+        playing = ~busted
+        while playing.any():
+            hitting = playing & self.strategy[np.minimum(client_sum, 21), up]
+            if not hitting.any():
+                break
+            drawn = rows[hitting]
+            client_sum[drawn], client_soft[drawn] = add_card(client_sum[drawn], client_soft[drawn],
+                                                             values[drawn, position[drawn]])
+            position[drawn] += 1
+            busted |= hitting & (client_sum > 21)
+            # whoever stood is done, whoever hit and did not bust decides again
+            playing = hitting & ~busted
+
+        # the dealer only plays against clients who did not bust
+        drawing = ~busted & (dealer_sum < DEALER_STANDS_AT)
+        while drawing.any():
+            drawn = rows[drawing]
+            dealer_sum[drawn], dealer_soft[drawn] = add_card(dealer_sum[drawn], dealer_soft[drawn],
+                                                             values[drawn, position[drawn]])
+            position[drawn] += 1
+            drawing &= dealer_sum < DEALER_STANDS_AT
+
+        # same order of checks as settle()
+        results = np.where(dealer_sum > 21, 3, np.where(client_sum > dealer_sum, 3, np.where(dealer_sum > client_sum, 2, 1)))
+        results[busted] = 2
+        return results.astype(np.int8)
+
+    def _play_round(self, values):
+        """Plays one round on a list of card values in dealing order, the scalar twin of _play_batch."""
+        client_sum, client_soft = add_card(*add_card(0, 0, values[0]), values[1])
+        up = values[2]
+        dealer_sum, dealer_soft = add_card(*add_card(0, 0, up), values[3])
+        position = 4
+        while self.strategy[client_sum, up]:
+            client_sum, client_soft = add_card(client_sum, client_soft, values[position])
+            position += 1
+            if client_sum > 21:
+                return 0x2
+        while dealer_sum < DEALER_STANDS_AT:
+            dealer_sum, dealer_soft = add_card(dealer_sum, dealer_soft, values[position])
+            position += 1
+        return settle(client_sum, dealer_sum)
+
+    def _summarize(self, counts, rounds, elapsed):
+        """Rates with their 95% confidence intervals, the house edge and the speed of the run."""
+        ties, losses, wins = (int(count) for count in counts[1:])
+        summary = {'rounds': rounds, 'wins': wins, 'losses': losses, 'ties': ties,
+                   'rounds_per_sec': rounds / elapsed if elapsed else float('inf')}
+        for name, count in (('win_rate', wins), ('loss_rate', losses), ('tie_rate', ties)):
+            rate = count / rounds
+            margin = Z_95 * math.sqrt(rate * (1 - rate) / rounds)
+            summary[name] = (rate, rate - margin, rate + margin)
+        summary['house_edge'] = edge_interval(wins, losses, rounds)
+        return summary
+
+
+def display_summary(summary):
+    """Display the statistics of a simulation run."""
+    print(f"\n{'=' * 50}")
+    print(f"SIMULATED {summary['rounds']} rounds at {summary['rounds_per_sec']:,.0f} rounds/sec")
+    for name in ('win_rate', 'loss_rate', 'tie_rate', 'house_edge'):
+        value, low, high = summary[name]
+        print(f"{name}: {value * 100:.3f}% (95% CI {low * 100:.3f}% .. {high * 100:.3f}%)")
+    print(f"{'=' * 50}\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Black Jack Monte Carlo simulator")
+    parser.add_argument("--rounds", type=int, default=1_000_000)
+    parser.add_argument("--stand-at", type=int, default=17, help="client hits while his sum is below this")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--scalar", action="store_true", help="play round by round in python (reference path)")
+    args = parser.parse_args()
+    simulator = Simulator(threshold_strategy(args.stand_at), args.seed)
+    display_summary(simulator.run(args.rounds, vectorized=not args.scalar))
@@ -0,0 +1,153 @@
+import argparse
+import sqlite3
+import threading
+import time
+from Metrics import metrics
+
+FLUSHES = metrics.counter("stats_flushes")
+FLUSHED_PLAYERS = metrics.counter("stats_flushed_players")
+FLUSH_LATENCY = metrics.histogram("stats_flush")
+FLUSH_ERRORS = metrics.counter("stats_flush_errors")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    name TEXT PRIMARY KEY,
+    wins INTEGER NOT NULL DEFAULT 0,
+    losses INTEGER NOT NULL DEFAULT 0,
+    ties INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL
+);
+-- the leaderboard is read from this index in order, it never scans or sorts the table
+CREATE INDEX IF NOT EXISTS players_by_net ON players ((wins - losses) DESC, wins DESC);
+"""
+
+UPSERT = """
+INSERT INTO players (name, wins, losses, ties, updated) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (name) DO UPDATE SET wins = wins + excluded.wins, losses = losses + excluded.losses,
+                                 ties = ties + excluded.ties, updated = excluded.updated
+"""
+
+
+class StatsStore:
+    """
+    Lifetime wins/losses/ties of every client name, kept in a SQLite database across sessions and restarts.
+    record() only adds the result to an in memory buffer (one dict update under a lock), a background thread
+    flushes the buffer every flush_interval seconds as one transaction of aggregated rows, so a slow disk delays
+    the stats and never the game. The database runs in WAL mode, so leaderboard queries never wait for a flush and
+    several server processes can share one file.
+    :parameter path: database file, created when missing
+    :parameter flush_interval: seconds between batched writes
+    """
+
+    def __init__(self, path="player_stats.db", flush_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.pending = {}  # client name -> [wins, losses, ties] not written yet
+        self.lock = threading.Lock()
+        # flushes write through their own connection, so queries never wait behind a slow write
+        self.writer = self._connect()
+        self.writer.executescript(SCHEMA)
+        self.write_lock = threading.Lock()
+        self.connection = self._connect()
+        self.query_lock = threading.Lock()
+        self.closed = False
+        self.thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self.thread.start()
+
+    def _connect(self):
+        # a long busy timeout because other server processes may be writing to the same file
+        connection = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")  # in WAL mode this is still safe against corruption
+        return connection
+
+    def record(self, client_name, result):
+        """Counts one round result (1 tie, 2 client lost, 3 client won), same signature as Server.result_listeners."""
+        with self.lock:
+            counts = self.pending.get(client_name)
+            if counts is None:
+                counts = self.pending[client_name] = [0, 0, 0]
+            # our [wins, losses, ties] layout puts result 3 first
+            counts[3 - result] += 1
+
+    def player(self, client_name):
+        """Lifetime stats of one client, including the results still waiting for a flush."""
+        # no flush may move results from the buffer into the table while we read both
+        with self.write_lock, self.query_lock:
+            row = self.connection.execute("SELECT wins, losses, ties FROM players WHERE name = ?",
+                                          (client_name,)).fetchone()
+            with self.lock:
+                pending = list(self.pending.get(client_name, (0, 0, 0)))
+        wins, losses, ties = row or (0, 0, 0)
+        return {'wins': wins + pending[0], 'losses': losses + pending[1], 'ties': ties + pending[2]}
+
+    def leaderboard(self, limit=10):
+        """The limit best clients by wins minus losses, as (name, wins, losses, ties) rows (flushed results only)."""
+        with self.query_lock:
+            return self.connection.execute(
+                "SELECT name, wins, losses, ties FROM players ORDER BY (wins - losses) DESC, wins DESC LIMIT ?",
+                (limit,)).fetchall()
+
+    def flush(self):
+        """
+        Writes the buffered results as one transaction of aggregated rows.
+        Returns False if the database failed us, the results then go back into the buffer for the next flush.
+        """
+        with self.write_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+            if not pending:
+                return True
+            started = time.perf_counter()
+            now = time.time()
+            try:
+                with self.writer:
+                    self.writer.executemany(UPSERT, [(name, wins, losses, ties, now)
+                                                     for name, (wins, losses, ties) in pending.items()])
+            except sqlite3.Error:
+                FLUSH_ERRORS.inc()
+                with self.lock:
+                    for name, counts in pending.items():
+                        buffered = self.pending.setdefault(name, [0, 0, 0])
+                        for index in range(3):
+                            buffered[index] += counts[index]
+                return False
+            FLUSHES.inc()
+            FLUSHED_PLAYERS.inc(len(pending))
+            FLUSH_LATENCY.observe(time.perf_counter() - started)
+            return True
+
+    def close(self):
+        """Stops the flush thread after writing everything that is still buffered."""
+        self.closed = True
+        self.thread.join()
+        self.flush()
+        self.writer.close()
+        self.connection.close()
+
+    def _flush_loop(self):
+        """Background thread: flushes the buffer every flush_interval seconds."""
+        while not self.closed:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+
+def display_leaderboard(rows):
+    """Display leaderboard rows."""
+    print(f"{'#':>3} {'client':<32} {'wins':>8} {'losses':>8} {'ties':>8}")
+    for place, (name, wins, losses, ties) in enumerate(rows, 1):
+        print(f"{place:>3} {name:<32} {wins:>8} {losses:>8} {ties:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Black Jack lifetime player statistics")
+    parser.add_argument("path", nargs="?", default="player_stats.db")
+    parser.add_argument("--top", type=int, default=10, help="leaderboard size")
+    parser.add_argument("--player", default=None, help="show one client's lifetime stats instead")
+    args = parser.parse_args()
+    store = StatsStore(args.path)
+    if args.player:
+        print(store.player(args.player))
+    else:
+        display_leaderboard(store.leaderboard(args.top))
+    store.close()
@@ -0,0 +1,255 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import numpy as np
+from Simulator import Simulator, threshold_strategy, edge_interval
+from StrategyTables import RULES
+
+DEFAULT_PATH = "ranked_policies.json"
+DEFAULT_CHECKPOINT = "optimizer_checkpoint.json"
+# sums a policy may stand on for an up card, it hits below them
+THRESHOLDS = tuple(range(12, 19))
+UP_CARDS = tuple(range(2, 12))
+
+
+def evaluate(stand_at, seed, rounds):
+    """
+    Process pool task: plays rounds rounds of the threshold policy stand_at on the decks of seed.
+    Returns (wins, losses, ties).
+    """
+    summary = Simulator(threshold_strategy(stand_at), seed).run(rounds)
+    return summary['wins'], summary['losses'], summary['ties']
+
+
+class Candidate:
+    """One policy of a race and the rounds it played so far."""
+    __slots__ = ('stand_at', 'wins', 'losses', 'ties', 'rounds', 'alive')
+
+    def __init__(self, stand_at, wins=0, losses=0, ties=0, rounds=0, alive=True):
+        self.stand_at = list(stand_at)  # the sum it stands on for every dealer up card value, indexed 0..11
+        self.wins = wins
+        self.losses = losses
+        self.ties = ties
+        self.rounds = rounds
+        self.alive = alive
+
+    def add(self, wins, losses, ties):
+        self.wins += wins
+        self.losses += losses
+        self.ties += ties
+        self.rounds += wins + losses + ties
+
+    def interval(self):
+        """(house edge, low, high) of the rounds played, see Simulator.edge_interval."""
+        return edge_interval(self.wins, self.losses, self.rounds)
+
+    def to_json(self):
+        return {'stand_at': self.stand_at, 'wins': self.wins, 'losses': self.losses, 'ties': self.ties,
+                'rounds': self.rounds, 'alive': self.alive}
+
+
+class StrategyOptimizer:
+    """
+    Searches threshold policies (stand on a sum that depends on the dealer up card) with the Simulator, one up card
+    at a time: for every up card it races the thresholds of THRESHOLDS against each other, the other up cards fixed
+    to the best found so far, and keeps the winner. Passes over all up cards repeat until one changes nothing.
+    A race plays chunks of chunk_rounds rounds of every candidate on a process pool. Chunk k of a race deals the same
+    decks to every candidate (common random numbers, so their differences are far less noisy than their edges)
+    from its own independent stream: SeedSequence(entropy, spawn_key=(race, k)) is the child that
+    SeedSequence(entropy).spawn() and then its own spawn() would give, without having to spawn the ones before it.
+    A candidate drops out as soon as its confidence interval is entirely worse than the leader's, a race ends when
+    one candidate is left or all of them played max_rounds.
+    The state goes to the checkpoint file after every step, an optimizer made with the same checkpoint resumes there.
+    :parameter seed: entropy of the root SeedSequence, None draws a fresh one (it is checkpointed)
+    :parameter passes: most passes over all up cards
+    """
+
+    def __init__(self, checkpoint=DEFAULT_CHECKPOINT, seed=None, chunk_rounds=100_000, max_rounds=2_000_000,
+                 passes=3):
+        self.checkpoint = checkpoint
+        self.chunk_rounds = chunk_rounds
+        self.max_rounds = max_rounds
+        self.passes = passes
+        self.entropy = np.random.SeedSequence(seed).entropy
+        self.best = [17] * 12  # stand_at of the best policy so far
+        self.race_number = 0
+        self.pass_number = 0
+        self.up_index = 0  # index into UP_CARDS of the up card being raced
+        self.changed = False  # whether this pass changed a threshold yet
+        self.done = False
+        self.race = []  # Candidates of the current race, empty between races
+        self.chunks = 0  # chunks every candidate of the current race played
+        self.results = {}  # stand_at tuple -> [wins, losses, ties] over every race it took part in
+        if checkpoint and os.path.exists(checkpoint):
+            self._load()
+
+    def _load(self):
+        """Resumes from the checkpoint, it must come from a run with the same settings."""
+        with open(self.checkpoint) as file:
+            state = json.load(file)
+        if (state['rules'], state['chunk_rounds'], state['max_rounds'], state['thresholds']) != \
+                (RULES, self.chunk_rounds, self.max_rounds, list(THRESHOLDS)):
+            raise ValueError(f"{self.checkpoint} is the checkpoint of a run with other settings")
+        self.entropy = state['entropy']
+        self.best = state['best']
+        self.race_number = state['race_number']
+        self.pass_number = state['pass_number']
+        self.up_index = state['up_index']
+        self.changed = state['changed']
+        self.done = state['done']
+        self.race = [Candidate(**candidate) for candidate in state['race']]
+        self.chunks = state['chunks']
+        self.results = {tuple(result[0]): result[1] for result in state['results']}
+
+    def _save(self):
+        """Writes the checkpoint, through a temporary file so a crash mid write keeps the previous one."""
+        if not self.checkpoint:
+            return
+        state = {'rules': RULES, 'chunk_rounds': self.chunk_rounds, 'max_rounds': self.max_rounds,
+                 'thresholds': list(THRESHOLDS), 'entropy': self.entropy, 'best': self.best,
+                 'race_number': self.race_number, 'pass_number': self.pass_number, 'up_index': self.up_index,
+                 'changed': self.changed, 'done': self.done, 'race': [candidate.to_json() for candidate in self.race],
+                 'chunks': self.chunks, 'results': [[list(stand_at), counts] for stand_at, counts in self.results.items()]}
+        with open(self.checkpoint + ".tmp", 'w') as file:
+            json.dump(state, file)
+        os.replace(self.checkpoint + ".tmp", self.checkpoint)
+
+    def run(self, workers=None, progress=None):
+        """
+        Searches until done and returns the ranking (see ranking).
+        :parameter workers: processes of the pool, None for one per CPU
+        :parameter progress: optional callable(up, Candidate winner, dropped) called after every race
+        """
+        workers = workers or os.cpu_count() or 1
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            while not self.done:
+                if not self.race:
+                    self._start_race()
+                while self._racing():
+                    self._step(pool, workers)
+                    self._save()
+                up, winner, dropped = self._finish_race()
+                self._save()
+                if progress:
+                    progress(up, winner, dropped)
+        return self.ranking()
+
+    def _start_race(self):
+        """Candidates for the current up card: every threshold, the rest of the policy is the best one so far."""
+        up = UP_CARDS[self.up_index]
+        self.race = []
+        for threshold in THRESHOLDS:
+            stand_at = list(self.best)
+            stand_at[up] = threshold
+            self.race.append(Candidate(stand_at))
+        self.chunks = 0
+
+    def _racing(self):
+        return sum(candidate.alive for candidate in self.race) > 1 and self.chunks * self.chunk_rounds < self.max_rounds
+
+    def _step(self, pool, workers):
+        """Plays more chunks of every live candidate, enough to keep every worker busy, then drops the losers."""
+        alive = [candidate for candidate in self.race if candidate.alive]
+        remaining = -(-self.max_rounds // self.chunk_rounds) - self.chunks
+        chunks = range(self.chunks, self.chunks + min(remaining, max(1, workers // len(alive))))
+        futures = [(candidate, pool.submit(evaluate, candidate.stand_at,
+                                           np.random.SeedSequence(self.entropy, spawn_key=(self.race_number, chunk)),
+                                           self.chunk_rounds))
+                   for chunk in chunks for candidate in alive]
+        for candidate, future in futures:
+            candidate.add(*future.result())
+        self.chunks = chunks.stop
+        # the leader has the lowest house edge, whoever is surely worse than it is out
+        leader_high = min(candidate.interval() for candidate in alive)[2]
+        for candidate in alive:
+            if candidate.interval()[1] > leader_high:
+                candidate.alive = False
+
+    def _finish_race(self):
+        """
+        Keeps the winner of the race and moves on to the next up card.
+        Returns (the up card raced, the winning Candidate, how many candidates dropped out early).
+        """
+        up = UP_CARDS[self.up_index]
+        winner = min((candidate for candidate in self.race if candidate.alive), key=lambda candidate: candidate.interval())
+        dropped = sum(not candidate.alive for candidate in self.race)
+        for candidate in self.race:
+            counts = self.results.setdefault(tuple(candidate.stand_at), [0, 0, 0])
+            counts[0] += candidate.wins
+            counts[1] += candidate.losses
+            counts[2] += candidate.ties
+        if winner.stand_at != self.best:
+            self.best = winner.stand_at
+            self.changed = True
+        self.race = []
+        self.race_number += 1
+        self.up_index += 1
+        if self.up_index == len(UP_CARDS):
+            self.up_index = 0
+            self.pass_number += 1
+            self.done = not self.changed or self.pass_number >= self.passes
+            self.changed = False
+        return up, winner, dropped
+
+    def ranking(self):
+        """
+        Every policy that was raced, the best first: ranked by the high end of the house edge's confidence interval,
+        so a policy only measured briefly does not outrank the well measured ones by luck. A policy that took part
+        in several races has the rounds of all of them, they were played on independent decks.
+        """
+        policies = []
+        for stand_at, (wins, losses, ties) in self.results.items():
+            rounds = wins + losses + ties
+            edge, low, high = edge_interval(wins, losses, rounds)
+            policies.append({'stand_at': list(stand_at), 'house_edge': edge, 'low': low, 'high': high,
+                             'rounds': rounds})
+        policies.sort(key=lambda policy: policy['high'])
+        return policies
+
+
+def save_ranking(policies, path=DEFAULT_PATH):
+    """Writes the ranked policy table that BotClient.policy_strategy loads."""
+    with open(path, 'w') as file:
+        json.dump({'rules': RULES, 'policies': policies}, file, indent=1)
+
+
+def load_ranking(path=DEFAULT_PATH):
+    """Reads a ranked policy table, it must have been searched under the current rules."""
+    with open(path) as file:
+        ranked = json.load(file)
+    if ranked.get('rules') != RULES:
+        raise ValueError(f"{path} was searched under other rules than {RULES}")
+    return ranked['policies']
+
+
+def display_policy(policy, rank):
+    """Display one ranked policy."""
+    thresholds = " ".join(f"{policy['stand_at'][up]:>2}" for up in UP_CARDS)
+    print(f"#{rank:<3} {thresholds}  edge {policy['house_edge'] * 100:.3f}% "
+          f"(95% CI {policy['low'] * 100:.3f}% .. {policy['high'] * 100:.3f}%) over {policy['rounds']:,} rounds")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the best stand threshold for every dealer up card")
+    parser.add_argument("--workers", type=int, default=None, help="processes of the pool, default one per CPU")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--chunk-rounds", type=int, default=100_000, help="rounds of one task of the pool")
+    parser.add_argument("--max-rounds", type=int, default=2_000_000, help="most rounds a candidate plays per race")
+    parser.add_argument("--passes", type=int, default=3, help="most passes over all the up cards")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="progress file, an existing one is resumed")
+    parser.add_argument("--output", default=DEFAULT_PATH, help="where the ranked policy table goes")
+    parser.add_argument("--top", type=int, default=10, help="how many of the ranked policies to print")
+    args = parser.parse_args()
+
+    def progress(up, winner, dropped):
+        edge, low, high = winner.interval()
+        print(f"up card {up:>2}: stand at {winner.stand_at[up]}, edge {edge * 100:.3f}% over {winner.rounds:,} rounds "
+              f"({dropped} of {len(THRESHOLDS)} candidates dropped early)", flush=True)
+
+    optimizer = StrategyOptimizer(args.checkpoint, args.seed, args.chunk_rounds, args.max_rounds, args.passes)
+    policies = optimizer.run(args.workers, progress)
+    save_ranking(policies, args.output)
+    print("      " + " ".join(f"{up:>2}" for up in UP_CARDS))
+    for rank, policy in enumerate(policies[:args.top], 1):
+        display_policy(policy, rank)
@@ -0,0 +1,262 @@
+import argparse
+import functools
+import json
+import os
+from Hand import add_card
+from ServerGameSession import DEALER_STANDS_AT
+
+# where the computed tables are cached, computing them again is only needed when the rules change
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "strategy_tables.json")
+# stored next to the tables, a cache computed under other rules is ignored and recomputed
+RULES = f"soft aces, dealer stands at {DEALER_STANDS_AT}, no blackjack bonus"
+# final dealer totals in the order of the dealer_outcomes tuples, None stands for bust
+DEALER_FINALS = (17, 18, 19, 20, 21, None)
+# how many cards of each value (index 0..11) one deck has
+DECK_VALUES = tuple(0 if value < 2 else 16 if value == 10 else 4 for value in range(12))
+# probability of drawing each card value (index 0..11) from an infinite shoe: four 10 valued ranks, one of each other
+INFINITE_DECK = tuple(0.0 if value < 2 else (4 / 13 if value == 10 else 1 / 13) for value in range(12))
+
+
+def dealer_outcomes(up, probabilities=INFINITE_DECK):
+    """
+    Distribution of the dealer's final total when he shows up (a card value 2..11) and draws until DEALER_STANDS_AT
+    with the same chance of every value at every draw, returns the probability of every entry of DEALER_FINALS.
+    Exact for an infinite shoe only, a real shoe has a card less of every value drawn (see shoe_dealer_outcomes).
+    :parameter probabilities: probability of drawing each card value, indexed by value
+    """
+    @functools.lru_cache(maxsize=None)
+    def finals(total, soft):
+        if total >= DEALER_STANDS_AT:
+            outcome = [0.0] * len(DEALER_FINALS)
+            outcome[total - 17 if total <= 21 else -1] = 1.0
+            return outcome
+        outcome = [0.0] * len(DEALER_FINALS)
+        for value in range(2, 12):
+            if probabilities[value]:
+                for index, chance in enumerate(finals(*add_card(total, soft, value))):
+                    outcome[index] += probabilities[value] * chance
+        return outcome
+
+    return tuple(finals(*add_card(0, 0, up)))
+
+
+def shoe_dealer_outcomes(shoe, total, soft, left, memo):
+    """
+    Exact distribution of the dealer's final total when his hand is (total, soft) and he draws the rest from shoe,
+    returns a list with the probability of every entry of DEALER_FINALS.
+    :parameter shoe: list of the cards left of every value (index 0..11), changed while we recurse and restored after
+    :parameter left: sum(shoe)
+    :parameter memo: dict shared between calls, the same cards left and the same hand give the same distribution
+    """
+    key = (tuple(shoe), total, soft)
+    outcome = memo.get(key)
+    if outcome is not None:
+        return outcome
+    outcome = [0.0] * len(DEALER_FINALS)
+    for value in range(2, 12):
+        count = shoe[value]
+        if not count:
+            continue
+        chance = count / left
+        new_total, new_soft = add_card(total, soft, value)
+        if new_total >= DEALER_STANDS_AT:
+            outcome[new_total - 17 if new_total <= 21 else -1] += chance
+            continue
+        shoe[value] -= 1
+        for index, final_chance in enumerate(shoe_dealer_outcomes(shoe, new_total, new_soft, left - 1, memo)):
+            outcome[index] += chance * final_chance
+        shoe[value] += 1
+    memo[key] = outcome
+    return outcome
+
+
+def stand_ev(total, outcomes):
+    """EV of standing on total against a dealer that finishes with the DEALER_FINALS probabilities outcomes."""
+    ev = outcomes[-1]  # dealer busts, client wins
+    for final, chance in zip(DEALER_FINALS[:-1], outcomes[:-1]):
+        if total > final:
+            ev += chance
+        elif total < final:
+            ev -= chance
+    return ev
+
+
+def compute_tables(probabilities=INFINITE_DECK):
+    """
+    Computes the dealer outcomes of every up card and the Stand and best-play Hit EV of every
+    (client total, soft, dealer up card) state, assuming the client keeps playing optimally after a Hit.
+    Every card is drawn with the same probabilities, as from an infinite shoe, so this is fast but only approximates
+    a real shoe (see compute_shoe_tables). ShoeTracker takes the difference of two of these per card value.
+    Returns (dealer, stand_ev, hit_ev): dealer[up] is a dealer_outcomes tuple,
+    stand_ev[soft][total][up] and hit_ev[soft][total][up] are EVs in units won per round (0 where the state is impossible).
+    """
+    dealer = [dealer_outcomes(up, probabilities) if up >= 2 else None for up in range(12)]
+    stand_evs = [[[0.0] * 12 for _ in range(22)] for _ in range(2)]
+    hit_evs = [[[0.0] * 12 for _ in range(22)] for _ in range(2)]
+    for up in range(2, 12):
+        outcomes = dealer[up]
+
+        @functools.lru_cache(maxsize=None)
+        def best(total, soft):
+            return max(stand_ev(total, outcomes), hit(total, soft))
+
+        @functools.lru_cache(maxsize=None)
+        def hit(total, soft):
+            ev = 0.0
+            for value in range(2, 12):
+                if probabilities[value]:
+                    new_total, new_soft = add_card(total, soft, value)
+                    ev += probabilities[value] * (-1.0 if new_total > 21 else best(new_total, new_soft))
+            return ev
+
+        # evaluate from the highest totals down so the recursion stays shallow
+        for total in range(21, -1, -1):
+            for soft in (0, 1):
+                stand_evs[soft][total][up] = stand_ev(total, outcomes)
+                hit_evs[soft][total][up] = hit(total, soft)
+    return dealer, stand_evs, hit_evs
+
+
+def compute_shoe_tables(decks=1):
+    """
+    The tables of compute_tables, exact for a shoe of decks decks that is shuffled before the round (the server's
+    default, Server --penetration 0). Every card dealt changes the chances of the next one, so we work per hand
+    composition (which cards the client holds, not only their total) and follow every card the shoe can still deal
+    to the client and to the dealer. After a Hit the client plays on the best way for his exact cards.
+    The EVs of a (total, soft, up) state average the compositions that make it, weighted by how likely the client is
+    dealt each of them; dealer[up] is the dealer's distribution averaged over the client's first two cards.
+    The dealer's hidden card is never peeked at, so it is just another card of the shoe the client's hits come before.
+    Plain python recursion, seconds per deck count, which is why StrategyTables.load caches the result.
+    """
+    dealer = [None] * 12
+    stand_evs = [[[0.0] * 12 for _ in range(22)] for _ in range(2)]
+    hit_evs = [[[0.0] * 12 for _ in range(22)] for _ in range(2)]
+    for up in range(2, 12):
+        shoe = [count * decks for count in DECK_VALUES]
+        shoe[up] -= 1
+        size = sum(shoe)
+        # levels[n]: the cards left once the client holds n cards -> (total, soft, chance he is dealt those n cards)
+        levels = [{tuple(shoe): (0, 0, 1.0)}]
+        while levels[-1]:
+            following = {}
+            left = size - len(levels) + 1
+            for cards, (total, soft, chance) in levels[-1].items():
+                for value in range(2, 12):
+                    if cards[value]:
+                        new_total, new_soft = add_card(total, soft, value)
+                        if new_total <= 21:
+                            after = cards[:value] + (cards[value] - 1,) + cards[value + 1:]
+                            known = following.get(after)
+                            draw = chance * cards[value] / left
+                            following[after] = (new_total, new_soft, known[2] + draw if known else draw)
+            levels.append(following)
+
+        # from the longest hands back to two cards, a Hit only leads to hands of the level after
+        memo = {}
+        up_total, up_soft = add_card(0, 0, up)
+        dealer_sums = [0.0] * len(DEALER_FINALS)
+        weights = [[0.0] * 22 for _ in range(2)]
+        best_after = {}  # best EV of every composition of the level after
+        for count in range(len(levels) - 1, 1, -1):
+            left = size - count
+            best = {}
+            for cards, (total, soft, chance) in levels[count].items():
+                outcomes = shoe_dealer_outcomes(list(cards), up_total, up_soft, left, memo)
+                stand = stand_ev(total, outcomes)
+                hit = 0.0
+                for value in range(2, 12):
+                    if cards[value]:
+                        if add_card(total, soft, value)[0] > 21:
+                            hit -= cards[value] / left
+                        else:
+                            after = cards[:value] + (cards[value] - 1,) + cards[value + 1:]
+                            hit += cards[value] / left * best_after[after]
+                best[cards] = max(stand, hit)
+                stand_evs[soft][total][up] += chance * stand
+                hit_evs[soft][total][up] += chance * hit
+                weights[soft][total] += chance
+                if count == 2:
+                    for index, final_chance in enumerate(outcomes):
+                        dealer_sums[index] += chance * final_chance
+            best_after = best
+        dealer[up] = tuple(dealer_sums)
+        for soft in (0, 1):
+            for total in range(22):
+                if weights[soft][total]:
+                    stand_evs[soft][total][up] /= weights[soft][total]
+                    hit_evs[soft][total][up] /= weights[soft][total]
+    return dealer, stand_evs, hit_evs
+
+
+class StrategyTables:
+    """
+    Precomputed dealer outcome probabilities and Hit/Stand EVs under the project's rules, exact for a shoe of a given
+    number of decks shuffled before every round (see compute_shoe_tables).
+    Build it with load(), which computes the tables once per deck count and caches them on disk, every lookup after
+    that is plain list indexing so an automated client can call it on every decision.
+    """
+
+    def __init__(self, dealer, stand_ev, hit_ev):
+        self.dealer = dealer
+        self.stand_ev = stand_ev
+        self.hit_ev = hit_ev
+
+    @classmethod
+    def load(cls, decks=1, path=DEFAULT_PATH):
+        """
+        Loads the tables of decks cached at path, or computes them and adds them to the cache if they are missing or
+        the cache is stale. The cache holds the tables of every deck count computed so far.
+        """
+        cached = {'rules': RULES, 'decks': {}}
+        try:
+            with open(path) as file:
+                stored = json.load(file)
+            if stored['rules'] == RULES:
+                cached = stored
+                tables = cached['decks'][str(decks)]
+                return cls(tables['dealer'], tables['stand_ev'], tables['hit_ev'])
+        except (OSError, ValueError, KeyError):
+            pass
+        tables = cls(*compute_shoe_tables(decks))
+        cached['decks'][str(decks)] = {'dealer': tables.dealer, 'stand_ev': tables.stand_ev, 'hit_ev': tables.hit_ev}
+        try:
+            # through a temporary file, bots in other processes may be reading the cache while we write it
+            with open(path + f".{os.getpid()}.tmp", 'w') as file:
+                json.dump(cached, file)
+            os.replace(path + f".{os.getpid()}.tmp", path)
+        except OSError:
+            pass  # a read only install still works, it just computes the tables every run
+        return tables
+
+    def dealer_outcomes(self, up):
+        """Probabilities of the dealer finishing on 17, 18, 19, 20, 21 or busting when he shows a card of value up."""
+        return self.dealer[up]
+
+    def decision(self, total, soft, up):
+        """Returns "Hit" or "Stand", whichever has the higher EV for the client in this state."""
+        soft = 1 if soft else 0
+        return "Hit" if self.hit_ev[soft][total][up] > self.stand_ev[soft][total][up] else "Stand"
+
+    def hit_table(self, soft=False):
+        """The decisions as a strategy table for the Simulator, indexed by [total][up], True means Hit."""
+        soft = 1 if soft else 0
+        return [[self.hit_ev[soft][total][up] > self.stand_ev[soft][total][up] for up in range(12)]
+                for total in range(22)]
+
+
+@functools.lru_cache(maxsize=None)
+def get_tables(decks=1, path=DEFAULT_PATH):
+    """Process wide memoized StrategyTables of a shoe of decks, loaded from disk on the first call."""
+    return StrategyTables.load(decks, path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the basic strategy of the project's rules")
+    parser.add_argument("--decks", type=int, default=1, help="decks in the server's shoe (Server --decks)")
+    parser.add_argument("--path", default=DEFAULT_PATH)
+    args = parser.parse_args()
+    tables = get_tables(args.decks, args.path)
+    print("total " + " ".join(f"{up:>2}" for up in range(2, 12)))
+    for total in range(4, 22):
+        print(f"{total:>5} " + " ".join(" H" if tables.decision(total, False, up) == "Hit" else " S"
+                                        for up in range(2, 12)))
@@ -0,0 +1,166 @@
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from EventLog import add_log_arguments, log_from_args
+from Metrics import add_metrics_arguments, expose_metrics
+from Server import Server, LISTEN_BACKLOG, stop_on_signals
+
+
+class Supervisor:
+    """
+    Pre-forks several server worker processes that all accept on one shared TCP port, so tables are spread
+    over every core instead of sharing one GIL.
+    Only worker 0 broadcasts the UDP offers, and it advertises the shared port.
+    """
+
+    def __init__(self, workers=None, mode="threads", reuse_port=None, server_options=None, worker_setup=None):
+        """
+        :parameter workers: number of worker processes, defaults to the number of cores
+        :parameter mode: the accept mode each worker runs ("threads", "asyncio" or "selectors")
+        :parameter reuse_port: give every worker its own listening socket with SO_REUSEPORT so the kernel balances
+            the accepts, otherwise the workers inherit one listening socket from us. defaults to SO_REUSEPORT when available.
+        :parameter server_options: extra keyword arguments for every worker's Server (decks, penetration...)
+        :parameter worker_setup: optional callable(index) every worker runs right after it started
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.mode = mode
+        self.server_options = server_options or {}
+        self.worker_setup = worker_setup
+        self.reuse_port = hasattr(socket, "SO_REUSEPORT") if reuse_port is None else reuse_port
+        # workers inherit our sockets and counters, so we need fork and not spawn
+        self.context = multiprocessing.get_context("fork")
+        self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.reuse_port:
+            # we only hold the port here, the workers bind their own listening sockets on it
+            self.tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self.tcp_socket.bind(('0.0.0.0', 0))
+        else:
+            self.tcp_socket.bind(('0.0.0.0', 0))
+            self.tcp_socket.listen(LISTEN_BACKLOG)
+        self.tcp_port = self.tcp_socket.getsockname()[1]
+        # one (wins, losses, ties) slot per worker, every worker only writes its own slot so they never share a lock
+        self.counters = [self.context.Array('q', 3) for _ in range(self.workers)]
+        self.processes = [None] * self.workers
+
+    def start(self, report_interval=10.0):
+        """Starts the workers and keeps them alive, printing the rolled up stats every report_interval seconds."""
+        print(f"Supervisor starting {self.workers} workers on TCP port {self.tcp_port}")
+        try:
+            while True:
+                for index, process in enumerate(self.processes):
+                    if process is None or not process.is_alive():
+                        self._spawn(index)
+                time.sleep(report_interval)
+                self._display_stats()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+            self._display_stats()
+
+    def stop(self, timeout=10.0):
+        """
+        Stops every worker the way ctrl+c stops a server, so each one closes its history and stats on the way out
+        (see Server.stop_on_signals), and waits for them. Only a worker still running after timeout seconds is killed.
+        """
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                os.kill(process.pid, signal.SIGINT)
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            if process is not None:
+                process.join(max(0.0, deadline - time.monotonic()))
+                if process.is_alive():
+                    process.kill()
+                    process.join()
+
+    def stats(self):
+        """Returns the wins/losses/ties of the whole server, summed over all the workers."""
+        totals = {'wins': 0, 'losses': 0, 'ties': 0}
+        for counter in self.counters:
+            wins, losses, ties = counter[:]
+            totals['wins'] += wins
+            totals['losses'] += losses
+            totals['ties'] += ties
+        return totals
+
+    def _spawn(self, index):
+        """Starts (or restarts) worker number index."""
+        process = self.context.Process(target=run_worker, daemon=True,
+                                       args=(index, self.tcp_socket, self.tcp_port, self.reuse_port,
+                                             self.counters[index], self.mode, self.server_options,
+                                             self.worker_setup))
+        process.start()
+        self.processes[index] = process
+
+    def _display_stats(self):
+        """Display the rolled up statistics of all the workers."""
+        stats = self.stats()
+        print(f"Server totals: {stats['wins']} client wins, {stats['losses']} client losses, {stats['ties']} ties")
+
+
+def run_worker(index, tcp_socket, tcp_port, reuse_port, counter, mode, server_options, worker_setup=None):
+    """
+    Entry point of a worker process: a normal Server on the shared port reporting its results into counter.
+    It serves until SIGINT or SIGTERM, a worker process leaves through os._exit without running atexit, so the
+    server must have closed its files by then.
+    """
+    stop_on_signals()
+    if worker_setup:
+        worker_setup(index)
+    if reuse_port:
+        tcp_socket.close()
+        tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        tcp_socket.bind(('0.0.0.0', tcp_port))
+        tcp_socket.listen(LISTEN_BACKLOG)
+    if server_options.get('history'):
+        # buffered appends of several processes would interleave, so every worker records into its own file
+        server_options = dict(server_options, history=f"{server_options['history']}.{index}")
+    server = Server(tcp_socket, broadcast=index == 0, **server_options)
+
+    def count_result(client_name, result):
+        # result is 1 tie, 2 client lost, 3 client won, our slot layout is (wins, losses, ties)
+        with counter.get_lock():
+            counter[3 - result] += 1
+
+    server.result_listeners.append(count_result)
+    try:
+        server.start(mode)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Black Jack multi-process server")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, defaults to the number of cores")
+    parser.add_argument("--mode", choices=["threads", "asyncio", "selectors"], default="threads")
+    parser.add_argument("--no-reuse-port", action="store_true",
+                        help="share one inherited listening socket instead of SO_REUSEPORT")
+    parser.add_argument("--decks", type=int, default=1, help="decks in every shoe, e.g. 6 or 8")
+    parser.add_argument("--penetration", type=float, default=0.0,
+                        help="fraction of the shoe dealt before reshuffling, 0 reshuffles every round")
+    parser.add_argument("--table-seats", type=int, default=1, help="clients sharing one table, shoe and dealer")
+    parser.add_argument("--stats-db", default=None, help="SQLite file all the workers keep lifetime stats in")
+    parser.add_argument("--history", default=None, help="hand history file, every worker appends to its own PATH.index")
+    parser.add_argument("--max-sessions", type=int, default=0, help="clients every worker plays at once")
+    parser.add_argument("--max-pending", type=int, default=0, help="clients every worker lets wait for a session")
+    parser.add_argument("--max-per-ip", type=int, default=0, help="connections one address may hold per worker")
+    parser.add_argument("--offer-to", action="append", default=[], help="also send offers straight to this address")
+    parser.add_argument("--rng", choices=["mt", "pcg", "secure"], default="mt", help="shuffling generator")
+    parser.add_argument("--shoe-pool", type=int, default=0, help="shoes every worker keeps shuffled ahead")
+    add_log_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    # the log's writer thread only starts on the first event, so every worker gets its own after the fork
+    supervisor = Supervisor(args.workers, args.mode, False if args.no_reuse_port else None,
+                            {'decks': args.decks, 'penetration': args.penetration, 'log': log_from_args(args),
+                             'table_seats': args.table_seats, 'stats_db': args.stats_db, 'history': args.history,
+                             'rng': args.rng, 'shoe_pool': args.shoe_pool, 'offer_to': args.offer_to,
+                             'max_sessions': args.max_sessions, 'max_pending': args.max_pending,
+                             'max_per_ip': args.max_per_ip},
+                            lambda index: expose_metrics(args, index))
+    supervisor.start()
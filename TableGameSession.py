@@ -0,0 +1,216 @@
+import threading
+from Deck import Deck
+from EventLog import default_log, INFO, WARNING
+from Hand import Hand
+from Metrics import metrics
+from Protocol import FLAG_KEEP_ALIVE, FLAG_TABLE_RESULTS, pack_table_result
+from ServerGameSession import dealer_draw
+from Shuffling import make_rng
+
+# seats around one table, like a real casino table
+MAX_SEATS = 7
+
+ACTIVE_TABLES = metrics.gauge("active_tables")
+TABLE_ROUNDS = metrics.counter("table_rounds")
+ACTIVE_SESSIONS = metrics.gauge("active_sessions")  # the same gauge the Server counts its sessions in, a seat is one
+SEAT_FAILURES = metrics.counter("seat_failures")  # seats that timed out or disconnected and left the table
+
+
+def flush_frames():
+    """Round steps that do nothing, driving them just writes whatever frames a seat still has queued."""
+    return
+    yield
+
+
+class TableGameSession:
+    """
+    Up to MAX_SEATS clients playing against one dealer from one shared shoe.
+    Every seat is a ServerGameSession whose round steps the table plays for each seat in turn: the cards are dealt
+    round-robin, then every seat decides with its own decision timeout, then the dealer draws once for the whole
+    table and every seat that stood gets the dealer's cards with its own result. Seats that asked for
+    FLAG_TABLE_RESULTS then also get the results of the other seats.
+    Clients join between rounds and leave when they played all their rounds or their connection failed,
+    the table closes once its last seat left. A seat that kept FLAG_KEEP_ALIVE (a Tournament player) leaves with his
+    connection open, his on_close takes it back.
+    """
+
+    def __init__(self, server_name, seats=MAX_SEATS, decks=1, penetration=0.0, log=None, rng="mt", pool=None):
+        """
+        :parameter seats: how many clients may sit at this table (at most MAX_SEATS)
+        :parameter decks: decks in the shared shoe, the shoe keeps a full deck behind its cut card which is plenty
+            for a round of MAX_SEATS hands
+        :parameter rng: kind of generator the shared shoe is shuffled with (see Shuffling.RNG_KINDS)
+        :parameter pool: Shuffling.ShoePool the shared shoe takes pre-shuffled shoes from
+        """
+        self.server_name = server_name
+        self.capacity = max(1, min(seats, MAX_SEATS))
+        self.deck = Deck(decks, penetration, make_rng(rng), pool)
+        self.log = log or default_log
+        # every seat's dealer_hand is this Hand, so the dealer's cards are drawn once for all of them
+        self.dealer_hand = Hand()
+        self.seats = []
+        self.joining = []  # seated while a round was running, they play from the next round on
+        self.streams = {}  # seat -> (reader, writer) when the table runs on asyncio
+        self.failed = set()  # seats whose connection failed this round
+        self.closed = False
+        self.lock = threading.Lock()  # clients join from the accepting threads
+
+    def join(self, session, streams=None):
+        """
+        Seats a client for his next round, returns False if the table is full or already closed.
+        :parameter streams: (reader, writer) of the client when the table is played with play_async
+        """
+        with self.lock:
+            if self.closed or len(self.seats) + len(self.joining) >= self.capacity:
+                return False
+            session.dealer_hand = self.dealer_hand
+            if streams is not None:
+                self.streams[session] = streams
+            self.joining.append(session)
+            ACTIVE_SESSIONS.inc()
+            return True
+
+    def play(self):
+        """Plays rounds over the blocking sockets of the seats until the table is empty."""
+        ACTIVE_TABLES.inc()
+        try:
+            while self._update_seats():
+                round_steps = self._play_round()
+                reply = None
+                while True:
+                    try:
+                        seat, steps, flush = round_steps.send(reply)
+                    except StopIteration:
+                        break
+                    try:
+                        reply = seat._run(steps, flush)
+                    except Exception as error:
+                        reply = self._fail(seat, error)
+        finally:
+            ACTIVE_TABLES.dec()
+
+    async def play_async(self):
+        """Coroutine version of play, every seat must have joined with its streams."""
+        ACTIVE_TABLES.inc()
+        try:
+            while self._update_seats():
+                round_steps = self._play_round()
+                reply = None
+                while True:
+                    try:
+                        seat, steps, flush = round_steps.send(reply)
+                    except StopIteration:
+                        break
+                    reader, writer = self.streams[seat]
+                    try:
+                        reply = await seat._run_async(steps, reader, writer, flush)
+                    except Exception as error:
+                        reply = self._fail(seat, error)
+        finally:
+            ACTIVE_TABLES.dec()
+
+    def _fail(self, seat, error):
+        """Marks a seat whose steps raised, it sits out the rest of the round and leaves after it."""
+        self.failed.add(seat)
+        SEAT_FAILURES.inc()
+        if not isinstance(error, OSError):
+            seat._failed(error)  # not a timeout or a disconnect, a bug that must not pass as a client leaving
+        self.log.event(WARNING, "seat_failed", "{client} left the table", client=seat.client_name)
+        return None
+
+    def _update_seats(self):
+        """Between rounds: lets the finished and failed seats leave and the joining ones sit. Returns False once empty."""
+        with self.lock:
+            leaving = [seat for seat in self.seats if seat in self.failed or seat.rounds_played >= seat.rounds]
+            joining = self.joining
+            self.seats = [seat for seat in self.seats if seat not in leaving] + joining
+            self.joining = []
+            self.failed.clear()
+            if not self.seats:
+                self.closed = True
+            streams = [self.streams.pop(seat, None) for seat in leaving]
+
+        for seat, seat_streams in zip(leaving, streams):
+            if seat.rounds_played >= seat.rounds:
+                seat._display_final_stats()
+            if seat.flags & FLAG_KEEP_ALIVE and seat.on_close:
+                pass  # his connection goes back to whoever seated him, through on_close
+            elif seat_streams is not None:
+                seat_streams[1].close()
+            elif seat.client_socket is not None:
+                seat.client_socket.close()
+            ACTIVE_SESSIONS.dec()
+            if seat.on_close:
+                seat.on_close()
+            self.log.event(INFO, "session_end", "Continuing to send offers...", client=seat.client_name)
+        for seat in joining:
+            self.log.event(INFO, "session_start", "\nStarting game with {client} for {rounds} rounds",
+                           client=seat.client_name, rounds=seat.rounds)
+        return not self.closed
+
+    def _play_round(self):
+        """
+        One round for every seat. Yields (seat, round steps of that seat, flush) for the driver to run and gets back
+        what the steps returned, or None when the seat failed.
+        """
+        deck = self.deck
+        if deck.needs_shuffle():
+            deck.shuffle()
+        seats = self.seats
+        for seat in seats:
+            seat._start_round()
+
+        # two cards for every seat, one card at a time around the table. the frames stay queued until the dealer's
+        # up card joins them, so every seat gets its whole deal in one write and can decide before its turn comes
+        # a seat whose connection failed sits out every step after it, it leaves the table after the round
+        for _ in range(2):
+            for seat in seats:
+                if seat not in self.failed:
+                    yield seat, seat._deal_to_client(deck.deal_code()), False
+
+        dealer_hand = self.dealer_hand
+        dealer_hand.add(deck.deal_code())
+        dealer_hand.add(deck.deal_code())
+        for seat in seats:
+            if seat not in self.failed:
+                yield seat, seat._show_dealer_cards(), True
+
+        # every seat decides in turn, each with its own decision timeout
+        standing = []
+        for seat in seats:
+            if seat not in self.failed and (yield seat, seat._client_turn(deck), False):
+                standing.append(seat)
+
+        # one dealer turn for the whole table, then every seat that stood sees it settled against his own hand
+        results = {seat: 0x2 for seat in seats if seat.client_hand.busted}
+        if standing:
+            dealer_sum = dealer_draw(deck, dealer_hand)
+            for seat in standing:
+                if seat not in self.failed:
+                    result = yield seat, seat._dealer_turn(), False
+                    if result:
+                        results[seat] = result
+
+        # every seat that asked for them gets the results of the other seats, queued behind his own last card so they
+        # leave with the frames that end his round. a seat that failed during the round is sent as result 0
+        table_results = [pack_table_result(results.get(seat, 0), number, len(seats))
+                         for number, seat in enumerate(seats, 1)]
+        for seat, own in zip(seats, table_results):
+            if seat.flags & FLAG_TABLE_RESULTS and seat not in self.failed:
+                for frame in table_results:
+                    if frame is not own:
+                        seat.frames.append(frame)
+
+        # like a single session, the frames that end a round leave together with the next round's deal:
+        # two small writes in a row without a read between them would wait on the client's delayed ack.
+        # only the seats that played their last round get theirs now
+        for seat in seats:
+            if seat.rounds_played >= seat.rounds and seat not in self.failed:
+                yield seat, flush_frames(), True
+
+        # and the whole table's results to the log
+        TABLE_ROUNDS.inc()
+        if self.log.enabled_for(INFO):
+            self.log.event(INFO, "table_round", "Table results (1 tie, 2 loss, 3 win): {results}",
+                           results=[(number, seat.client_name, results.get(seat)) for number, seat in enumerate(seats, 1)],
+                           dealer=dealer_sum if standing else None)
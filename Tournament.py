@@ -0,0 +1,277 @@
+import bisect
+import functools
+import math
+import threading
+import time
+from EventLog import default_log, INFO, WARNING
+from Metrics import metrics
+from Protocol import FLAG_KEEP_ALIVE
+from TableGameSession import TableGameSession, MAX_SEATS
+
+FORMATS = ("elimination", "round-robin")
+# seconds a player has to send his request for the next stage, his client sends it as soon as his table is done
+NEXT_STAGE_TIMEOUT = 12.0
+# what a round is worth in the standings, by result (1 tie, 2 client lost, 3 client won)
+SCORES = {1: 0, 2: -1, 3: 1}
+
+TOURNAMENTS = metrics.counter("tournaments")
+TOURNAMENT_STAGES = metrics.counter("tournament_stages")
+ELIMINATED = metrics.counter("tournament_eliminated")  # players who lost their place, failed or left mid tournament
+TOURNAMENT_PLAYERS = metrics.gauge("tournament_players")  # registered players still in the running tournament
+
+
+class Standings:
+    """
+    Players ordered by the last stage they reached and then their score, kept sorted while the results come in:
+    a result moves its player with two bisects instead of sorting everybody again. On a tie whoever registered
+    first stays ahead. Results come from the threads of all the tables at once.
+    """
+
+    def __init__(self):
+        self.order = []  # sorted keys (-stage, -score, number), the leader first
+        self.keys = {}  # number -> his key in order
+        self.names = {}
+        self.lock = threading.Lock()
+
+    def add(self, number, name):
+        with self.lock:
+            self.names[number] = name
+            self.keys[number] = key = (0, 0, number)
+            bisect.insort(self.order, key)
+
+    def _move(self, number, stage, score):
+        """Puts a player at his new key, the lock must be held."""
+        del self.order[bisect.bisect_left(self.order, self.keys[number])]
+        self.keys[number] = key = (-stage, -score, number)
+        bisect.insort(self.order, key)
+
+    def update(self, number, points):
+        """Adds points to the score of a player."""
+        if not points:
+            return
+        with self.lock:
+            stage, score, _ = self.keys[number]
+            self._move(number, -stage, -score + points)
+
+    def advance(self, number):
+        """The player goes on to the next stage, so he ranks above everybody who did not."""
+        with self.lock:
+            stage, score, _ = self.keys[number]
+            self._move(number, -stage + 1, -score)
+
+    def rank(self, number):
+        """1 for the leader."""
+        with self.lock:
+            return bisect.bisect_left(self.order, self.keys[number]) + 1
+
+    def top(self, count=None):
+        """The count best (all by default) as (number, name, score)."""
+        with self.lock:
+            return [(number, self.names[number], -score) for _, score, number in self.order[:count]]
+
+    def __len__(self):
+        return len(self.order)
+
+
+class Player:
+    """One tournament entrant, his session is reused for every stage he plays."""
+    __slots__ = ('number', 'session', 'release', 'finished')
+
+    def __init__(self, number, session, release):
+        self.number = number
+        self.session = session
+        self.release = release  # optional callable() once he is out, the Server frees his admission slot with it
+        self.finished = False  # whether he played every round of the last stage
+
+
+class Tournament:
+    """
+    Registers clients until entrants of them joined, then plays them in stages: every stage seats the players at
+    tables of up to seats players, all tables play their stage_rounds rounds at once, each on its own thread,
+    and the next stage starts once the last one is done. The standings are updated with every round of every table.
+    "elimination": after every stage only the best survivors fraction goes on (never fewer than a table full),
+        until the players fit at one table and play the final.
+    "round-robin": everybody plays stages stages, every one at tables mixed anew, the best total score wins.
+    Players play every stage on the connection they registered with: they ask for FLAG_KEEP_ALIVE and exactly
+    stage_rounds rounds, and send the same request again for the next stage once their table is done.
+    A player who is out gets his connection closed.
+    :parameter registration_timeout: seconds registration stays open after the first entrant, the tournament then
+        starts with whoever came (at least 2)
+    :parameter on_round_end: optional callable(client_name, result) notified on every round, like a session's
+    """
+
+    def __init__(self, server_name, entrants, stage_rounds, seats=MAX_SEATS, format="elimination", stages=3,
+                 survivors=0.5, registration_timeout=10.0, decks=1, penetration=0.0, log=None, rng="mt", pool=None,
+                 on_round_end=None):
+        if format not in FORMATS:
+            raise ValueError(f"unknown tournament format {format}, use one of {FORMATS}")
+        self.server_name = server_name
+        self.entrants = max(2, entrants)
+        self.stage_rounds = stage_rounds
+        self.seats = max(1, min(seats, MAX_SEATS))
+        self.format = format
+        self.stages = stages
+        self.survivors = survivors
+        self.registration_timeout = registration_timeout
+        self.table_settings = (decks, penetration, log or default_log, rng, pool)
+        self.log = log or default_log
+        self.on_round_end = on_round_end
+        self.players = []
+        self.standings = Standings()
+        self.closed = False  # registration is over
+        self.registered = threading.Condition()
+
+    def register(self, session, release=None):
+        """
+        Enters the client of a session, from the thread that read his request. Returns False when he may not play:
+        registration is over or his request does not fit the tournament, the caller then closes his connection.
+        Otherwise the tournament owns the connection from now on.
+        :parameter release: callable() called once he is out of the tournament
+        """
+        if session.rounds != self.stage_rounds or not session.flags & FLAG_KEEP_ALIVE:
+            self.log.event(WARNING, "tournament_rejected",
+                           "{client} asked for {rounds} rounds, tournament players ask for {stage_rounds} and keep alive",
+                           client=session.client_name, rounds=session.rounds, stage_rounds=self.stage_rounds)
+            return False
+        with self.registered:
+            if self.closed:
+                return False
+            player = Player(len(self.players), session, release)
+            self.players.append(player)
+            self.standings.add(player.number, session.client_name)
+            session.on_round_end = functools.partial(self._round_end, player.number)
+            session.on_close = functools.partial(self._left_table, player)
+            TOURNAMENT_PLAYERS.inc()
+            self.log.event(INFO, "tournament_registered", "{client} registered ({count}/{entrants})",
+                           client=session.client_name, count=len(self.players), entrants=self.entrants)
+            self.registered.notify_all()
+        return True
+
+    def run(self):
+        """Waits for the entrants and plays the whole tournament, returns the final standings (see Standings.top)."""
+        with self.registered:
+            self.registered.wait_for(lambda: self.players)
+            deadline = time.monotonic() + self.registration_timeout
+            while len(self.players) < self.entrants:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.registered.wait(remaining)
+            self.closed = True
+        players = list(self.players)
+        if len(players) < 2:
+            self.log.event(WARNING, "tournament_cancelled", "Not enough players registered, tournament cancelled")
+            for player in players:
+                self._drop(player)
+            return self.standings.top()
+
+        TOURNAMENTS.inc()
+        self.log.event(INFO, "tournament_start", "{format} tournament starts with {count} players",
+                       format=self.format, count=len(players))
+        stage = 0
+        while players:
+            self._play_stage(stage, players)
+            stage += 1
+            TOURNAMENT_STAGES.inc()
+            for player in players:
+                if not player.finished:
+                    self._drop(player)
+            players = [player for player in players if player.finished]
+            advancing = self._advancing(stage, players)
+            for player in players:
+                if player not in advancing:
+                    self._drop(player, eliminated=bool(advancing))
+            self._log_standings(stage)
+            # whoever goes on already sent his next request, his client did so the moment his table was done
+            players = [player for player in advancing if self._next_stage(player)]
+        standings = self.standings.top()
+        self.log.event(INFO, "tournament_end", "Tournament over, {winner} wins with {score}",
+                       winner=standings[0][1], score=standings[0][2], standings=standings)
+        return standings
+
+    def _advancing(self, stage, players):
+        """Who of the players that finished stage plays the next one, in standings order. Nobody once it is over."""
+        if self.format == "round-robin":
+            return players if stage < self.stages else []
+        if len(players) <= self.seats:
+            return []  # they just played the final
+        playing = {player.number: player for player in players}
+        by_rank = [playing[number] for number, _, _ in self.standings.top() if number in playing]
+        return by_rank[:max(self.seats, math.ceil(len(players) * self.survivors))]
+
+    def _play_stage(self, stage, players):
+        """Seats the players at their tables and plays every table on its own thread until all are done."""
+        threads = []
+        for group in self._tables(stage, players):
+            table = TableGameSession(self.server_name, len(group), *self.table_settings)
+            for player in group:
+                player.finished = False
+                table.join(player.session)
+            threads.append(threading.Thread(target=table.play))
+        self.log.event(INFO, "stage_start", "Stage {stage}: {players} players at {tables} tables", stage=stage + 1,
+                       players=len(players), tables=len(threads))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _tables(self, stage, players):
+        """
+        Splits the players into as few tables as seats allow, as even as possible. Player i sits at table
+        (column + stage * row) % tables where (row, column) = divmod(i, tables): every row moves by a different step
+        each stage, so a round-robin keeps meeting new opponents while no table gets more than one player per row.
+        """
+        count = math.ceil(len(players) / self.seats)
+        tables = [[] for _ in range(count)]
+        for index, player in enumerate(players):
+            row, column = divmod(index, count)
+            tables[(column + stage * row) % count].append(player)
+        return tables
+
+    def _round_end(self, number, client_name, result):
+        """on_round_end of every player's session."""
+        self.standings.update(number, SCORES[result])
+        if self.on_round_end:
+            self.on_round_end(client_name, result)
+
+    def _left_table(self, player):
+        """on_close of every player's session, his table let him go with his connection still open."""
+        player.finished = player.session.rounds_played >= player.session.rounds
+
+    def _next_stage(self, player):
+        """Reads a player's request for the next stage and readies his session, drops him if it does not come."""
+        session = player.session
+        try:
+            request = session._run(session._next_request(NEXT_STAGE_TIMEOUT))
+        except OSError:
+            request = None
+        if request is None or request[0] != self.stage_rounds or not request[2] & FLAG_KEEP_ALIVE:
+            self._drop(player)
+            return False
+        session.reset(*request)
+        self.standings.advance(player.number)
+        return True
+
+    def _drop(self, player, eliminated=True):
+        """
+        The player leaves the tournament: closes his connection and frees his slot.
+        :parameter eliminated: False when the tournament is just over for him
+        """
+        if eliminated:
+            ELIMINATED.inc()
+        TOURNAMENT_PLAYERS.dec()
+        self.log.event(INFO, "tournament_out", "{client} leaves the tournament at rank {rank}",
+                       client=player.session.client_name, rank=self.standings.rank(player.number), eliminated=eliminated)
+        try:
+            player.session.client_socket.close()
+        except OSError:
+            pass
+        if player.release:
+            player.release()
+
+    def _log_standings(self, stage):
+        if self.log.enabled_for(INFO):
+            self.log.event(INFO, "stage_end", "Standings after stage {stage}:\n{table}", stage=stage,
+                           table="\n".join(f"{rank:>4}. {name} {score:+d}"
+                                           for rank, (_, name, score) in enumerate(self.standings.top(), 1)),
+                           standings=self.standings.top())
@@ -0,0 +1,85 @@
+from AdmissionController import AdmissionController
+
+
+def submit(controller, started, ip, name):
+    """Submits a connection that appends its name to started once it may play."""
+    return controller.submit(ip, lambda: started.append(name))
+
+
+def test_free_slots_start_at_once():
+    controller = AdmissionController(max_sessions=2)
+    started = []
+    assert submit(controller, started, "10.0.0.1", "a")
+    assert submit(controller, started, "10.0.0.2", "b")
+    assert started == ["a", "b"] and controller.active == 2
+
+
+def test_waiting_connections_get_freed_slots_in_fifo_order():
+    controller = AdmissionController(max_sessions=1, max_pending=3)
+    started = []
+    for number, name in enumerate("abcd"):
+        assert submit(controller, started, f"10.0.0.{number}", name)
+    assert started == ["a"] and len(controller.pending) == 3
+    controller.release("10.0.0.0")
+    assert started == ["a", "b"]
+    controller.release("10.0.0.1")
+    controller.release("10.0.0.2")
+    assert started == ["a", "b", "c", "d"]
+    assert controller.active == 1  # the slot passed on every time, it was never given back
+    controller.release("10.0.0.3")
+    assert controller.active == 0 and not controller.pending
+
+
+def test_full_queue_rejects_and_frees_nothing():
+    controller = AdmissionController(max_sessions=1, max_pending=1)
+    started = []
+    assert submit(controller, started, "10.0.0.1", "a")
+    assert submit(controller, started, "10.0.0.2", "b")
+    assert not submit(controller, started, "10.0.0.3", "c")
+    assert started == ["a"] and "10.0.0.3" not in controller.per_ip
+
+
+def test_no_pending_queue_rejects_as_soon_as_every_slot_is_busy():
+    controller = AdmissionController(max_sessions=1)
+    started = []
+    assert submit(controller, started, "10.0.0.1", "a")
+    assert not submit(controller, started, "10.0.0.2", "b")
+
+
+def test_per_ip_limit_counts_playing_and_waiting_connections():
+    controller = AdmissionController(max_sessions=1, max_pending=5, max_per_ip=2)
+    started = []
+    assert submit(controller, started, "10.0.0.1", "playing")
+    assert submit(controller, started, "10.0.0.1", "waiting")
+    assert not submit(controller, started, "10.0.0.1", "third")
+    assert submit(controller, started, "10.0.0.2", "other address")
+    controller.release("10.0.0.1")  # "playing" is done, "waiting" takes its slot
+    assert started == ["playing", "waiting"]
+    assert submit(controller, started, "10.0.0.1", "third")
+    controller.release("10.0.0.1")
+    controller.release("10.0.0.2")
+    controller.release("10.0.0.1")
+    assert controller.per_ip == {}
+
+
+def test_limits_of_zero_are_off():
+    controller = AdmissionController()
+    started = []
+    for number in range(100):
+        assert submit(controller, started, "10.0.0.1", number)
+    assert len(started) == 100 and not controller.pending
+
+
+def test_timeout_shrinks_with_load():
+    controller = AdmissionController(max_sessions=4, max_pending=1, min_timeout_fraction=0.25)
+    started = []
+    assert controller.timeout(10.0) == 10.0
+    for number in range(2):
+        submit(controller, started, f"10.0.0.{number}", number)
+    assert controller.timeout(10.0) == 10.0  # half of the slots busy
+    submit(controller, started, "10.0.0.2", 2)
+    assert 2.5 < controller.timeout(10.0) < 10.0
+    submit(controller, started, "10.0.0.3", 3)
+    assert controller.timeout(10.0) == 2.5
+    submit(controller, started, "10.0.0.4", 4)  # waits, which keeps the timeouts at their shortest
+    assert controller.timeout(10.0) == 2.5
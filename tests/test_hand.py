@@ -0,0 +1,66 @@
+from Deck import CARD_VALUE
+from Hand import Hand, add_card
+
+# a card code of every rank, code = (rank - 1) * 4 + suit
+ACE, TWO, FIVE, SIX, NINE, KING = 0, 4, 16, 20, 32, 48
+
+
+def hand_of(*cards):
+    hand = Hand()
+    for card in cards:
+        hand.add(card)
+    return hand
+
+
+def test_ace_counts_as_eleven_until_it_would_bust():
+    hand = hand_of(ACE, SIX)
+    assert (hand.total, hand.soft) == (17, 1)
+    hand.add(NINE)
+    assert (hand.total, hand.soft, hand.busted) == (16, 0, False)
+
+
+def test_two_aces_make_a_soft_twelve():
+    hand = hand_of(ACE, ACE)
+    assert (hand.total, hand.soft, hand.busted) == (12, 1, False)
+
+
+def test_ace_on_a_soft_twenty_one_demotes_both_aces():
+    # soft 21 with two aces counting 11 for a moment, the new ace must push both down to 1
+    assert add_card(21, 1, 11) == (12, 0)
+    hand = hand_of(ACE, NINE, ACE)
+    assert (hand.total, hand.soft) == (21, 1)
+    hand.add(ACE)
+    assert (hand.total, hand.soft, hand.busted) == (12, 0, False)
+
+
+def test_blackjack_only_with_the_first_two_cards():
+    assert hand_of(ACE, KING).blackjack
+    three_cards = hand_of(FIVE, SIX, KING)
+    assert three_cards.total == 21 and not three_cards.blackjack
+
+
+def test_hard_hand_busts_over_twenty_one():
+    hand = hand_of(KING, SIX, SIX)
+    assert (hand.total, hand.soft, hand.busted) == (22, 0, True)
+
+
+def test_clear_reuses_the_hand():
+    hand = hand_of(ACE, KING)
+    cards = hand.cards
+    hand.clear()
+    assert (hand.total, hand.soft, hand.blackjack, hand.busted) == (0, 0, False, False)
+    assert hand.cards is cards and not cards
+    hand.add(TWO)
+    assert hand.total == 2
+
+
+def test_total_matches_counting_aces_the_slow_way():
+    # every two and three card hand against the textbook rule: count aces as 1, add 10 once if that does not bust
+    for first in range(0, 52, 4):
+        for second in range(0, 52, 4):
+            for third in range(0, 52, 4):
+                cards = (first, second, third)
+                hard = sum(1 if CARD_VALUE[card] == 11 else CARD_VALUE[card] for card in cards)
+                has_ace = any(CARD_VALUE[card] == 11 for card in cards)
+                expected = hard + 10 if has_ace and hard + 10 <= 21 else hard
+                assert hand_of(*cards).total == expected
@@ -0,0 +1,103 @@
+from EventLog import EventLog, OFF
+from HandHistory import HandHistoryWriter, HandHistoryReader, HEADER, replay
+from Protocol import (HIT_PAYLOAD, STAND_PAYLOAD, MAX_ROUNDS, request_Message, request_extension_size,
+                      unpack_request_ext)
+from ServerGameSession import ServerGameSession, SEND
+
+QUIET = EventLog(OFF)
+
+
+def record_session(writer, rounds, name, seed, decks=1, penetration=0.0, stop_after=None):
+    """
+    Plays a session that hits below 15 and records it with writer, like a server does.
+    stop_after decisions the client disconnects in the middle of a round. Returns the session's per round results.
+    """
+    results = []
+    game = ServerGameSession(None, rounds, name, "dealer", on_round_end=lambda _, result: results.append(result),
+                             decks=decks, penetration=penetration, log=QUIET, seed=seed, history=writer)
+    steps = game._game()
+    reply = None
+    decisions = 0
+    while True:
+        try:
+            op = steps.send(reply)
+        except StopIteration:
+            return results
+        reply = None
+        if op[0] == SEND:
+            continue
+        if decisions == stop_after:
+            steps.close()  # the session's finally records it like any other failed session
+            return results
+        decisions += 1
+        reply = HIT_PAYLOAD if game.client_hand.total < 15 else STAND_PAYLOAD
+
+
+def test_recorded_sessions_read_back_and_replay(tmp_path):
+    path = str(tmp_path / "hands.bjhh")
+    writer = HandHistoryWriter(path)
+    played = [record_session(writer, 20, "alice", seed=1),
+              record_session(writer, 30, "bøb", seed=2, decks=6, penetration=0.75),
+              record_session(writer, 10, "carol", seed=3, stop_after=4)]
+    writer.close()
+
+    reader = HandHistoryReader(path)
+    sessions = list(reader)
+    assert len(sessions) == 3
+    for history, results, (rounds, name, seed, decks, penetration) in zip(
+            sessions, played, ((20, "alice", 1, 1, 0.0), (30, "bøb", 2, 6, 0.75), (10, "carol", 3, 1, 0.0))):
+        assert history.fields[0] == seed and history.fields[2:] == (decks, penetration, 0, rounds, name)
+        assert history.client_name == name and history.rng_kind == "mt"
+        recorded = list(history.rounds())
+        # an unfinished round is recorded with result 0, the results that did come in match what the server counted
+        assert [result for result, _, _ in recorded if result] == results
+        assert all(2 <= len(cards) for _, cards, _ in recorded)
+        assert bytes(replay(history).data) == bytes(history.rounds_data)
+    assert sum(1 for _ in sessions[2].rounds()) == len(played[2]) + 1  # the round he left in the middle of
+    del sessions, history
+    reader.close()
+
+
+def test_writer_appends_to_an_existing_file(tmp_path):
+    path = str(tmp_path / "hands.bjhh")
+    for seed in (1, 2):
+        writer = HandHistoryWriter(path)
+        record_session(writer, 5, "alice", seed=seed)
+        writer.close()
+    with open(path, 'rb') as file:
+        assert file.read().count(HEADER) == 1
+    reader = HandHistoryReader(path)
+    assert [history.fields[0] for history in reader] == [1, 2]
+    reader.close()
+
+
+def test_record_cut_short_ends_the_scan(tmp_path):
+    path = str(tmp_path / "hands.bjhh")
+    writer = HandHistoryWriter(path)
+    record_session(writer, 5, "alice", seed=1)
+    record_session(writer, 5, "bob", seed=2)
+    writer.close()
+    with open(path, 'r+b') as file:
+        file.truncate(file.seek(0, 2) - 3)  # a crash in the middle of writing the last record
+    reader = HandHistoryReader(path)
+    assert [history.client_name for history in reader] == ["alice"]
+    reader.close()
+
+
+def test_sessions_over_255_rounds(tmp_path):
+    # the wide request carries the rounds in 16 bits, the history's rounds fields are 16 bits as well
+    for rounds in (255, 256, 300, MAX_ROUNDS):
+        packet = request_Message(rounds, "alice")
+        assert len(packet) == 38 + request_extension_size(packet[:38])
+        assert unpack_request_ext(packet) == (rounds, "alice", 0)
+    path = str(tmp_path / "hands.bjhh")
+    writer = HandHistoryWriter(path)
+    results = record_session(writer, 300, "alice", seed=4)
+    writer.close()
+    reader = HandHistoryReader(path)
+    (history,) = reader
+    assert len(results) == 300 and history.fields[5] == 300
+    assert [result for result, _, _ in history.rounds()] == results
+    assert bytes(replay(history).data) == bytes(history.rounds_data)
+    del history
+    reader.close()
@@ -0,0 +1,34 @@
+import Metrics as metrics_module
+from Metrics import Metrics
+
+
+def test_readers_keep_their_own_rate_baseline(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(metrics_module.time, "monotonic", lambda: clock[0])
+    registry = Metrics()
+    rounds = registry.counter("rounds")
+    rounds.inc(10)
+    clock[0] = 110.0
+    _, endpoint = registry.snapshot()
+    rounds.inc(5)
+    clock[0] = 115.0
+    _, snapshot_file = registry.snapshot()
+    # the snapshot file reading in between does not move the endpoint's baseline
+    rounds.inc(1)
+    clock[0] = 120.0
+    since_endpoint, _ = registry.snapshot(endpoint)
+    since_file, _ = registry.snapshot(snapshot_file)
+    assert since_endpoint["rounds_per_sec"] == 6 / 10
+    assert since_file["rounds_per_sec"] == 1 / 5
+
+
+def test_first_snapshot_counts_from_the_start(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(metrics_module.time, "monotonic", lambda: clock[0])
+    registry = Metrics()
+    registry.counter("rounds").inc(4)
+    clock[0] = 2.0
+    first, _ = registry.snapshot()
+    second, _ = registry.snapshot()
+    # a reader without a baseline does not reset anything for the next one
+    assert first["rounds_per_sec"] == second["rounds_per_sec"] == 2.0
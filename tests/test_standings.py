@@ -0,0 +1,65 @@
+import random
+from Tournament import Standings
+
+
+def standings_of(*names):
+    standings = Standings()
+    for number, name in enumerate(names):
+        standings.add(number, name)
+    return standings
+
+
+def test_registration_order_breaks_ties():
+    standings = standings_of("ann", "bob", "cy")
+    assert standings.top() == [(0, "ann", 0), (1, "bob", 0), (2, "cy", 0)]
+    standings.update(2, 3)
+    standings.update(0, 3)
+    assert [number for number, _, _ in standings.top()] == [0, 2, 1]
+
+
+def test_scores_move_players_both_ways():
+    standings = standings_of("ann", "bob", "cy")
+    standings.update(1, 5)
+    standings.update(2, 2)
+    assert standings.rank(1) == 1 and standings.rank(2) == 2 and standings.rank(0) == 3
+    standings.update(1, -10)
+    assert standings.top() == [(2, "cy", 2), (0, "ann", 0), (1, "bob", -5)]
+
+
+def test_reaching_the_next_stage_beats_any_score():
+    standings = standings_of("ann", "bob")
+    standings.update(0, 100)
+    standings.advance(1)
+    assert standings.rank(1) == 1
+    assert standings.top(1) == [(1, "bob", 0)]
+    standings.advance(0)
+    assert standings.rank(0) == 1  # same stage again, so the score decides
+
+
+def test_zero_points_change_nothing():
+    standings = standings_of("ann", "bob")
+    standings.update(1, 0)
+    assert standings.top() == [(0, "ann", 0), (1, "bob", 0)]
+    assert len(standings) == 2
+
+
+def test_matches_sorting_everybody_again():
+    rng = random.Random(7)
+    standings = Standings()
+    stages, scores = {}, {}
+    for number in range(40):
+        standings.add(number, f"bot{number}")
+        stages[number], scores[number] = 0, 0
+    for _ in range(2000):
+        number = rng.randrange(40)
+        if rng.random() < 0.05:
+            standings.advance(number)
+            stages[number] += 1
+        else:
+            points = rng.randint(-3, 3)
+            standings.update(number, points)
+            scores[number] += points
+    expected = sorted(stages, key=lambda number: (-stages[number], -scores[number], number))
+    assert [number for number, _, _ in standings.top()] == expected
+    assert [standings.rank(number) for number in expected] == list(range(1, 41))
+    assert [score for _, _, score in standings.top()] == [scores[number] for number in expected]
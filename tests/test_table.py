@@ -0,0 +1,79 @@
+from EventLog import EventLog, OFF
+from Protocol import STAND_PAYLOAD, FLAG_TABLE_RESULTS, unpack_table_result
+from ServerGameSession import ServerGameSession, SEND
+from TableGameSession import TableGameSession, SEAT_FAILURES
+
+QUIET = EventLog(OFF)
+
+
+def run_steps(seat, steps, broken):
+    """Drives one seat's round steps like TableGameSession.play, a broken seat fails on its first frame."""
+    reply = None
+    while True:
+        try:
+            op = steps.send(reply)
+        except StopIteration as done:
+            return done.value
+        if seat in broken:
+            raise ConnectionError("broken pipe")
+        reply = None if op[0] == SEND else STAND_PAYLOAD
+
+
+def play_round(table, broken=()):
+    """Plays one round of the table, returns every seat in the order the table asked to drive it."""
+    driven = []
+    round_steps = table._play_round()
+    reply = None
+    while True:
+        try:
+            seat, steps, flush = round_steps.send(reply)
+        except StopIteration:
+            return driven
+        driven.append(seat)
+        try:
+            reply = run_steps(seat, steps, broken)
+        except Exception as error:
+            reply = table._fail(seat, error)
+
+
+def make_table(seats, rounds=3):
+    table = TableGameSession("dealer", seats, log=QUIET)
+    sessions = [ServerGameSession(None, rounds, f"seat{number}", "dealer", log=QUIET) for number in range(seats)]
+    for session in sessions:
+        assert table.join(session)
+    table._update_seats()
+    return table, sessions
+
+
+def test_every_seat_plays_the_round():
+    table, sessions = make_table(3)
+    play_round(table)
+    assert all(session.rounds_played == 1 for session in sessions)
+
+
+def test_failed_seat_sits_out_the_rest_of_the_round():
+    table, (first, broken, last) = make_table(3)
+    failures = SEAT_FAILURES.value
+    driven = play_round(table, broken={broken})
+    # it failed on its first card and is never driven again, so it fails and is counted once
+    assert driven.count(broken) == 1
+    assert SEAT_FAILURES.value == failures + 1
+    assert broken.rounds_played == 0
+    assert first.rounds_played == last.rounds_played == 1
+    # and it leaves the table before the next round
+    table._update_seats()
+    assert table.seats == [first, last]
+
+
+def test_seats_that_ask_get_the_other_seats_results():
+    table, (first, broken, last) = make_table(3)
+    first.flags = FLAG_TABLE_RESULTS
+    play_round(table, broken={broken})
+    # the test driver sends nothing, so the queued frames are exactly the table results
+    frames = first.frames.take()
+    results = [unpack_table_result(frames[start:start + 9]) for start in range(0, len(frames), 9)]
+    # the failed seat left without a result, the other one stood and was settled against the dealer
+    assert [(seat, seats) for _, seat, seats in results] == [(2, 3), (3, 3)]
+    assert results[0][0] == 0
+    assert results[1][0] in (1, 2, 3)
+    assert last.frames.size == 0
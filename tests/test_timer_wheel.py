@@ -0,0 +1,59 @@
+from SessionScheduler import TimerWheel
+
+
+def make_wheel(tick=0.1, slots=8):
+    wheel = TimerWheel(tick, slots)
+    wheel.started = 0.0  # we pass our own clock to advance
+    return wheel
+
+
+def expiry(wheel, entry, step=0.01, until=100.0):
+    """Advances wheel in small steps until entry expires, returns when it did (None if it never did)."""
+    now = 0.0
+    while now < until:
+        now += step
+        if entry in wheel.advance(now):
+            return now
+    return None
+
+
+def test_timeout_fires_not_before_it_is_due_and_at_most_a_tick_late():
+    for timeout in (0.05, 0.1, 0.35, 0.8):
+        wheel = make_wheel()
+        wheel.schedule("wait", timeout)
+        fired = expiry(wheel, "wait")
+        assert timeout - 1e-9 <= fired <= timeout + wheel.tick + 0.011
+
+
+def test_timeouts_longer_than_the_wheel_wait_extra_rotations():
+    wheel = make_wheel(tick=0.1, slots=8)  # one rotation is 0.8 seconds
+    wheel.schedule("long", 2.05)
+    fired = expiry(wheel, "long")
+    assert 2.05 - 1e-9 <= fired <= 2.05 + wheel.tick + 0.011
+
+
+def test_cancelled_timeout_never_fires():
+    wheel = make_wheel()
+    slot = wheel.schedule("wait", 0.3)
+    wheel.schedule("other", 0.3)
+    wheel.cancel("wait", slot)
+    wheel.cancel("missing", slot)  # cancelling what is not there is harmless
+    assert wheel.advance(1.0) == ["other"]
+    assert wheel.advance(100.0) == []
+
+
+def test_one_advance_collects_every_due_entry_once():
+    wheel = make_wheel()
+    for entry, timeout in (("a", 0.1), ("b", 0.2), ("c", 0.5), ("d", 3.0)):
+        wheel.schedule(entry, timeout)
+    assert sorted(wheel.advance(0.45)) == ["a", "b"]
+    assert wheel.advance(0.55) == ["c"]
+    assert wheel.advance(3.2) == ["d"]
+    assert wheel.advance(10.0) == []
+
+
+def test_zero_timeout_waits_one_tick():
+    wheel = make_wheel()
+    wheel.schedule("now", 0.0)
+    assert wheel.advance(0.05) == []
+    assert wheel.advance(0.1) == ["now"]